@@ -0,0 +1,34 @@
+"""Micro-benchmark of the CAN-Id decoding per received frame
+
+Compares the decoding with MessageId and ParameterGroupNumber objects, as
+done by the data link layers before, with :func:`j1939.decode_can_id`.
+
+    PYTHONPATH=. python benchmarks/bench_decode_can_id.py
+"""
+import timeit
+
+from j1939 import MessageId, ParameterGroupNumber, decode_can_id
+
+CAN_IDS = [0x18FEF101, 0x0CF00400, 0x18EC9B90, 0x1CEBFF01, 0x18EAFF00, 0x19FECA03]
+
+def decode_objects():
+    for can_id in CAN_IDS:
+        mid = MessageId(can_id=can_id)
+        pgn = ParameterGroupNumber()
+        pgn.from_message_id(mid)
+        if pgn.is_pdu2_format:
+            result = (mid.priority, pgn.value, mid.source_address, ParameterGroupNumber.Address.GLOBAL, True)
+        else:
+            result = (mid.priority, pgn.value & 0x1FF00, mid.source_address, pgn.pdu_specific, False)
+
+def decode_function():
+    for can_id in CAN_IDS:
+        result = decode_can_id(can_id)
+
+def main(number=100000):
+    for name, func in (('MessageId/ParameterGroupNumber', decode_objects), ('decode_can_id', decode_function)):
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print('{:32s} {:8.3f} us/frame'.format(name, seconds / (number * len(CAN_IDS)) * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+"""Benchmark suite of the receive dispatch, the transport protocols and the diagnostic messages
+
+The ECUs are connected by an in-memory loopback bus, no CAN interface is required.
+Each benchmark is repeated and the best run is reported. The results are saved as
+JSON together with the python version, the platform and the git commit, so the
+results of different commits can be compared:
+
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --output before.json
+    PYTHONPATH=. python benchmarks/run_benchmarks.py --output after.json --compare before.json
+
+Benchmarks:
+
+* rx_single_frame: frames/s through :meth:`ElectronicControlUnit.notify` for single frame PGNs
+* tp_reassembly_bam, tp_reassembly_rts_cts: receive throughput of recorded transport protocol sessions
+* tp_transmission_bam, tp_transmission_rts_cts: transfers/s between two ECUs over the loopback bus
+* multi_pg_pack, multi_pg_unpack: c-PGs/s packed into and unpacked from J1939-22 multi-PG frames
+* dm1_encode, dm1_decode: DM1 messages/s with 1 and 10 DTCs
+* dm14_read, dm14_write: DM14 round trips/s between a query and a server ECU
+"""
+import argparse
+import datetime
+import json
+import platform
+import queue
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import j1939
+
+DATA_LINK_LAYERS = ('j1939-21', 'j1939-22')
+
+# source address of the sending ECU and address of the receiving CA
+SENDER_ADDRESS = 0x80
+RECEIVER_ADDRESS = 0x90
+
+# payload size of the transport protocol sessions, the maximum of J1939-21
+TP_MESSAGE_SIZE = 1785
+
+
+class Loopback:
+    """In-memory CAN bus connecting ECUs
+
+    The frames sent by an ECU are delivered to all other attached ECUs by a single
+    delivery thread, like the receive thread of a :class:`can.Notifier`.
+    """
+
+    def __init__(self, record=False):
+        """
+        :param bool record:
+            if True, all sent frames are stored in :attr:`frames` as tuples
+            (index of the sending ECU, CAN-ID, data).
+        """
+        self._ecus = []
+        self._queue = queue.SimpleQueue()
+        self.frames = [] if record else None
+        self._thread = threading.Thread(target=self._deliver, daemon=True)
+        self._thread.start()
+
+    def attach(self, ecu):
+        """Connects an ECU to the loopback bus
+
+        :return:
+            index of the ECU
+        """
+        index = len(self._ecus)
+        self._ecus.append(ecu)
+
+        def send_message(can_id, extended_id, data, fd_format=False):
+            data = bytes(data)
+            if self.frames is not None:
+                self.frames.append((index, can_id, data))
+            self._queue.put((index, can_id, data))
+
+        ecu.send_message = send_message
+        return index
+
+    def close(self):
+        """Stops the delivery thread"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _deliver(self):
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            index, can_id, data = frame
+            now = time.time()
+            for receiver, ecu in enumerate(self._ecus):
+                if receiver != index:
+                    ecu.notify(can_id, bytearray(data), now)
+
+
+class PayloadCapture:
+    """Stand-in for a :class:`j1939.ControllerApplication` keeping the last sent payload
+
+    Isolates the encoding of the diagnostic messages from the transport protocol.
+    """
+
+    def __init__(self):
+        self.data = None
+
+    def subscribe(self, callback):
+        pass
+
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, data, time_limit=0, frame_format=None):
+        self.data = data
+        return True
+
+
+def best_of(repeat, run):
+    """Runs a benchmark repeatedly
+
+    :param int repeat:
+        number of runs
+    :param run:
+        callable returning (number of operations, duration in seconds)
+    :return:
+        dict with the number of operations per run and the best and median rate in operations/s
+    """
+    rates = []
+    operations = 0
+    for _ in range(repeat):
+        operations, duration = run()
+        rates.append(operations / duration)
+    return {'operations': operations, 'best': max(rates), 'median': statistics.median(rates)}
+
+
+def create_ecu(data_link_layer, send_message=None, address=None, **kwargs):
+    ecu = j1939.ElectronicControlUnit(data_link_layer, send_message=send_message, **kwargs)
+    ca = None
+    if address is not None:
+        ca = j1939.ControllerApplication(None, address, bypass_address_claim=True)
+        ecu.add_ca(controller_application=ca)
+        ca.start()
+    return ecu, ca
+
+
+def bench_rx_single_frame(data_link_layer, frames, repeat):
+    ecu, _ = create_ecu(data_link_layer, send_message=lambda *args, **kwargs: None)
+    received = [0]
+
+    def on_message(priority, pgn, sa, timestamp, data):
+        received[0] += 1
+
+    ecu.subscribe(on_message)
+    if data_link_layer == 'j1939-21':
+        pgns = (0xF004, 0xFEF1, 0xFEEE, 0xFEF2, 0xFEEF, 0xFECA)
+        messages = [(0x0C000000 | (pgn << 8) | sa, bytearray(range(8))) for pgn in pgns for sa in range(8)]
+    else:
+        # single c-PG in a multi-pg frame, the only single frame format of J1939-22
+        messages = [(0x0C000000 | (j1939.ParameterGroupNumber.PGN.FEFF_MULTI_PG << 8) | 0xFF00 | sa,
+                     bytearray([0x40 | ((pgn >> 16) & 0x3), (pgn >> 8) & 0xFF, pgn & 0xFF, 8]) + bytearray(range(8)) + bytearray(4))
+                    for pgn in (0xF004, 0xFEF1, 0xFEEE, 0xFEF2, 0xFEEF, 0xFECA) for sa in range(8)]
+    messages = (messages * (frames // len(messages) + 1))[:frames]
+
+    def run():
+        received[0] = 0
+        notify = ecu.notify
+        start = time.perf_counter()
+        for can_id, data in messages:
+            notify(can_id, data, 0.0)
+        duration = time.perf_counter() - start
+        assert received[0] == frames
+        return frames, duration
+
+    try:
+        return dict(best_of(repeat, run), unit='frames/s')
+    finally:
+        ecu.stop()
+
+
+def transfer(loopback, sender, receiver_done, sends):
+    """Sends PDUs one after the other and waits for the completion of each
+
+    :return:
+        duration in seconds
+    """
+    completed = threading.Event()
+    start = time.perf_counter()
+    for send in sends:
+        completed.clear()
+        receiver_done.clear()
+        # the send buffer of the previous session is released by the job thread after its completion
+        while not send(lambda success: completed.set()):
+            time.sleep(0.0001)
+        if not (completed.wait(5) and receiver_done.wait(5)):
+            raise RuntimeError("transfer did not complete")
+    return time.perf_counter() - start
+
+
+def create_pair(data_link_layer, record=False):
+    """Creates a sending and a receiving ECU connected by a loopback bus"""
+    loopback = Loopback(record)
+    sender, _ = create_ecu(data_link_layer, address=SENDER_ADDRESS, max_cmdt_packets=255, minimum_tp_bam_dt_interval=0)
+    receiver, _ = create_ecu(data_link_layer, address=RECEIVER_ADDRESS, max_cmdt_packets=255)
+    loopback.attach(sender)
+    loopback.attach(receiver)
+    receiver_done = threading.Event()
+    receiver.subscribe(lambda priority, pgn, sa, timestamp, data: receiver_done.set() if len(data) == TP_MESSAGE_SIZE else None)
+    return loopback, sender, receiver, receiver_done
+
+
+def tp_send(sender, destination, payload):
+    return lambda on_complete: sender.send_pgn(0, 0xEF, destination, 7, SENDER_ADDRESS, payload, on_complete=on_complete)
+
+
+def bench_tp_reassembly(data_link_layer, destination, sessions, repeat):
+    # record the frames of one session
+    loopback, sender, receiver, receiver_done = create_pair(data_link_layer, record=True)
+    try:
+        transfer(loopback, sender, receiver_done, [tp_send(sender, destination, bytes(TP_MESSAGE_SIZE))])
+    finally:
+        loopback.close()
+        sender.stop()
+        receiver.stop()
+    frames = [(can_id, data) for index, can_id, data in loopback.frames if index == 0]
+
+    # replay the recorded frames of the sender, the frames sent by the receiver are dropped
+    ecu, _ = create_ecu(data_link_layer, send_message=lambda *args, **kwargs: None, address=RECEIVER_ADDRESS)
+    received = [0]
+
+    def on_message(priority, pgn, sa, timestamp, data):
+        received[0] += len(data) == TP_MESSAGE_SIZE
+
+    ecu.subscribe(on_message)
+    replay = [(can_id, bytearray(data)) for can_id, data in frames] * sessions
+
+    def run():
+        received[0] = 0
+        notify = ecu.notify
+        start = time.perf_counter()
+        for can_id, data in replay:
+            notify(can_id, data, 0.0)
+        duration = time.perf_counter() - start
+        assert received[0] == sessions
+        return sessions, duration
+
+    try:
+        result = best_of(repeat, run)
+    finally:
+        ecu.stop()
+    return dict(result, unit='sessions/s', frames_per_session=len(frames), bytes_per_s=result['best'] * TP_MESSAGE_SIZE)
+
+
+def bench_tp_transmission(data_link_layer, destination, sessions, repeat):
+    loopback, sender, receiver, receiver_done = create_pair(data_link_layer)
+    sends = [tp_send(sender, destination, bytes(TP_MESSAGE_SIZE))] * sessions
+    try:
+        result = best_of(repeat, lambda: (sessions, transfer(loopback, sender, receiver_done, sends)))
+    finally:
+        loopback.close()
+        sender.stop()
+        receiver.stop()
+    return dict(result, unit='sessions/s', bytes_per_s=result['best'] * TP_MESSAGE_SIZE)
+
+
+def bench_multi_pg(c_pgs, repeat):
+    loopback = Loopback(record=True)
+    sender, _ = create_ecu('j1939-22')
+    receiver, _ = create_ecu('j1939-22', send_message=lambda *args, **kwargs: None)
+    loopback.attach(sender)
+    loopback.attach(receiver)
+    received = [0]
+    all_received = threading.Event()
+
+    def on_message(priority, pgn, sa, timestamp, data):
+        received[0] += 1
+        if received[0] == c_pgs:
+            all_received.set()
+
+    receiver.subscribe(on_message)
+    pgns = [0xFF00 | (index % 0x100) for index in range(c_pgs)]
+    payload = bytes(range(8))
+
+    # packing: c-PGs with a time limit are collected in multi-pg frames by the job thread,
+    # full frames are sent immediately and the time limit only delays the last frame.
+    # The time limit is long enough that the job thread does not send a frame while it is filled.
+    def pack():
+        received[0] = 0
+        all_received.clear()
+        del loopback.frames[:]
+        send_pgn = sender.send_pgn
+        start = time.perf_counter()
+        for pgn in pgns:
+            send_pgn(0, pgn >> 8, pgn & 0xFF, 6, SENDER_ADDRESS, payload, time_limit=0.01)
+        if not all_received.wait(5):
+            raise RuntimeError("multi-pg frames not received")
+        return c_pgs, time.perf_counter() - start
+
+    try:
+        pack_result = best_of(repeat, pack)
+    finally:
+        loopback.close()
+        sender.stop()
+    frames = [(can_id, bytearray(data)) for index, can_id, data in loopback.frames]
+
+    # unpacking of the recorded multi-pg frames
+    def unpack():
+        received[0] = 0
+        notify = receiver.notify
+        start = time.perf_counter()
+        for can_id, data in frames:
+            notify(can_id, data, 0.0)
+        duration = time.perf_counter() - start
+        assert received[0] == c_pgs
+        return c_pgs, duration
+
+    try:
+        unpack_result = best_of(repeat, unpack)
+    finally:
+        receiver.stop()
+    return (dict(pack_result, unit='c-PGs/s', c_pgs_per_frame=c_pgs / len(frames)),
+            dict(unpack_result, unit='c-PGs/s', c_pgs_per_frame=c_pgs / len(frames)))
+
+
+def bench_dm1(dtcs, messages, repeat):
+    lamps = {'pl': j1939.DtcLamp.OFF, 'awl': j1939.DtcLamp.ON, 'rsl': j1939.DtcLamp.OFF, 'mil': j1939.DtcLamp.ON_SLOW_FLASH}
+    dtc_list = [{'spn': 100 + index, 'fmi': index % 32, 'oc': index % 127} for index in range(dtcs)]
+    capture = PayloadCapture()
+    encoder = j1939.Dm1(capture)
+    cookie = {'cb': lambda: (lamps, [dict(dtc) for dtc in dtc_list])}
+
+    def encode():
+        send = encoder._send
+        start = time.perf_counter()
+        for _ in range(messages):
+            send(cookie)
+        return messages, time.perf_counter() - start
+
+    encode_result = best_of(repeat, encode)
+    payload = bytes(capture.data)
+
+    decoder = j1939.Dm1(PayloadCapture())
+    decoded = []
+    decoder.subscribe(lambda sa, lamp_status, dtc_dic_list, timestamp: decoded.append(len(dtc_dic_list)))
+
+    def decode():
+        del decoded[:]
+        receive = decoder._receive
+        start = time.perf_counter()
+        for _ in range(messages):
+            receive(6, j1939.ParameterGroupNumber.PGN.DM01, SENDER_ADDRESS, 0.0, payload)
+        duration = time.perf_counter() - start
+        assert decoded == [dtcs] * messages
+        return messages, duration
+
+    decode_result = best_of(repeat, decode)
+    return dict(encode_result, unit='messages/s', payload_size=len(payload)), dict(decode_result, unit='messages/s', payload_size=len(payload))
+
+
+def bench_dm14(command, round_trips, repeat):
+    # each command uses its own pair of ECUs, the server does not expect a write after a read of the same query
+    loopback = Loopback()
+    query_ecu, query_ca = create_ecu('j1939-21', address=0xF9)
+    server_ecu, server_ca = create_ecu('j1939-21', address=0xD4)
+    loopback.attach(query_ecu)
+    loopback.attach(server_ecu)
+
+    query = j1939.MemoryAccess(query_ca)
+    server = j1939.MemoryAccess(server_ca)
+    server.set_proceed(lambda *args: True)
+    requested = threading.Event()
+    server.set_notify(requested.set)
+    responded = threading.Event()
+    stop = threading.Event()
+
+    # the server responds from its own thread, the response blocks until the query is finished
+    def serve():
+        while not stop.is_set():
+            if requested.wait(0.1):
+                requested.clear()
+                server.respond(True, [0x5A], 0xFFFF, 0xFF)
+                responded.set()
+
+    server_thread = threading.Thread(target=serve, daemon=True)
+    server_thread.start()
+
+    def run(operation):
+        start = time.perf_counter()
+        for _ in range(round_trips):
+            responded.clear()
+            operation()
+            if not responded.wait(5):
+                raise RuntimeError("DM14 server did not respond")
+        return round_trips, time.perf_counter() - start
+
+    if command == 'read':
+        operation = lambda: query.read(0xD4, 1, 0x92000003, 1)
+    else:
+        operation = lambda: query.write(0xD4, 1, 0x91000007, [0x5A])
+    try:
+        result = best_of(repeat, lambda: run(operation))
+    finally:
+        stop.set()
+        server_thread.join()
+        loopback.close()
+        query_ecu.stop()
+        server_ecu.stop()
+    return dict(result, unit='round trips/s')
+
+
+def run_all(scale, repeat, log):
+    results = {}
+
+    def report(name, result):
+        results[name] = result
+        log('{:40s} {:14,.0f} {}'.format(name, result['best'], result['unit']))
+
+    for data_link_layer in DATA_LINK_LAYERS:
+        report('rx_single_frame[{}]'.format(data_link_layer), bench_rx_single_frame(data_link_layer, 20000 * scale, repeat))
+    for data_link_layer in DATA_LINK_LAYERS:
+        for kind, destination in (('bam', j1939.ParameterGroupNumber.Address.GLOBAL), ('rts_cts', RECEIVER_ADDRESS)):
+            report('tp_reassembly_{}[{}]'.format(kind, data_link_layer), bench_tp_reassembly(data_link_layer, destination, 50 * scale, repeat))
+            report('tp_transmission_{}[{}]'.format(kind, data_link_layer), bench_tp_transmission(data_link_layer, destination, 5 * scale, repeat))
+    pack, unpack = bench_multi_pg(5000 * scale, repeat)
+    report('multi_pg_pack', pack)
+    report('multi_pg_unpack', unpack)
+    for dtcs in (1, 10):
+        encode, decode = bench_dm1(dtcs, 2000 * scale, repeat)
+        report('dm1_encode[{}_dtc]'.format(dtcs), encode)
+        report('dm1_decode[{}_dtc]'.format(dtcs), decode)
+    for command in ('read', 'write'):
+        report('dm14_{}'.format(command), bench_dm14(command, 20 * scale, repeat))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, log):
+    log('')
+    log('{:40s} {:>14s} {:>14s} {:>8s}'.format('change against ' + (baseline['meta'].get('commit') or 'baseline')[:12], 'baseline', 'current', ''))
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        log('{:40s} {:14,.0f} {:14,.0f} {:+7.1f}%'.format(name, before['best'], result['best'], (result['best'] / before['best'] - 1) * 100))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='bench_results.json', help='JSON file the results are written to')
+    parser.add_argument('--compare', metavar='JSON', help='results of an earlier run to compare with')
+    parser.add_argument('--scale', type=int, default=1, help='multiplies the number of operations per run')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per benchmark')
+    args = parser.parse_args(argv)
+
+    results = run_all(args.scale, args.repeat, print)
+    document = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'j1939': j1939.__version__,
+            'python': sys.version,
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(document, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f), print)
+
+if __name__ == '__main__':
+    main()
@@ -56,8 +56,6 @@ class Dm14Query:
             self.state = QueryState.WAIT_FOR_OPER_COMPLETE
         else:
             self.state = QueryState.WAIT_FOR_DM16
-            self._ca.unsubscribe(self._parse_dm15)
-            self._ca.subscribe(self._parse_dm16)
 
     def _send_operation_complete(self) -> None:
         """
@@ -116,6 +114,8 @@ class Dm14Query:
         """
         if pgn != j1939.ParameterGroupNumber.PGN.DM15 or sa != self._dest_address:
             return
+        if self.state is QueryState.WAIT_FOR_DM16:
+            return
         seed = (data[7] << 8) + data[6]
         status = (data[1] >> 1) & 7
         if (
@@ -173,11 +173,11 @@ class Dm14Query:
         """
         if pgn != j1939.ParameterGroupNumber.PGN.DM16 or sa != self._dest_address:
             return
+        if self.state is not QueryState.WAIT_FOR_DM16:
+            return
         length = min(data[0], len(data) - 1)
         # assert object_count == self.object_count
         self.mem_data = data[1 : length + 1]
-        self._ca.unsubscribe(self._parse_dm16)
-        self._ca.subscribe(self._parse_dm15)
         self.state = QueryState.WAIT_FOR_OPER_COMPLETE
 
     def _values_to_bytes(self, values: list) -> bytearray:
@@ -237,9 +237,9 @@ class Dm14Query:
         self.signed = signed
         self.return_raw_bytes = return_raw_bytes
         self.command = Command.READ
-        self._ca.subscribe(self._parse_dm15)
-        self._send_dm14(self.user_level)
         self.state = QueryState.WAIT_FOR_SEED
+        self._subscribe()
+        self._send_dm14(self.user_level)
         # wait for operation completed DM15 message
         raw_bytes = None
         try:
@@ -248,6 +248,8 @@ class Dm14Query:
             if self.state is QueryState.WAIT_FOR_SEED:
                 raise RuntimeError("No response from server")
             pass
+        finally:
+            self._unsubscribe()
         for _ in range(self.exception_queue.qsize()):
             raise self.exception_queue.get(block=False, timeout=max_timeout)
         if raw_bytes:
@@ -283,9 +285,9 @@ class Dm14Query:
         self.command = Command.WRITE
         self.bytes = self._values_to_bytes(values)
         self.object_count = len(values)
-        self._ca.subscribe(self._parse_dm15)
-        self._send_dm14(self.user_level)
         self.state = QueryState.WAIT_FOR_SEED
+        self._subscribe()
+        self._send_dm14(self.user_level)
         # wait for operation completed DM15 message
         try:
             self.data_queue.get(block=True, timeout=max_timeout)
@@ -295,6 +297,23 @@ class Dm14Query:
             if self.state is QueryState.WAIT_FOR_SEED:
                 raise RuntimeError("No response from server")
             pass  # expect empty queue for write
+        finally:
+            self._unsubscribe()
+
+    def _subscribe(self) -> None:
+        """
+        Add the handlers of a query, they ignore the messages not expected in the current state.
+        The handlers are added and removed by the querying thread, not by the handlers themselves.
+        """
+        self._ca.subscribe(self._parse_dm15)
+        self._ca.subscribe(self._parse_dm16)
+
+    def _unsubscribe(self) -> None:
+        """
+        Remove the handlers of the finished query, a later query subscribes again.
+        """
+        self._ca.unsubscribe(self._parse_dm15)
+        self._ca.unsubscribe(self._parse_dm16)
 
     def set_seed_key_algorithm(self, algorithm: callable) -> None:
         """
@@ -1,8 +1,21 @@
 from .version import __version__
-from .electronic_control_unit import ElectronicControlUnit
+from .electronic_control_unit import ElectronicControlUnit, BusSegment
 from .controller_application import ControllerApplication
+from .async_electronic_control_unit import AsyncElectronicControlUnit, AsyncControllerApplication
+from .subscriber_queue import SubscriberQueue
+from .transmit_scheduler import TransmitScheduler
+from .gateway import RoutingTable
+from .statistics import Statistics
+from .tracing import Tracer
+from .latest_values import LatestValues
+from .replay import VirtualClock, LogReplay
+from .stream_decoder import decode_stream
+from .pdu_recorder import PduRecorder, PduReader
+from .npz_exporter import NpzExporter
+from .signal_database import SpnDefinition, PgnDefinition, SignalDatabase
+from .dbc import parse_dbc, load_dbc
 from .name import Name
-from .message_id import MessageId
+from .message_id import MessageId, decode_can_id
 from .parameter_group_number import ParameterGroupNumber
 from .diagnostic_messages import *
 from .memory_access import *
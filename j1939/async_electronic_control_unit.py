@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import threading
+import can
+from .electronic_control_unit import ElectronicControlUnit
+from .controller_application import ControllerApplication
+from .parameter_group_number import ParameterGroupNumber
+from .message_id import FrameFormat
+
+logger = logging.getLogger(__name__)
+
+class AsyncElectronicControlUnit(ElectronicControlUnit):
+    """ElectronicControlUnit (ECU) running on an asyncio event loop.
+
+    The data link layer, the timer events and the subscriber callbacks are handled
+    in the event loop the ECU was created in. Neither the job thread nor the
+    receive thread of a python-can :class:`can.Notifier` are used, incoming
+    messages are taken from a :class:`can.AsyncBufferedReader`.
+
+    The ECU must be created from within a running event loop. All methods are
+    expected to be called from the thread of this loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Arguments are passed directly to :class:`j1939.ElectronicControlUnit`.
+
+        :raises RuntimeError:
+            When there is no running event loop.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._job_event = asyncio.Event()
+        self._job_task = None
+        self._reader = None
+        self._rx_task = None
+        super().__init__(*args, **kwargs)
+
+    def _start_job_thread(self):
+        logger.info("Starting ECU job task")
+        self._job_task = self._loop.create_task(self._async_job_task())
+
+    def stop(self):
+        """Stops the ECU background handling
+
+        This Function explicitely stops the background handling of the ECU.
+        """
+        self._stop_rx_task()
+        if self._job_task is not None:
+            self._job_task.cancel()
+            self._job_task = None
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self._transmit_scheduler is not None:
+            self._transmit_scheduler.stop()
+        for segment in self._segments:
+            segment.stop()
+
+    def connect(self, *args, **kwargs):
+        """Connect to CAN bus using python-can.
+
+        Arguments are passed directly to :class:`can.BusABC`.
+        The bus is read by a :class:`can.Notifier` attached to the event loop of the ECU.
+        For interfaces providing a file descriptor no receive thread is started.
+
+        :raises can.CanError:
+            When connection fails.
+        """
+        self._bus = can.interface.Bus(*args, **kwargs)
+        logger.info("Connected to '%s'", self._bus.channel_info)
+        self._start_rx_task()
+        self._notifier = can.Notifier(self._bus, [self._reader], 1, loop=self._loop)
+        return self._bus
+
+    def disconnect(self):
+        """Disconnect from the CAN bus.
+        """
+        self._stop_rx_task()
+        self._notifier.stop()
+        self._bus.shutdown()
+        self._bus = None
+
+    def add_notifier(self, notifier):
+        """Add a notifier to the ECU.
+
+        :param notifier:
+            A :class:`can.Notifier` object, created with the event loop of the ECU.
+        """
+        self._notifier = notifier
+        self._start_rx_task()
+        self._notifier.add_listener(self._reader)
+
+    def remove_notifier(self):
+        """Remove the notifier from the ECU.
+        """
+        self._notifier.remove_listener(self._reader)
+        self._stop_rx_task()
+        self._notifier = None
+
+    def add_ca(self, **kwargs):
+        """Add a ControllerApplication to the ECU.
+
+        See :meth:`j1939.ElectronicControlUnit.add_ca`.
+        If the CA is created from a name, a :class:`AsyncControllerApplication` is used.
+        """
+        if ('controller_application' not in kwargs) and ('name' in kwargs):
+            kwargs['controller_application'] = AsyncControllerApplication(kwargs['name'], kwargs.get('device_address', None))
+        return super().add_ca(**kwargs)
+
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF, on_complete=None):
+        """send a pgn
+
+        See :meth:`j1939.ElectronicControlUnit.send_pgn`.
+
+        :return:
+            An :class:`asyncio.Future` resolving to True when the transmission
+            (including a transport protocol session) is finished, or to False when
+            the transmission could not be started or was aborted.
+        """
+        future = self._loop.create_future()
+
+        def _resolve(success):
+            if not future.done():
+                future.set_result(success)
+
+        def _on_complete(success):
+            if on_complete is not None:
+                on_complete(success)
+            self._call_soon(_resolve, success)
+
+        if not super().send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=_on_complete):
+            _resolve(False)
+        return future
+
+    async def pdus(self, pgn=None, device_address=None):
+        """Asynchronous iterator over the received PDUs.
+
+        Usage::
+
+            async for priority, pgn, sa, timestamp, data in ecu.pdus(pgn=65262):
+                ...
+
+        :param pgn:
+            Optional PGN or iterable of PGNs to be received.
+            If omitted, all PDUs are received.
+        :param device_address:
+            Device address to receive peer-to-peer messages for, see :meth:`subscribe`.
+        :return:
+            Yields tuples (priority, pgn, sa, timestamp, data).
+        """
+        pdu_queue = asyncio.Queue()
+
+        def on_pdu(priority, pgn, sa, timestamp, data):
+            self._call_soon(pdu_queue.put_nowait, (priority, pgn, sa, timestamp, data))
+
+        self.subscribe(on_pdu, device_address, pgn)
+        try:
+            while True:
+                yield await pdu_queue.get()
+        finally:
+            self.unsubscribe(on_pdu)
+
+    async def _async_job_task(self):
+        """Task for handling various jobs
+
+        Event loop counterpart of :meth:`_async_job_thread`.
+        """
+        while True:
+            self._job_event.clear()
+            try:
+                next_wakeup = self._process_jobs(self._clock())
+            except Exception as e:
+                # Exceptions in any callbaks should not stop the job handling
+                logger.exception(str(e))
+                next_wakeup = self._clock()
+
+            time_to_sleep = next_wakeup - self._clock()
+            if time_to_sleep > 0:
+                try:
+                    await asyncio.wait_for(self._job_event.wait(), time_to_sleep)
+                except asyncio.TimeoutError:
+                    # do nothing
+                    pass
+            else:
+                # give other tasks a chance to run
+                await asyncio.sleep(0)
+
+    async def _async_rx_task(self):
+        """Task feeding the received messages into the ECU"""
+        reader = self._reader
+        while True:
+            msg = await reader.get_message()
+            while True:
+                for listener in self._listeners:
+                    listener.on_message_received(msg)
+                # process all buffered messages without suspending
+                try:
+                    msg = reader.buffer.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+
+    def _start_rx_task(self):
+        self._stop_rx_task()
+        self._reader = can.AsyncBufferedReader()
+        self._rx_task = self._loop.create_task(self._async_rx_task())
+
+    def _stop_rx_task(self):
+        if self._rx_task is not None:
+            self._rx_task.cancel()
+            self._rx_task = None
+        if self._reader is not None:
+            self._reader.stop()
+
+    def _job_thread_wakeup(self):
+        """Wakeup the job task
+
+        Forces a recalculation of the next wakeup event.
+        Can be called from any thread.
+        """
+        self._call_soon(self._job_event.set)
+
+    def _call_soon(self, callback, *args):
+        """Calls the callback in the event loop of the ECU
+
+        The callback is called immediately when we are already running in the thread of the event loop.
+        """
+        if threading.get_ident() == self._loop_thread_id:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+
+class AsyncControllerApplication(ControllerApplication):
+    """ControllerApplication (CA) for the use with :class:`AsyncElectronicControlUnit`.
+
+    :meth:`send_pgn` returns an awaitable resolving when the transmission is finished::
+
+        await ca.send_pgn(0, 0xEF, 0x80, 6, data)
+    """
+
+    async def request(self, data_page, pgn, destination=ParameterGroupNumber.Address.GLOBAL, timeout=1.25):
+        """send a request message and wait for the response
+
+        :param int data_page: data page
+        :param int pgn: pgn to be requested
+        :param int destination: destination address
+        :param float timeout: time in seconds to wait for the response
+
+        :return:
+            Tuple (priority, pgn, sa, timestamp, data) of the first response received.
+        :raises asyncio.TimeoutError:
+            When no response is received in time.
+        """
+        response = asyncio.get_running_loop().create_future()
+
+        def _resolve(pdu):
+            if not response.done():
+                response.set_result(pdu)
+
+        def on_response(priority, rx_pgn, sa, timestamp, data):
+            if (destination == ParameterGroupNumber.Address.GLOBAL) or (sa == destination):
+                self._ecu._call_soon(_resolve, (priority, rx_pgn, sa, timestamp, data))
+
+        if ((pgn >> 8) & 0xFF) < 240:
+            # peer-to-peer pgns are notified without the destination address
+            self.subscribe(on_response, pgn & 0x1FF00)
+        else:
+            self.subscribe(on_response, pgn)
+        try:
+            self.send_request(data_page, pgn, destination)
+            return await asyncio.wait_for(response, timeout)
+        finally:
+            self.unsubscribe(on_response)
@@ -1,6 +1,7 @@
 import logging
 import j1939
 from .message_id import FrameFormat
+from .subscriber_queue import SubscriberQueue
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +57,8 @@ class ControllerApplication:
         self._subscribers_request = []
         self._subscribers_acknowledge = []
         self._started = False
+        # CAN-ID cache of the messages sent by this CA, keyed by (pgn, priority, sa, da)
+        self._can_id_cache = {}
 
     def associate_ecu(self, ecu):
         """Binds this CA to the ECU given
@@ -70,12 +73,21 @@ class ControllerApplication:
 
         self._ecu = None
 
-    def subscribe(self, callback):
+    def subscribe(self, callback, pgns=None, queue_size=0, overflow_policy=SubscriberQueue.OverflowPolicy.DROP_OLDEST):
         """Add the given callback to the message notification stream.
         :param callback:
             Function to call when message is received.
+        :param pgns:
+            Optional PGN or iterable of PGNs the callback is interested in.
+            If omitted, the callback is notified for every PGN.
+        :param int queue_size:
+            If greater than 0, the messages are passed through a bounded queue of this size.
+        :param overflow_policy:
+            One of :class:`j1939.SubscriberQueue.OverflowPolicy`.
+        :return:
+            The :class:`j1939.SubscriberQueue` or None if no queue is used.
         """
-        self._ecu.subscribe(callback, self.message_acceptable)
+        return self._ecu.subscribe(callback, self.message_acceptable, pgns, queue_size, overflow_policy)
 
     def unsubscribe(self, callback):
         """Stop listening for message.
@@ -113,8 +125,10 @@ class ControllerApplication:
             The time in seconds after which the event is to be triggered.
         :param callback:
             The callback function to call
+        :return:
+            A :class:`j1939.electronic_control_unit.Timer` handle which can be used to cancel the event.
         """
-        self._ecu.add_timer(delta_time, callback, cookie)
+        return self._ecu.add_timer(delta_time, callback, cookie)
 
     def remove_timer(self, callback):
         """Removes ALL entries from the timer event list for the given callback
@@ -155,10 +169,12 @@ class ControllerApplication:
                     # addresses from 0..127 and 248..253 should start immediately
                     self._device_address = self._device_address_announced
                     self._device_address_state = ControllerApplication.State.NORMAL
+                    self._address_changed()
         elif self._device_address_state == ControllerApplication.State.WAIT_VETO:
             # if we reach this phase, there was no VETO to our address claimed message so far
             self._device_address = self._device_address_announced
             self._device_address_state = ControllerApplication.State.NORMAL
+            self._address_changed()
         elif self._device_address_state == ControllerApplication.State.NORMAL:
             # do nothing
             pass
@@ -170,6 +186,12 @@ class ControllerApplication:
         # returning false deletes the event from the list
         return False
 
+    def _address_changed(self):
+        """Informs the ECU about a change of the address claim state or the address"""
+        self._can_id_cache = {}
+        if self._ecu:
+            self._ecu._ca_address_changed(self)
+
     def _process_addressclaim(self, mid, data, timestamp):
         """Processes an address claim message
         :param j1939.MessageId mid:
@@ -215,6 +237,7 @@ class ControllerApplication:
                     self._send_address_claimed(self._device_address_announced)
                     # TODO: it's not possible to set the VETO-Timeout from here
                     self._device_address_state = ControllerApplication.State.WAIT_VETO
+                self._address_changed()
 
             else:
                 # we have higher prio - repeat our claim message
@@ -258,8 +281,7 @@ class ControllerApplication:
         if self.state != ControllerApplication.State.NORMAL:
             raise RuntimeError("Could not send message unless address claiming has finished")
 
-        mid = j1939.MessageId(priority=priority, parameter_group_number=parameter_group_number, source_address=self._device_address)
-        self._ecu.send_message(mid.can_id, True, data)
+        self._ecu.send_frame(self._can_id(parameter_group_number & 0x3FF00, priority, self._device_address, parameter_group_number & 0xFF), True, data)
 
     def send_pgn(self, data_page, pdu_format, pdu_specific, priority, data, time_limit=0, frame_format=FrameFormat.FEFF):
         """send a pgn
@@ -267,7 +289,7 @@ class ControllerApplication:
         :param int pdu_format: pdu format
         :param int pdu_specific: pdu specific
         :param int priority: message priority
-        :param list data: payload, each list index represents one payload byte
+        :param data: payload, a bytes-like object or a list of ints
         :param time_limit: option j1939-22 multi-pg: specify a time limit in s (e.g. 0.1 == 100ms),
         after this time, the multi-pg will be sent. several pgs can thus be combined in one multi-pg.
         0 or no time-limit means immediate sending.
@@ -297,10 +319,28 @@ class ControllerApplication:
         # TODO: Normally the (initial) address claimed message must not be an auto repeat message.
         #       We have to use a single-shot message instead!
         #       After a (send-)error occurs we have to wait 0..153 msec before repeating.
-        pgn = j1939.ParameterGroupNumber(0, 238, j1939.ParameterGroupNumber.Address.GLOBAL)
-        mid = j1939.MessageId(priority=6, parameter_group_number=pgn.value, source_address=address)
+        can_id = self._can_id(j1939.ParameterGroupNumber.PGN.ADDRESSCLAIM, 6, address, j1939.ParameterGroupNumber.Address.GLOBAL)
         data = self._name.bytes
-        self._ecu.send_message(mid.can_id, True, data)
+        self._ecu.send_frame(can_id, True, data)
+
+    def _can_id(self, pgn_value, priority, src_address, dest_address):
+        """Returns the 29-bit CAN-ID from the CAN-ID cache
+
+        :param int pgn_value:
+            The PGN with PDU specific 0.
+        :param int priority:
+            The priority of the message.
+        :param src_address:
+            The Source-Address of the message.
+        :param dest_address:
+            The Destination-Address or group extension of the message.
+        """
+        key = (pgn_value, priority, src_address, dest_address)
+        can_id = self._can_id_cache.get(key)
+        if can_id is None:
+            can_id = j1939.MessageId(priority=priority, parameter_group_number=pgn_value | dest_address, source_address=src_address).can_id
+            self._can_id_cache[key] = can_id
+        return can_id
 
     def on_request(self, src_address, dest_address, pgn):
         """Callback for PGN requests
@@ -313,9 +353,23 @@ class ControllerApplication:
         """
         pass
 
+    def update_acceptance(self):
+        """Recalculates the cached results of :meth:`message_acceptable`
+
+        Must be called by subclasses overriding :meth:`message_acceptable` whenever its result
+        changes, e.g. depending on their own state. Address claim state changes are handled
+        by the CA itself.
+        """
+        if self._ecu:
+            self._ecu.update_acceptance_tables()
+
     def message_acceptable(self, dest_address):
         """Indicates if this CA would accept a message
         This function indicates the acceptance of this CA for the given dest_address.
+        The result is cached in the acceptance table of the data link layer, which is
+        recalculated when the CA is added/removed and on every address claim state change.
+        Subclasses whose acceptance changes otherwise have to call :meth:`update_acceptance`,
+        the data link layer drops the peer-to-peer messages for the cached addresses until then.
         """
         if self.state != j1939.ControllerApplication.State.NORMAL:
             return False
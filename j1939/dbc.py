@@ -0,0 +1,146 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+
+from .message_id import decode_can_id
+from .signal_database import SpnDefinition, PgnDefinition, SignalDatabase
+from .version import __version__
+
+logger = logging.getLogger(__name__)
+
+# BO_ <CAN-ID> <name>: <DLC> <transmitter>
+_BO = re.compile(r'BO_\s+(\d+)\s+(\w+)\s*:\s*(\d+)')
+# SG_ <name> [M|m<n>] : <start bit>|<length>@<byte order><sign> (<scale>,<offset>) [<min>|<max>] "<unit>" <receivers>
+_SG = re.compile(r'SG_\s+(\w+)\s*(M|m\d+)?\s*:\s*(\d+)\|(\d+)@([01])([+-])\s*\(\s*([^,\s]+)\s*,\s*([^)\s]+)\s*\)\s*\[[^\]]*\]\s*"([^"]*)"')
+# VAL_ <CAN-ID> <signal> <value> "<description>" ... ;
+_VAL = re.compile(r'VAL_\s+(\d+)\s+(\w+)\s+(.*);')
+_VAL_CHOICE = re.compile(r'(-?\d+)\s+"([^"]*)"')
+# BA_ "SPN" SG_ <CAN-ID> <signal> <spn>;
+_BA_SPN = re.compile(r'BA_\s+"SPN"\s+SG_\s+(\d+)\s+(\w+)\s+(\d+)\s*;')
+
+# extended CAN-IDs are marked with bit 31 in DBC files
+_EXTENDED_ID = 0x80000000
+
+
+def _default_cache_dir():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'j1939', 'dbc')
+
+
+def parse_dbc(text):
+    """Parses the messages (BO_), signals (SG_), value descriptions (VAL_) and SPN attributes of a J1939 DBC file
+
+    Only messages with an extended CAN-ID are imported, keyed by their PGN. A PGN sent by several
+    sources is defined by its first message. Signals in Motorola byte order and multiplexed
+    signals are skipped.
+
+    :param str text:
+        The content of the DBC file.
+    :return:
+        A :class:`j1939.SignalDatabase`.
+    """
+    # DBC id -> (pgn, name, dlc, signal name -> SpnDefinition arguments)
+    messages = {}
+    message = None
+    # (DBC id, signal name) -> value descriptions and SPN numbers, defined after all messages
+    choices = {}
+    spns = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('SG_ '):
+            if message is None:
+                continue
+            match = _SG.match(line)
+            if match is None:
+                logger.warning("cannot parse signal: %s", line)
+                continue
+            name, multiplex, start_bit, length, byte_order, sign, scale, offset, unit = match.groups()
+            if byte_order == '0':
+                logger.warning("signal %s of %s in Motorola byte order is skipped", name, message[1])
+                continue
+            if (multiplex is not None) and (multiplex != 'M'):
+                logger.warning("multiplexed signal %s of %s is skipped", name, message[1])
+                continue
+            message[3][name] = dict(name=name, start_bit=int(start_bit), length=int(length),
+                                    scale=float(scale), offset=float(offset), unit=unit, signed=(sign == '-'))
+            continue
+
+        # the signals of a message follow its BO_ line
+        message = None
+        if line.startswith('BO_ '):
+            match = _BO.match(line)
+            if match and (int(match.group(1)) & _EXTENDED_ID):
+                dbc_id = int(match.group(1))
+                _, pgn, _, _, _ = decode_can_id(dbc_id & 0x1FFFFFFF)
+                message = messages[dbc_id] = (pgn, match.group(2), int(match.group(3)), {})
+        elif line.startswith('VAL_ '):
+            match = _VAL.match(line)
+            if match:
+                choices[(int(match.group(1)), match.group(2))] = {int(raw): description for raw, description in _VAL_CHOICE.findall(match.group(3))}
+        elif line.startswith('BA_ '):
+            match = _BA_SPN.match(line)
+            if match:
+                spns[(int(match.group(1)), match.group(2))] = int(match.group(3))
+
+    database = SignalDatabase()
+    for dbc_id, (pgn, name, dlc, signals) in messages.items():
+        if pgn in database:
+            continue
+        definitions = []
+        for signal in signals.values():
+            key = (dbc_id, signal['name'])
+            try:
+                definitions.append(SpnDefinition(spn=spns.get(key), choices=choices.get(key), **signal))
+            except ValueError as e:
+                logger.warning("signal %s of %s is skipped: %s", signal['name'], name, e)
+        database.add(PgnDefinition(pgn, definitions, name, length=dlc))
+    return database
+
+
+def load_dbc(filename, cache_dir=None, use_cache=True):
+    """Loads a J1939 DBC file into a :class:`j1939.SignalDatabase`, see :func:`parse_dbc`
+
+    The parsed database is cached in a file named after the SHA-256 hash of the DBC file,
+    so a DBC file is parsed only once. The cache is bound to the version of this package.
+
+    :param str filename:
+        The DBC file.
+    :param str cache_dir:
+        The cache directory, by default ``$XDG_CACHE_HOME/j1939/dbc`` (``~/.cache/j1939/dbc``).
+    :param bool use_cache:
+        If False, the file is parsed without reading or writing the cache.
+    """
+    with open(filename, 'rb') as f:
+        content = f.read()
+    if not use_cache:
+        return parse_dbc(content.decode('latin-1'))
+
+    digest = hashlib.sha256(content)
+    digest.update(__version__.encode())
+    cache_dir = cache_dir or _default_cache_dir()
+    cache_file = os.path.join(cache_dir, digest.hexdigest() + '.pickle')
+    try:
+        with open(cache_file, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning("ignoring the DBC cache %s: %s", cache_file, e)
+
+    database = parse_dbc(content.decode('latin-1'))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, concurrent processes never read a partly written cache
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(database, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, cache_file)
+        except BaseException:
+            os.unlink(temp_file)
+            raise
+    except OSError as e:
+        logger.warning("cannot write the DBC cache %s: %s", cache_file, e)
+    return database
@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import threading
+
+
+class DeadlineIndex:
+    """Priority queue of deadlines for keyed objects (e.g. transport protocol sessions)
+
+    Every key has at most one active deadline. Setting a new deadline for a key
+    does not search the queue, the old entry is invalidated and dropped lazily
+    when it reaches the head of the queue. This keeps setting a deadline at
+    O(log n) and lets the job thread touch expired sessions only.
+    """
+
+    def __init__(self):
+        # entries are (deadline, sequence number, key)
+        self._heap = []
+        # key -> sequence number of the valid entry
+        self._active = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._active)
+
+    def __contains__(self, key):
+        return key in self._active
+
+    def set(self, key, deadline):
+        """Sets (or replaces) the deadline for the given key
+
+        :param key:
+            The key the deadline belongs to.
+        :param float deadline:
+            The deadline in seconds.
+
+        :return:
+            True if the deadline is the earliest one in the index.
+            In this case the job thread has to recalculate its sleep time.
+        """
+        with self._lock:
+            seq = next(self._sequence)
+            self._active[key] = seq
+            heapq.heappush(self._heap, (deadline, seq, key))
+            self._drop_invalid_head()
+            return self._heap[0][1] == seq
+
+    def discard(self, key):
+        """Removes the deadline for the given key, if any
+
+        :param key:
+            The key the deadline belongs to.
+        """
+        with self._lock:
+            self._active.pop(key, None)
+
+    def pop_expired(self, now):
+        """Removes and returns the keys with reached deadline
+
+        :param float now:
+            The current time in seconds.
+
+        :return:
+            A list of the expired keys, ordered by deadline.
+        """
+        expired = []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, seq, key = heapq.heappop(heap)
+                if self._active.get(key) == seq:
+                    del self._active[key]
+                    expired.append(key)
+        return expired
+
+    def next_deadline(self):
+        """Returns the earliest valid deadline or None if the index is empty"""
+        with self._lock:
+            self._drop_invalid_head()
+            if self._heap:
+                return self._heap[0][0]
+            return None
+
+    def _drop_invalid_head(self):
+        heap = self._heap
+        while heap and self._active.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
@@ -5,50 +5,227 @@ import time
 import sys
 import threading
 import queue
+import heapq
+import itertools
+import math
+import numpy as np
 from .controller_application import ControllerApplication
 from .parameter_group_number import ParameterGroupNumber
 from .j1939_21 import J1939_21
 from .j1939_22 import J1939_22
 from .message_id import FrameFormat
+from .subscriber_dispatcher import SubscriberDispatcher
+from .subscriber_queue import SubscriberQueue
+from .transmit_scheduler import TransmitScheduler
+from .gateway import RoutingTable
+from .statistics import Statistics
+from .tracing import Tracer
+from .latest_values import LatestValues
 
 logger = logging.getLogger(__name__)
 
-class ElectronicControlUnit:
+class Timer:
+    """Handle of a timer event, returned by :meth:`ElectronicControlUnit.add_timer`"""
+
+    #: Minimum interval in seconds of a repeating event, a callback of an event with a shorter
+    #: delta_time (e.g. 0) asking to be called again is called again after this interval
+    MINIMUM_INTERVAL = 0.001
+
+    def __init__(self, deadline, delta_time, callback, cookie):
+        self.deadline = deadline
+        self.delta_time = delta_time
+        self.callback = callback
+        self.cookie = cookie
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancels the timer event
+
+        The event is removed lazily from the scheduler, when its deadline is reached
+        or when the scheduler purges the cancelled events as the number of events grows.
+        """
+        self.cancelled = True
+
+class _BusTransmitter:
+    """Transmit path shared by the ECU and its bus segments
+
+    Holds the bus, the send lock, the runtime counters and the tracer of one CAN bus.
+    """
+
+    def __init__(self, statistics, tracer):
+        #: A python-can :class:`can.BusABC` instance
+        self._bus = None
+        # Locking object for send
+        self._send_lock = threading.Lock()
+        # runtime counters, see stats()
+        self._statistics = statistics
+        self._tracer = tracer
+
+    def send_message(self, can_id, extended_id, data, fd_format=False):
+        """Send a raw CAN message to the bus.
+
+        This method may be overridden in a subclass if you need to integrate
+        this library with a custom backend.
+        It is safe to call this from multiple threads.
+
+        :param int can_id:
+            CAN-ID of the message (always 29-bit)
+        :param data:
+            Data to be transmitted (anything that can be converted to bytes)
+        :param fd_format:
+            fd format means bitrate switching and payload of max 64Bytes is active
+
+        :raises can.CanError:
+            When the message fails to be transmitted
+        """
+
+        if not self._bus:
+            raise RuntimeError("Not connected to CAN bus")
+        msg = can.Message(is_extended_id=extended_id,
+                          arbitration_id=can_id,
+                          data=data,
+                          is_fd=fd_format,
+                          bitrate_switch=fd_format
+                          )
+        with self._send_lock:
+            self._bus.send(msg)
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.FRAME_SENT, can_id)
+        # TODO: check error receivement
+
+    def send_frame(self, can_id, extended_id, data, fd_format=False):
+        """Send a raw CAN message to the bus and count it in the runtime counters.
+
+        The data link layer and the controller applications send their frames with
+        this method, see :meth:`stats`. The message is sent by :meth:`send_message`.
+        It is safe to call this from multiple threads.
+
+        :param int can_id:
+            CAN-ID of the message (always 29-bit)
+        :param data:
+            Data to be transmitted (anything that can be converted to bytes)
+        :param fd_format:
+            fd format means bitrate switching and payload of max 64Bytes is active
+
+        :raises can.CanError:
+            When the message fails to be transmitted
+        """
+        self._statistics.count_tx(can_id, len(data), extended_id)
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.FRAME_QUEUED, can_id)
+        self.send_message(can_id, extended_id, data, fd_format)
+
+class ElectronicControlUnit(_BusTransmitter):
     """ElectronicControlUnit (ECU) holding one or more ControllerApplications (CAs)."""
 
 
-    def __init__(self, data_link_layer='j1939-21', max_cmdt_packets=1, minimum_tp_rts_cts_dt_interval=None, minimum_tp_bam_dt_interval=None, send_message=None):
+    def __init__(self, data_link_layer='j1939-21', max_cmdt_packets=1, minimum_tp_rts_cts_dt_interval=None, minimum_tp_bam_dt_interval=None, send_message=None, subscriber_workers=0, transmit_queue=False, transmit_batch_size=1, transmit_fbff_priority=0, apply_can_filters=False, tracer=None, clock=None, latest_values=False):
         """
         :param data_link_layer:
             specify data-link-layer, 'j1939-21' or 'j1939-22'
+        :param int subscriber_workers:
+            number of worker threads executing the subscriber callbacks.
+            0 executes the callbacks inline in the receiving thread.
+            With workers, the order of the messages is preserved per (source address, PGN)
+            and slow subscribers do not delay the transport protocol handling.
+        :param bool transmit_queue:
+            if True, all messages are sent through a :class:`j1939.TransmitScheduler`, a queue ordered
+            by the J1939 priority which is drained by a single writer thread.
+            The senders are not blocked by the bus and transmission errors are logged instead of raised.
+        :param int transmit_batch_size:
+            maximum number of messages the writer thread takes from the transmit queue at once.
+        :param int transmit_fbff_priority:
+            priority (0..7) in the transmit queue of the messages with 11-bit identifiers,
+            see :class:`j1939.TransmitScheduler`.
+        :param bool apply_can_filters:
+            if True, the receive filters of the bus are set to the messages the ECU is interested in,
+            see :meth:`compute_can_filters`. The filters follow the subscriptions and the claimed addresses.
+        :param tracer:
+            optional :class:`j1939.Tracer` recording the timestamps of the processing stages
+            of the received and sent frames, including the frames of the bus segments.
+        :param clock:
+            optional callable returning the current time in seconds, used for the timeouts of the
+            transport protocols and the timer events instead of :func:`time.time`, e.g. a
+            :class:`j1939.VirtualClock` for replaying logs at full speed.
+            A thread can not wait for the time of such a clock, the ECU does not start the job thread
+            and the jobs have to be processed by calling :meth:`process_jobs`.
+        :param latest_values:
+            if True (or a PGN or an iterable of PGNs to keep), the ECU keeps the latest received PDU
+            per (source address, PGN) in a :class:`j1939.LatestValues` store, see :attr:`latest_values`.
         """
         if send_message:
             self.send_message = send_message
 
-        #: A python-can :class:`can.BusABC` instance
-        self._bus = None
-        # Locking object for send
-        self._send_lock = threading.Lock()
+        self._transmit_scheduler = None
+        if transmit_queue:
+            self._transmit_scheduler = TransmitScheduler(self.send_message, transmit_batch_size, transmit_fbff_priority)
+            self.send_message = self._transmit_scheduler.send
 
-        if max_cmdt_packets > 0xFF:
-            raise ValueError("max number of segments that can be sent is 0xFF")
+        super().__init__(Statistics(), tracer)
+        self._apply_can_filters = apply_can_filters
+        # filters currently set on the bus
+        self._can_filters = None
+        self._clock = clock if clock is not None else time.time
+        self._latest_values = None
+        if latest_values is not False:
+            self._latest_values = LatestValues(None if latest_values is True else latest_values)
 
         # set data link layer
-        if data_link_layer == 'j1939-21':
-            self.j1939_dll = J1939_21(self.send_message, self._job_thread_wakeup, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable)
-        elif data_link_layer == 'j1939-22':
-            self.j1939_dll = J1939_22(self.send_message, self._job_thread_wakeup, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable)
-        else:
-            raise ValueError("either 'j1939-21' or 'j1939-22' must be provided for data link layer")
+        self.j1939_dll = self._create_data_link_layer(data_link_layer, self.send_frame, self._notify_subscribers, self._is_message_acceptable, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._statistics)
+
+        # additional bus segments, the ECU itself is segment 0
+        self._segments = []
+        # routing table of the gateway between the segments
+        self._routing_table = None
 
         #: Includes at least MessageListener.
         self._listeners = [MessageListener(self)]
         self._notifier = None
+        # The subscriber lists and the dispatch table are never changed in place, (un)subscribe
+        # replaces them under the lock (copy-on-write), so a dispatch iterates over a snapshot.
+        # List of all subscriber entries in order of subscription
         self._subscribers = []
-
-        # List of timer events the job thread should care of
+        # Dispatch table: PGN -> subscribers interested in this PGN (including the wildcard subscribers),
+        # the subscribers for PGNs without a dedicated entry are stored with the key None
+        self._subscribers_by_pgn = {None: ()}
+        self._subscribers_lock = threading.Lock()
+        # ids of the subscriptions, the callback statistics are kept per subscription
+        self._subscription_ids = itertools.count(1)
+        # executes the subscriber callbacks off the receiving thread
+        self._dispatcher = None
+        if subscriber_workers > 0:
+            self._dispatcher = SubscriberDispatcher(self._dispatch_subscribers, subscriber_workers)
+
+        # Priority queue of timer events the job thread should care of
+        # entries are [deadline, sequence number, Timer]
         self._timer_events = []
+        self._timer_sequence = itertools.count()
+        self._timer_lock = threading.Lock()
+        # the cancelled events are purged from the priority queue when it reaches this size
+        self._timer_purge_size = 64
+        # timer event whose callback is currently executed by the job thread
+        self._timer_running = None
+
+        self._job_thread = None
+        if clock is None:
+            self._start_job_thread()
+
+    def _create_data_link_layer(self, data_link_layer, send_message, notify_subscribers, is_message_acceptable, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, statistics):
+        if max_cmdt_packets > 0xFF:
+            raise ValueError("max number of segments that can be sent is 0xFF")
 
+        if data_link_layer == 'j1939-21':
+            return J1939_21(send_message, self._job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, is_message_acceptable, notify_eom_ack=self._notify_local_subscribers, statistics=statistics, tracer=self._tracer, clock=self._clock)
+        elif data_link_layer == 'j1939-22':
+            return J1939_22(send_message, self._job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, is_message_acceptable, notify_eom_ack=self._notify_local_subscribers, statistics=statistics, tracer=self._tracer, clock=self._clock)
+        else:
+            raise ValueError("either 'j1939-21' or 'j1939-22' must be provided for data link layer")
+
+    def _start_job_thread(self):
+        """Starts the background handling of the ECU
+
+        May be overridden in a subclass to run the jobs in a different context.
+        """
         self._job_thread_end = threading.Event()
         logger.info("Starting ECU async thread")
         self._job_thread_wakeup_queue = queue.Queue()
@@ -65,28 +242,65 @@ class ElectronicControlUnit:
 
         This Function explicitely stops the background handling of the ECU.
         """
-        self._job_thread_end.set()
-        self._job_thread_wakeup()
-        self._job_thread.join()
+        if self._job_thread is not None:
+            self._job_thread_end.set()
+            self._job_thread_wakeup()
+            self._job_thread.join()
+        if self._dispatcher is not None:
+            self._dispatcher.stop()
+        if self._transmit_scheduler is not None:
+            self._transmit_scheduler.stop()
+        for segment in self._segments:
+            segment.stop()
+
+    @property
+    def transmit_scheduler(self):
+        """The :class:`j1939.TransmitScheduler` providing the transmit queue statistics,
+        None if the ECU sends without transmit queue."""
+        return self._transmit_scheduler
+
+    @property
+    def latest_values(self):
+        """The :class:`j1939.LatestValues` store with the latest received PDU per (source address, PGN),
+        None if the ECU was created without it.
+
+        Other threads, e.g. of a dashboard, poll it without locks instead of subscribing.
+        """
+        return self._latest_values
+
+    def stats(self, delta=False):
+        """Returns the runtime counters of the ECU
+
+        Counted are the frames on the bus of the ECU (not of additional segments),
+        the transport protocol sessions, the sent multi-pg frames, the runs of the job
+        handling and the execution times of the subscriber callbacks. The callbacks are counted
+        per subscription, named by their qualified name. For subscribers with a queue, the time
+        to enqueue the message is recorded.
+
+        :param bool delta:
+            If False, the counters since the start of the ECU are returned. If True, the change
+            since the last call with delta=True is returned and a new interval is started.
+        :return:
+            dict of counters, see :meth:`j1939.Statistics.snapshot`.
+        """
+        return self._statistics.delta() if delta else self._statistics.snapshot()
 
     def add_timer(self, delta_time, callback, cookie=None):
         """Adds a callback to the list of timer events
 
         :param delta_time:
             The time in seconds after which the event is to be triggered.
+            An event repeated by its callback is triggered at most every :attr:`Timer.MINIMUM_INTERVAL` seconds.
         :param callback:
             The callback function to call
+        :return:
+            A :class:`Timer` handle which can be used to cancel the event.
         """
-
-        d = {
-            'delta_time': delta_time,
-            'callback': callback,
-            'deadline': (time.time() + delta_time),
-            'cookie': cookie,
-            }
-
-        self._timer_events.append( d )
-        self._job_thread_wakeup()
+        timer = Timer(self._clock() + delta_time, delta_time, callback, cookie)
+        if self._schedule_timer(timer):
+            # the job thread has to recalculate its sleep time
+            self._job_thread_wakeup()
+        return timer
 
     def remove_timer(self, callback):
         """Removes ALL entries from the timer event list for the given callback
@@ -94,10 +308,32 @@ class ElectronicControlUnit:
         :param callback:
             The callback to be removed from the timer event list
         """
-        for event in self._timer_events:
-            if event['callback'] == callback:
-                self._timer_events.remove( event )
-        self._job_thread_wakeup()
+        with self._timer_lock:
+            for _, _, timer in self._timer_events:
+                if timer.callback == callback:
+                    timer.cancel()
+            if (self._timer_running is not None) and (self._timer_running.callback == callback):
+                self._timer_running.cancel()
+            self._purge_timers()
+
+    def _schedule_timer(self, timer):
+        """Inserts the timer into the priority queue
+
+        :return:
+            True if the timer is the next event to be triggered
+        """
+        with self._timer_lock:
+            heapq.heappush(self._timer_events, [timer.deadline, next(self._timer_sequence), timer])
+            if len(self._timer_events) >= self._timer_purge_size:
+                self._purge_timers()
+            return self._timer_events[0][2] is timer
+
+    def _purge_timers(self):
+        """Removes the cancelled events from the priority queue, called with the timer lock held"""
+        self._timer_events = [event for event in self._timer_events if not event[2].cancelled]
+        heapq.heapify(self._timer_events)
+        # purging again at twice the size keeps the amortized cost per event constant
+        self._timer_purge_size = max(64, 2 * len(self._timer_events))
 
     def connect(self, *args, **kwargs):
         """Connect to CAN bus using python-can.
@@ -119,6 +355,8 @@ class ElectronicControlUnit:
         """
         self._bus = can.interface.Bus(*args, **kwargs)
         logger.info("Connected to '%s'", self._bus.channel_info)
+        self._can_filters = None
+        self._update_can_filters()
         self._notifier = can.Notifier(self._bus, self._listeners, 1)
         return self._bus
 
@@ -131,18 +369,52 @@ class ElectronicControlUnit:
         self._bus.shutdown()
         self._bus = None
 
-    def subscribe(self, callback, device_address=None):
+    def subscribe(self, callback, device_address=None, pgns=None, queue_size=0, overflow_policy=SubscriberQueue.OverflowPolicy.DROP_OLDEST, with_dest_address=False):
         """Add the given callback to the message notification stream.
 
         :param callback:
-            Function to call when message is received.
+            Function to call when message is received, with the arguments (priority, pgn, sa, timestamp, data).
+            data is a bytes-like object: the data of the received frame, a reassembled transport protocol
+            payload (bytearray) or a view into a J1939-22 multi-pg frame (memoryview).
+            It is not copied for the subscribers, use ``bytes(data)`` to keep an independent copy.
         :param int device_address:
             Device address of the application.
             This is a simple way for peer-to-peer reception without adding a controller-application.
             Only one device address can be entered. Multiple device addresses are only possible with controller applications.
             Note: TP.CMDT will only be received if the destination address is bound to a controller application.
+        :param pgns:
+            Optional PGN or iterable of PGNs the callback is interested in.
+            If omitted, the callback is notified for every PGN.
+            Registering for dedicated PGNs keeps the dispatch cost independent of the number of subscribers.
+        :param int queue_size:
+            If greater than 0, the messages are passed to the callback through a bounded
+            :class:`j1939.SubscriberQueue` of this size, executing the callback in its own thread.
+        :param overflow_policy:
+            One of :class:`j1939.SubscriberQueue.OverflowPolicy`, defines what happens when the queue is full.
+        :param bool with_dest_address:
+            If True, the callback is called with the arguments (priority, pgn, sa, dest, timestamp, data),
+            dest is the destination address of the message (GLOBAL for broadcasts).
+            Cannot be combined with a queue.
+
+        :return:
+            The :class:`j1939.SubscriberQueue` providing the drop and high-watermark counters,
+            or None if no queue is used.
         """
-        self._subscribers.append({'cb': callback, 'dev_adr':device_address})
+        if with_dest_address and (queue_size > 0):
+            raise ValueError("a subscriber with destination address cannot use a queue")
+        if pgns is not None:
+            pgns = frozenset([pgns]) if isinstance(pgns, int) else frozenset(pgns)
+        subscriber_queue = None
+        if queue_size > 0:
+            subscriber_queue = SubscriberQueue(callback, queue_size, overflow_policy)
+        dic = {'cb': subscriber_queue.put if subscriber_queue is not None else callback, 'callback': callback, 'queue': subscriber_queue, 'dev_adr': device_address, 'pgns': pgns, 'with_dest': with_dest_address,
+               'id': next(self._subscription_ids), 'name': getattr(callback, '__qualname__', None) or repr(callback)}
+        with self._subscribers_lock:
+            self._set_subscribers(self._subscribers + [dic])
+        if (device_address is not None) and not callable(device_address):
+            self.j1939_dll.update_acceptance_table()
+        self._update_can_filters()
+        return subscriber_queue
 
     def unsubscribe(self, callback):
         """Stop listening for message.
@@ -150,11 +422,35 @@ class ElectronicControlUnit:
         :param callback:
             Function to call when message is received.
         """
-        for dic in self._subscribers:
-            if dic['cb'] == callback:
-                self._subscribers.remove(dic)
-
-
+        with self._subscribers_lock:
+            removed = [dic for dic in self._subscribers if dic['callback'] == callback]
+            if removed:
+                self._set_subscribers([dic for dic in self._subscribers if dic['callback'] != callback])
+        for dic in removed:
+            if dic['queue'] is not None:
+                dic['queue'].stop()
+        for dic in removed:
+            if (dic['dev_adr'] is not None) and not callable(dic['dev_adr']):
+                self.j1939_dll.update_acceptance_table()
+                break
+        self._update_can_filters()
+
+    def _set_subscribers(self, subscribers):
+        """Replaces the subscriber list and the dispatch table, called with the subscribers lock held
+
+        :param list subscribers:
+            The new list of subscriber entries in order of subscription.
+        """
+        wildcards = tuple(dic for dic in subscribers if dic['pgns'] is None)
+        pgns = set()
+        for dic in subscribers:
+            if dic['pgns'] is not None:
+                pgns.update(dic['pgns'])
+        subscribers_by_pgn = {pgn: tuple(dic for dic in subscribers if (dic['pgns'] is None) or (pgn in dic['pgns'])) for pgn in pgns}
+        subscribers_by_pgn[None] = wildcards
+        self._subscribers = subscribers
+        # a single reference assignment, a dispatch sees either the old or the new table
+        self._subscribers_by_pgn = subscribers_by_pgn
     def add_ca(self, **kwargs):
         """Add a ControllerApplication to the ECU.
 
@@ -183,6 +479,7 @@ class ElectronicControlUnit:
 
         self.j1939_dll.add_ca(ca)
         ca.associate_ecu(self)
+        self._update_can_filters()
         return ca
 
     def remove_ca(self, device_address):
@@ -194,7 +491,10 @@ class ElectronicControlUnit:
         :return:
             True if the ControllerApplication was successfully removed, otherwise False is returned.
         """
-        return self.j1939_dll.remove_ca(device_address)
+        if not self.j1939_dll.remove_ca(device_address):
+            return False
+        self._update_can_filters()
+        return True
 
     def add_bus(self, bus):
         """Add a bus to the ECU.
@@ -203,6 +503,8 @@ class ElectronicControlUnit:
             A :class:`can.BusABC` object.
         """
         self._bus = bus
+        self._can_filters = None
+        self._update_can_filters()
 
     def add_notifier(self, notifier):
         """Add a notifier to the ECU.
@@ -226,49 +528,89 @@ class ElectronicControlUnit:
             self._notifier.remove_listener(listener)
         self._notifier = None
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF):
+    def add_segment(self, data_link_layer='j1939-21', max_cmdt_packets=1, minimum_tp_rts_cts_dt_interval=None, minimum_tp_bam_dt_interval=None, send_message=None):
+        """Add a further CAN bus segment to the ECU.
+
+        Each segment has its own data link layer instance. The ECU itself is
+        segment 0, the added segments are numbered consecutively.
+        Messages received on any segment are delivered to the subscribers of the ECU
+        and can be forwarded to other segments, see :meth:`add_route`.
+
+        :param data_link_layer:
+            specify data-link-layer of the segment, 'j1939-21' or 'j1939-22'
+        :param send_message:
+            optional function sending a raw CAN message on this segment, see :meth:`send_message`
+
+        :return:
+            The :class:`BusSegment` object that was added.
+        """
+        segment = BusSegment(self, len(self._segments) + 1, data_link_layer, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, send_message)
+        self._segments.append(segment)
+        return segment
+
+    @property
+    def segments(self):
+        """List of the added :class:`BusSegment` objects (without the ECU itself)"""
+        return list(self._segments)
+
+    def add_route(self, src_segment, dst_segment, pgns=None, source_addresses=None, destination_addresses=None):
+        """Add a gateway route forwarding PDUs between two segments.
+
+        Transport protocol messages are reassembled on the source segment and
+        segmented again by the data link layer of the destination segment, so PDUs can be
+        bridged between J1939-21 and J1939-22 segments. Address claim and request
+        messages are handled per segment and are not forwarded.
+
+        :param int src_segment:
+            Index of the segment the PDUs are received on (0 is the ECU itself).
+        :param int dst_segment:
+            Index of the segment the PDUs are forwarded to.
+        :param pgns:
+            Optional iterable of PGNs to forward, all PGNs if omitted.
+        :param source_addresses:
+            Optional iterable of source addresses to forward, all if omitted.
+        :param destination_addresses:
+            Optional iterable of destination addresses to forward, all if omitted.
+            Include GLOBAL (255) to forward broadcast PDUs.
+            The data link layer of the source segment accepts peer-to-peer messages for these addresses.
+        """
+        for segment in (src_segment, dst_segment):
+            if not 0 <= segment <= len(self._segments):
+                raise ValueError("unknown segment {}".format(segment))
+        if self._routing_table is None:
+            self._routing_table = RoutingTable()
+        self._routing_table.add_route(src_segment, dst_segment, pgns, source_addresses, destination_addresses)
+        self.update_acceptance_tables()
+
+    def remove_routes(self, src_segment=None, dst_segment=None):
+        """Remove the gateway routes matching the given segments.
+
+        :param src_segment:
+            Index of the source segment or None for any.
+        :param dst_segment:
+            Index of the destination segment or None for any.
+        """
+        if self._routing_table is None:
+            return
+        self._routing_table.remove_routes(src_segment, dst_segment)
+        self.update_acceptance_tables()
+
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF, on_complete=None):
         """send a pgn
         :param int data_page: data page
         :param int pdu_format: pdu format
         :param int pdu_specific: pdu specific
         :param int priority: message priority
         :param int src_address: address of the transmitter
-        :param list data: payload, each list index represents one payload byte
+        :param data: payload, a bytes-like object or a list of ints.
+        The payload is copied once, the transport protocol segments are sliced from that copy.
         :param time_limit: option j1939-22 multi-pg: specify a time limit in s (e.g. 0.1 == 100ms),
         after this time, the multi-pg will be sent. several pgs can thus be combined in one multi-pg.
         0 or no time-limit means immediate sending.
+        :param on_complete: optional callback, called with True when the transmission
+        (including a transport protocol session) is finished or with False when it is aborted.
         """
-        return self.j1939_dll.send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format)
-
-    def send_message(self, can_id, extended_id, data, fd_format=False):
-        """Send a raw CAN message to the bus.
-
-        This method may be overridden in a subclass if you need to integrate
-        this library with a custom backend.
-        It is safe to call this from multiple threads.
-
-        :param int can_id:
-            CAN-ID of the message (always 29-bit)
-        :param data:
-            Data to be transmitted (anything that can be converted to bytes)
-        :param fd_format:
-            fd format means bitrate switching and payload of max 64Bytes is active
-
-        :raises can.CanError:
-            When the message fails to be transmitted
-        """
-
-        if not self._bus:
-            raise RuntimeError("Not connected to CAN bus")
-        msg = can.Message(is_extended_id=extended_id,
-                          arbitration_id=can_id,
-                          data=data,
-                          is_fd=fd_format,
-                          bitrate_switch=fd_format
-                          )
-        with self._send_lock:
-            self._bus.send(msg)
-        # TODO: check error receivement
+        return self.j1939_dll.send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=on_complete)
 
     def notify(self, can_id, data, timestamp):
         """Feed incoming CAN message into this ecu.
@@ -279,15 +621,34 @@ class ElectronicControlUnit:
         :param int can_id:
             CAN-ID of the message (always 29-bit)
         :param bytearray data:
-            Data part of the message (0 - 8 bytes)
+            Data part of the message (0 - 8 bytes).
+            The data is passed to the subscribers without copy, it must not be modified afterwards.
         :param float timestamp:
             The timestamp field in a CAN message is a floating point number
             representing when the message was received since the epoch in
             seconds.
             Where possible this will be timestamped in hardware.
         """
+        self._statistics.count_rx(can_id, len(data))
         self.j1939_dll.notify(can_id, data, timestamp)
 
+    def notify_batch(self, can_ids, datas, timestamps):
+        """Feed a block of incoming CAN messages into this ecu.
+
+        Equivalent to calling :meth:`notify` for each message, but the CAN-IDs
+        are classified in one vectorized pass. Intended for backends and log
+        readers delivering the messages in blocks.
+
+        :param can_ids:
+            Sequence or numpy array of 29-bit CAN-IDs
+        :param datas:
+            Sequence with the data part of each message
+        :param timestamps:
+            Sequence with the timestamp of each message
+        """
+        self._statistics.count_rx_batch(can_ids, np.fromiter(map(len, datas), dtype=np.int64, count=len(datas)))
+        self.j1939_dll.notify_batch(can_ids, datas, timestamps)
+
     def _async_job_thread(self):
         """Asynchronous thread for handling various jobs
 
@@ -300,35 +661,11 @@ class ElectronicControlUnit:
         wakeup the timeout handler to recalculate the new sleep-time
         to awake at the new events.
         """
-        system = sys.platform
-
         while not self._job_thread_end.is_set():
 
-            now = time.time()
+            next_wakeup = self._process_jobs(self._clock())
 
-            next_wakeup = self.j1939_dll.async_job_thread(now)
-
-            # check timer events
-            for event in self._timer_events:
-                if event['deadline'] > now:
-                    if next_wakeup > event['deadline']:
-                        next_wakeup = event['deadline']
-                else:
-                    # deadline reached
-                    logger.debug("Deadline for event reached")
-                    if event['callback']( event['cookie'] ) == True:
-                        # "true" means the callback wants to be called again
-                        while event['deadline'] < now:
-                            # just to take care of overruns
-                            event['deadline'] += event['delta_time']
-                        # recalc next wakeup
-                        if next_wakeup > event['deadline']:
-                            next_wakeup = event['deadline']
-                    else:
-                        # remove from list
-                        self._timer_events.remove( event )
-
-            time_to_sleep = next_wakeup - time.time()
+            time_to_sleep = next_wakeup - self._clock()
             if time_to_sleep > 0:
                 try:
                     self._job_thread_wakeup_queue.get(True, time_to_sleep)
@@ -336,15 +673,75 @@ class ElectronicControlUnit:
                     # do nothing
                     pass
 
+    def process_jobs(self):
+        """Processes the jobs with reached deadline at the current time of the clock
+
+        Only required for an ECU created with a clock, see :class:`ElectronicControlUnit`.
+        The jobs are the timeouts of the transport protocols and the timer events.
+
+        :return:
+            The time of the next job.
+        """
+        return self._process_jobs(self._clock())
+
+    def _process_jobs(self, now):
+        """Processes the data link layer and timer events with reached deadline
+
+        :param float now:
+            The current time in seconds.
+        :return:
+            The time of the next event to be processed.
+        """
+        self._statistics.job_wakeups += 1
+        next_wakeup = self.j1939_dll.async_job_thread(now)
+        for segment in self._segments:
+            next_wakeup = min(next_wakeup, segment.j1939_dll.async_job_thread(now))
+
+        # check timer events, only the events with reached deadline are touched
+        # repeating events are rescheduled after the loop, each event is called at most once per run
+        repeating = []
+        while True:
+            with self._timer_lock:
+                if not self._timer_events or self._timer_events[0][0] > now:
+                    break
+                _, _, timer = heapq.heappop(self._timer_events)
+                if timer.cancelled:
+                    continue
+                self._timer_running = timer
+            # deadline reached
+            logger.debug("Deadline for event reached")
+            repeat = timer.callback( timer.cookie ) == True
+            with self._timer_lock:
+                self._timer_running = None
+            if repeat:
+                # "true" means the callback wants to be called again
+                repeating.append(timer)
+
+        # reschedule the repeating events and recalc next wakeup
+        with self._timer_lock:
+            for timer in repeating:
+                if timer.cancelled:
+                    continue
+                if timer.deadline <= now:
+                    # next event after now, skips the missed events of an overrun (e.g. a jump of a virtual clock)
+                    interval = max(timer.delta_time, Timer.MINIMUM_INTERVAL)
+                    timer.deadline += (math.floor((now - timer.deadline) / interval) + 1) * interval
+                heapq.heappush(self._timer_events, [timer.deadline, next(self._timer_sequence), timer])
+            if self._timer_events and (next_wakeup > self._timer_events[0][0]):
+                next_wakeup = self._timer_events[0][0]
+
+        return next_wakeup
+
     def _job_thread_wakeup(self):
         """Wakeup the async job thread
 
         By calling this function we wakeup the asyncronous job thread to
         force a recalculation of his next wakeup event.
         """
-        self._job_thread_wakeup_queue.put(1)
+        if self._job_thread is not None:
+            self._job_thread_wakeup_queue.put(1)
 
-    def _notify_subscribers(self, priority, pgn, sa, dest, timestamp, data):
+    def _notify_subscribers(self, priority, pgn, sa, dest, timestamp, data, segment=0):
         """Feed incoming message to subscribers.
 
         :param int priority:
@@ -359,20 +756,250 @@ class ElectronicControlUnit:
             Timestamp of the CAN message
         :param bytearray data:
             Data of the PDU
+        :param int segment:
+            Index of the segment the message was received on
+        """
+        if self._routing_table is not None:
+            self._forward(segment, priority, pgn, sa, dest, timestamp, data)
+        # received PDUs only, the EOM_ACK notifications of sent transfers bypass this method
+        if self._latest_values is not None:
+            self._latest_values.update(pgn, sa, timestamp, data)
+        self._notify_local_subscribers(priority, pgn, sa, dest, timestamp, data)
+
+    def _notify_local_subscribers(self, priority, pgn, sa, dest, timestamp, data):
+        """Feed incoming message to the subscribers of this ECU without forwarding it
+
+        See :meth:`_notify_subscribers` for the parameters.
+        """
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.PDU_DELIVERED, Tracer.pdu_key(priority, pgn, sa, dest))
+        if self._dispatcher is not None:
+            self._dispatcher.submit(priority, pgn, sa, dest, timestamp, data)
+        else:
+            self._dispatch_subscribers(priority, pgn, sa, dest, timestamp, data)
+
+    def _dispatch_subscribers(self, priority, pgn, sa, dest, timestamp, data):
+        """Calls the subscriber callbacks for a message
+
+        See :meth:`_notify_subscribers` for the parameters.
         """
         logger.debug("notify subscribers for PGN {}".format(pgn))
         # notify only the CA for which the message is intended
         # each CA receives all broadcast messages
-        for dic in self._subscribers:
+        subscribers_by_pgn = self._subscribers_by_pgn
+        for dic in subscribers_by_pgn.get(pgn, subscribers_by_pgn[None]):
             if (dic['dev_adr'] == None) or (dest == ParameterGroupNumber.Address.GLOBAL) or (callable(dic['dev_adr']) and dic['dev_adr'](dest)) or (dest == dic['dev_adr']):
-                dic['cb'](priority, pgn, sa, timestamp, data)
+                start = time.perf_counter()
+                if dic['with_dest']:
+                    dic['cb'](priority, pgn, sa, dest, timestamp, data)
+                else:
+                    dic['cb'](priority, pgn, sa, timestamp, data)
+                self._statistics.record_callback(dic['id'], dic['name'], time.perf_counter() - start)
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.SUBSCRIBER_RETURNED, Tracer.pdu_key(priority, pgn, sa, dest))
+
+    def _ca_address_changed(self, ca):
+        """Called by a CA whenever its address claim state or address changes
+
+        :param ca:
+            The :class:`j1939.ControllerApplication` whose address changed.
+        """
+        self.j1939_dll.invalidate_can_id_cache()
+        self.j1939_dll.update_acceptance_table()
+        self._update_can_filters()
+
+    def _forward(self, src_segment, priority, pgn, sa, dest, timestamp, data):
+        """Forwards a received PDU according the routing table"""
+        dst_segments = self._routing_table.lookup(src_segment, pgn, sa, dest)
+        if not dst_segments:
+            return
+        data_page = (pgn >> 16) & 0x01
+        pdu_format = (pgn >> 8) & 0xFF
+        # for PDU1 the destination address is the pdu specific
+        pdu_specific = (pgn & 0xFF) if pdu_format >= 240 else dest
+        for index in dst_segments:
+            dll = self.j1939_dll if index == 0 else self._segments[index - 1].j1939_dll
+            try:
+                if not dll.send_pgn(data_page, pdu_format, pdu_specific, priority, sa, data, 0, FrameFormat.FEFF):
+                    logger.info("PGN %d from 0x%02X could not be forwarded to segment %d", pgn, sa, index)
+            except Exception as e:
+                # Exceptions on the destination segment should not affect the source segment
+                logger.error(str(e))
+
+    def update_acceptance_tables(self):
+        """Recalculates the acceptance tables of the data link layers of the ECU and its segments.
+
+        The data link layers cache the results of :meth:`ControllerApplication.message_acceptable`
+        per destination address. The tables are updated when CAs, subscribers with a device address
+        or routes are added or removed and on every address claim state change. This method must be
+        called whenever the acceptance of a CA changes otherwise, see
+        :meth:`ControllerApplication.update_acceptance`.
+        """
+        self.j1939_dll.update_acceptance_table()
+        for segment in self._segments:
+            segment.j1939_dll.update_acceptance_table()
+        self._update_can_filters()
+
+    def compute_can_filters(self):
+        """Derives the python-can receive filters for the messages the ECU is interested in.
+
+        The filters pass the transport protocol and network management messages,
+        the PGNs of the subscribers and, for subscribers of all PGNs, every broadcast message.
+        Peer-to-peer messages are only passed for the accepted destination addresses,
+        i.e. the addresses claimed by the CAs, the device addresses of the subscribers and GLOBAL.
+        The filters apply to the bus of the ECU only, not to additional segments.
+
+        :return:
+            list of dicts with the keys 'can_id', 'can_mask' and 'extended' as expected by
+            :meth:`can.BusABC.set_filters`, or None if all messages have to be received
+            (a subscriber without device address for all PGNs or a gateway route from the bus).
+        """
+        if (self._routing_table is not None) and self._routing_table.has_routes_from(0):
+            return None
+        table = self.j1939_dll._acceptance_table
+        addresses = [dest_address for dest_address in range(256) if table[dest_address]]
+        pgns = set(int(pgn) for pgn in self.j1939_dll._PROTOCOL_PGNS)
+        all_pgns = False
+        with self._subscribers_lock:
+            for dic in self._subscribers:
+                if dic['pgns'] is not None:
+                    pgns.update(dic['pgns'])
+                elif dic['dev_adr'] is None:
+                    return None
+                else:
+                    all_pgns = True
+
+        filters = set()
+        if all_pgns:
+            # PDU2: pdu format 240..255
+            filters.add((0x00F00000, 0x00F00000))
+            for dest_address in addresses:
+                filters.add((dest_address << 8, 0xFF00))
+        for pgn in pgns:
+            if ((pgn >> 8) & 0xFF) >= 240:
+                filters.add(((pgn & 0x3FFFF) << 8, 0x03FFFF00))
+            else:
+                for dest_address in addresses:
+                    filters.add((((pgn & 0x3FF00) | dest_address) << 8, 0x03FFFF00))
+        return [{'can_id': can_id, 'can_mask': can_mask, 'extended': True} for can_id, can_mask in sorted(filters)]
+
+    def _update_can_filters(self):
+        """Sets the receive filters of the bus if they have changed"""
+        if not self._apply_can_filters or (self._bus is None):
+            return
+        filters = self.compute_can_filters()
+        if filters == self._can_filters:
+            return
+        self._bus.set_filters(filters)
+        self._can_filters = filters
 
     def _is_message_acceptable(self, dest):
         for dic in self._subscribers:
             if dic['dev_adr'] == dest:
                 return True
+        if self._routing_table is not None:
+            return self._routing_table.accepts(0, dest)
         return False
 
+class BusSegment(_BusTransmitter):
+    """A further CAN bus attached to an ECU, created by :meth:`ElectronicControlUnit.add_segment`.
+
+    The segment has its own data link layer. Its timeouts are handled by the job thread of the ECU.
+    """
+
+    def __init__(self, ecu, index, data_link_layer, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, send_message=None):
+        if send_message:
+            self.send_message = send_message
+        #: Index of the segment
+        self.index = index
+        self._ecu = ecu
+        super().__init__(Statistics(), ecu._tracer)
+        self.j1939_dll = ecu._create_data_link_layer(data_link_layer, self.send_frame, self._notify_subscribers, self._is_message_acceptable, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._statistics)
+        self._listeners = [MessageListener(self)]
+        self._notifier = None
+        # the notifier was created by connect()
+        self._own_notifier = False
+
+    def connect(self, *args, **kwargs):
+        """Connect the segment to a CAN bus using python-can.
+
+        Arguments are passed directly to :class:`can.BusABC`.
+        """
+        self._bus = can.interface.Bus(*args, **kwargs)
+        logger.info("Segment %d connected to '%s'", self.index, self._bus.channel_info)
+        self._notifier = can.Notifier(self._bus, self._listeners, 1)
+        self._own_notifier = True
+        return self._bus
+
+    def disconnect(self):
+        """Disconnect the segment from the CAN bus."""
+        self._notifier.stop()
+        self._bus.shutdown()
+        self._bus = None
+
+    def add_bus(self, bus):
+        """Add a bus to the segment.
+
+        :param bus:
+            A :class:`can.BusABC` object.
+        """
+        self._bus = bus
+
+    def add_notifier(self, notifier):
+        """Add a notifier to the segment.
+
+        :param notifier:
+            A :class:`can.Notifier` object.
+        """
+        self._notifier = notifier
+        self._own_notifier = False
+        for listener in self._listeners:
+            self._notifier.add_listener(listener)
+
+    def stop(self):
+        """Stops the reception of the segment, called by :meth:`ElectronicControlUnit.stop`
+
+        A notifier created by :meth:`connect` is stopped, the listeners of the segment
+        are removed from a notifier added by :meth:`add_notifier`.
+        """
+        for listener in self._listeners:
+            listener.stop()
+        if self._notifier is None:
+            return
+        if self._own_notifier:
+            self._notifier.stop()
+        else:
+            for listener in self._listeners:
+                self._notifier.remove_listener(listener)
+
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF, on_complete=None):
+        """send a pgn on this segment, see :meth:`ElectronicControlUnit.send_pgn`"""
+        return self.j1939_dll.send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=on_complete)
+
+    def stats(self, delta=False):
+        """Returns the runtime counters of the segment, see :meth:`ElectronicControlUnit.stats`
+
+        The job handling and the subscriber callbacks are counted by the ECU.
+        """
+        return self._statistics.delta() if delta else self._statistics.snapshot()
+
+    def notify(self, can_id, data, timestamp):
+        """Feed incoming CAN message into this segment, see :meth:`ElectronicControlUnit.notify`"""
+        self._statistics.count_rx(can_id, len(data))
+        self.j1939_dll.notify(can_id, data, timestamp)
+
+    def notify_batch(self, can_ids, datas, timestamps):
+        """Feed a block of incoming CAN messages into this segment, see :meth:`ElectronicControlUnit.notify_batch`"""
+        self._statistics.count_rx_batch(can_ids, np.fromiter(map(len, datas), dtype=np.int64, count=len(datas)))
+        self.j1939_dll.notify_batch(can_ids, datas, timestamps)
+
+    def _notify_subscribers(self, priority, pgn, sa, dest, timestamp, data):
+        self._ecu._notify_subscribers(priority, pgn, sa, dest, timestamp, data, self.index)
+
+    def _is_message_acceptable(self, dest):
+        routing_table = self._ecu._routing_table
+        return (routing_table is not None) and routing_table.accepts(self.index, dest)
+
 class MessageListener(Listener):
     """Listens for messages on CAN bus and feeds them to an ECU instance.
 
@@ -388,6 +1015,10 @@ class MessageListener(Listener):
         if self.stopped or msg.is_error_frame or msg.is_remote_frame or (msg.is_extended_id == False):
             return
 
+        tracer = self.ecu._tracer
+        if tracer is not None:
+            tracer.record(Tracer.Event.FRAME_RECEIVED, msg.arbitration_id)
+
         try:
             self.ecu.notify(msg.arbitration_id, msg.data, msg.timestamp)
         except Exception as e:
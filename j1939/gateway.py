@@ -0,0 +1,140 @@
+import threading
+
+class RoutingTable:
+    """Routing table of a J1939 gateway forwarding PDUs between bus segments.
+
+    A route forwards the PDUs received on a source segment to a destination
+    segment, optionally filtered by PGN, source address (SA) and destination
+    address (DA). Broadcast PDUs have the DA GLOBAL (255).
+
+    The routes are compiled per source segment into a dict keyed by PGN and
+    256 entry lookup tables for SA and DA, so the lookup cost per PDU is
+    independent of the number of routes. Compiled tables are replaced as a
+    whole, lookups do not need a lock.
+    """
+
+    def __init__(self):
+        self._routes = []
+        self._lock = threading.Lock()
+        # source segment -> (dict pgn -> entries, entries for all other pgns)
+        # entries are tuples (destination segment, sa table, da table)
+        self._lookup = {}
+        # segment -> table of destination addresses the segment has to accept
+        self._acceptance = {}
+
+    def add_route(self, src_segment, dst_segment, pgns=None, source_addresses=None, destination_addresses=None):
+        """Adds a route
+
+        :param int src_segment:
+            Index of the segment the PDUs are received on.
+        :param int dst_segment:
+            Index of the segment the PDUs are forwarded to.
+        :param pgns:
+            Optional iterable of PGNs to forward, all PGNs if omitted.
+            PGNs in PDU1 format are given without destination address (PDU specific 0).
+        :param source_addresses:
+            Optional iterable of source addresses to forward, all if omitted.
+        :param destination_addresses:
+            Optional iterable of destination addresses to forward, all if omitted.
+            Include GLOBAL (255) to forward broadcast PDUs.
+        """
+        if src_segment == dst_segment:
+            raise ValueError("source and destination segment must differ")
+        route = {
+            'src': src_segment,
+            'dst': dst_segment,
+            'pgns': None if pgns is None else frozenset(pgns),
+            'sa': self._address_table(source_addresses),
+            'da': self._address_table(destination_addresses),
+        }
+        with self._lock:
+            self._routes.append(route)
+            self._compile()
+
+    def remove_routes(self, src_segment=None, dst_segment=None):
+        """Removes all routes matching the given segments
+
+        :param src_segment:
+            Index of the source segment or None for any.
+        :param dst_segment:
+            Index of the destination segment or None for any.
+        """
+        with self._lock:
+            self._routes = [route for route in self._routes
+                            if not (((src_segment is None) or (route['src'] == src_segment)) and ((dst_segment is None) or (route['dst'] == dst_segment)))]
+            self._compile()
+
+    def lookup(self, src_segment, pgn, sa, da):
+        """Returns the segments a PDU has to be forwarded to
+
+        :param int src_segment:
+            Index of the segment the PDU was received on.
+        :param int pgn:
+            Parameter Group Number of the PDU
+        :param int sa:
+            Source Address of the PDU
+        :param int da:
+            Destination Address of the PDU
+        :return:
+            List of destination segment indices
+        """
+        tables = self._lookup.get(src_segment)
+        if tables is None:
+            return []
+        by_pgn, any_pgn = tables
+        segments = []
+        for dst, sa_table, da_table in by_pgn.get(pgn, any_pgn):
+            if sa_table[sa] and da_table[da] and (dst not in segments):
+                segments.append(dst)
+        return segments
+
+    def accepts(self, segment, da):
+        """Indicates if a segment has to accept peer-to-peer messages for the DA
+
+        The segment accepts the DAs which are forwarded from the segment and
+        the SAs which are forwarded to the segment (for the transport protocol
+        handshake and responses).
+        """
+        table = self._acceptance.get(segment)
+        return (table is not None) and (table[da] != 0)
+
+    def has_routes_from(self, segment):
+        """Indicates if PDUs received on the segment are forwarded"""
+        return segment in self._lookup
+
+    @staticmethod
+    def _address_table(addresses):
+        if addresses is None:
+            return b'\x01' * 256
+        table = bytearray(256)
+        for address in addresses:
+            table[address & 0xFF] = 1
+        return bytes(table)
+
+    def _compile(self):
+        lookup = {}
+        acceptance = {}
+        for route in self._routes:
+            entry = (route['dst'], route['sa'], route['da'])
+            by_pgn, any_pgn = lookup.setdefault(route['src'], ({}, []))
+            if route['pgns'] is None:
+                # routes for all pgns are part of every pgn entry
+                any_pgn.append(entry)
+                for entries in by_pgn.values():
+                    entries.append(entry)
+            else:
+                for pgn in route['pgns']:
+                    if pgn not in by_pgn:
+                        by_pgn[pgn] = list(any_pgn)
+                    by_pgn[pgn].append(entry)
+
+            src_table = acceptance.setdefault(route['src'], bytearray(256))
+            dst_table = acceptance.setdefault(route['dst'], bytearray(256))
+            for address in range(256):
+                if route['da'][address]:
+                    src_table[address] = 1
+                if route['sa'][address]:
+                    dst_table[address] = 1
+
+        self._lookup = lookup
+        self._acceptance = {segment: bytes(table) for segment, table in acceptance.items()}
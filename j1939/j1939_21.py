@@ -1,7 +1,11 @@
 from .parameter_group_number import ParameterGroupNumber
-from .message_id import MessageId
+from .message_id import MessageId, decode_can_id
+from .deadline_index import DeadlineIndex
+from .statistics import Statistics
+from .tracing import Tracer
 import logging
 import time
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -38,11 +42,17 @@ class J1939_21:
         SENDING_BM              = 2 # sending broadcast packages
         TRANSMISSION_FINISHED   = 3 # finished, remove buffer
 
-    def __init__(self, send_message, job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable):
+    class BufferType:
+        RCV = 0 # receive buffer
+        SND = 1 # send buffer
+
+    def __init__(self, send_message, job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable, notify_eom_ack=None, statistics=None, tracer=None, clock=None):
         # Receive buffers
         self._rcv_buffer = {}
         # Send buffers
         self._snd_buffer = {}
+        # Deadlines of all buffers, the keys are (BufferType, buffer_hash)
+        self._deadline_index = DeadlineIndex()
 
         # List of ControllerApplication
         self._cas = []
@@ -62,18 +72,110 @@ class J1939_21:
         self.__job_thread_wakeup = job_thread_wakeup
         self.__send_message = send_message
         self.__notify_subscribers = notify_subscribers
+        # receiver of the end of message acknowledgements, by default the subscribers
+        self.__notify_eom_ack = notify_eom_ack if notify_eom_ack is not None else notify_subscribers
         self.__ecu_is_message_acceptable = ecu_is_message_acceptable
+        # runtime counters of the transport protocol
+        self._statistics = statistics if statistics is not None else Statistics()
+        # optional j1939.Tracer recording the classification and reassembly of the frames
+        self._tracer = tracer
+        # time source of the deadlines, the wall clock or the virtual clock of a log replay
+        self._clock = clock if clock is not None else time.time
+
+        # acceptance table for peer-to-peer messages, indexed by the destination address
+        # 1: the destination address is handled by this ECU, 0: the message is rejected
+        self._acceptance_table = bytes(255) + b'\x01'
+
+        # CAN-ID cache for the transport protocol and control frames, keyed by (pgn, priority, sa, da)
+        self._can_id_cache = {}
 
     def add_ca(self, ca):
         self._cas.append(ca)
+        self.update_acceptance_table()
 
     def remove_ca(self, device_address):
         for ca in self._cas:
             if device_address == ca._device_address_preferred:
                 self._cas.remove(ca)
+                self.update_acceptance_table()
                 return True
         return False
 
+    def update_acceptance_table(self):
+        """Recalculates the acceptance table for peer-to-peer messages
+
+        Has to be called whenever the result of the acceptance check for a
+        destination address may change, e.g. after an address claim,
+        after adding/removing subscribers with a device address or when a CA
+        overriding message_acceptable() changes its acceptance, see
+        :meth:`ControllerApplication.update_acceptance`.
+        """
+        table = bytearray(256)
+        for dest_address in range(256):
+            if self.__ecu_is_message_acceptable(dest_address): # simple peer-to-peer reception without adding a controller-application
+                table[dest_address] = 1
+                continue
+            for ca in self._cas:
+                if ca.message_acceptable(dest_address):
+                    table[dest_address] = 1
+                    break
+        table[ParameterGroupNumber.Address.GLOBAL] = 1
+        # replace the whole table, so the receive path never sees a partly updated table
+        self._acceptance_table = bytes(table)
+
+    def _can_id(self, pgn_value, priority, src_address, dest_address):
+        """Returns the 29-bit CAN-ID for a PDU1 message from the CAN-ID cache
+
+        :param int pgn_value:
+            The PGN with PDU specific 0.
+        :param int priority:
+            The priority of the message.
+        :param src_address:
+            The Source-Address of the message.
+        :param dest_address:
+            The Destination-Address of the message.
+        """
+        key = (pgn_value, priority, src_address, dest_address)
+        can_id = self._can_id_cache.get(key)
+        if can_id is None:
+            pgn = ParameterGroupNumber((pgn_value >> 16) & 0x1, (pgn_value >> 8) & 0xFF, dest_address)
+            can_id = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address).can_id
+            self._can_id_cache[key] = can_id
+        return can_id
+
+    def invalidate_can_id_cache(self):
+        """Clears the CAN-ID cache
+
+        Called whenever an address is (re-)claimed, so the cache only holds the IDs of current connections.
+        """
+        self._can_id_cache = {}
+
+    def __set_deadline(self, buffer_type, buffer_hash, buf, deadline, wakeup=True):
+        """Sets the deadline of a buffer and updates the deadline index
+
+        The job thread is only woken up if the deadline is the earliest one.
+        """
+        buf['deadline'] = deadline
+        if self._deadline_index.set((buffer_type, buffer_hash), deadline) and wakeup:
+            self.__job_thread_wakeup()
+
+    def __remove_rcv_buffer(self, buffer_hash):
+        del self._rcv_buffer[buffer_hash]
+        self._deadline_index.discard((self.BufferType.RCV, buffer_hash))
+
+    def __remove_snd_buffer(self, buffer_hash):
+        del self._snd_buffer[buffer_hash]
+        self._deadline_index.discard((self.BufferType.SND, buffer_hash))
+
+    def __transmission_finished(self, buf, success):
+        """Informs the sender of a pgn about the end of its transmission
+
+        The completion callback of the buffer is called only once.
+        """
+        on_complete = buf.pop('on_complete', None)
+        if on_complete is not None:
+            on_complete(success)
+
     def _buffer_hash(self, src_address, dest_address):
         """Calcluates a hash value for the given address pair
 
@@ -89,12 +191,14 @@ class J1939_21:
         """
         return ((src_address & 0xFF) << 8) | (dest_address & 0xFF)
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format):
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=None):
         pgn = ParameterGroupNumber(data_page, pdu_format, pdu_specific)
         if len(data) <= 8:
             # send normal message
             mid = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address)
             self.__send_message(mid.can_id, True, data)
+            if on_complete is not None:
+                on_complete(True)
         else:
             # if the PF is between 0 and 239, the message is destination dependent when pdu_specific != 255
             # if the PF is between 240 and 255, the message can only be broadcast
@@ -111,10 +215,13 @@ class J1939_21:
                 return False
             message_size = len(data)
             num_packets = int(message_size / 7) if (message_size % 7 == 0) else int(message_size / 7) + 1
+            # the packets are sliced from an immutable copy of the payload without further copies
+            data = memoryview(bytes(data))
 
             # if the PF is between 240 and 255, the message can only be broadcast
             if dest_address == ParameterGroupNumber.Address.GLOBAL:
                 # send BAM
+                self._statistics.count_tp_opened()
                 self.__send_tp_bam(src_address, priority, pgn.value, message_size, num_packets)
 
                 # init new buffer for this connection
@@ -125,11 +232,13 @@ class J1939_21:
                         "num_packages": num_packets,
                         "data": data,
                         "state": self.SendBufferState.SENDING_BM,
-                        "deadline": time.time() + self._minimum_tp_bam_dt_interval,
+                        "deadline": 0,
                         'src_address' : src_address,
                         'dest_address' : ParameterGroupNumber.Address.GLOBAL,
                         'next_packet_to_send' : 0,
+                        'on_complete': on_complete,
                     }
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self._minimum_tp_bam_dt_interval)
             else:
                 # send RTS/CTS
                 pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
@@ -141,16 +250,17 @@ class J1939_21:
                         "num_packages": num_packets,
                         "data": data,
                         "state": self.SendBufferState.WAITING_CTS,
-                        "deadline": time.time() + self.Timeout.T3,
+                        "deadline": 0,
                         'src_address' : src_address,
                         'dest_address' : pdu_specific,
                         'next_packet_to_send' : 0,
                         'next_wait_on_cts': 0,
+                        'on_complete': on_complete,
                     }
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self.Timeout.T3)
+                self._statistics.count_tp_opened()
                 self.__send_tp_rts(src_address, pdu_specific, priority, pgn.value, message_size, num_packets, min(self._max_cmdt_packets, num_packets))
 
-            self.__job_thread_wakeup()
-
         return True
 
 
@@ -158,109 +268,111 @@ class J1939_21:
 
         next_wakeup = now + 5.0 # wakeup in 5 seconds
 
-        # check receive buffers for timeout
-        # using "list(x)" to prevent "RuntimeError: dictionary changed size during iteration"
-        for bufid in list(self._rcv_buffer):
-            buf = self._rcv_buffer[bufid]
-            if buf['deadline'] != 0:
-                if buf['deadline'] > now:
-                    if next_wakeup > buf['deadline']:
-                        next_wakeup = buf['deadline']
-                else:
-                    # deadline reached
-                    logger.info("Deadline reached for rcv_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
-                    if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
-                        # TODO: should we handle retries?
-                        self.__send_tp_abort(buf['dest_address'], buf['src_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
-                    # TODO: should we notify our CAs about the cancelled transfer?
-                    del self._rcv_buffer[bufid]
-
-        # check send buffers
-        # using "list(x)" to prevent "RuntimeError: dictionary changed size during iteration"
-        for bufid in list(self._snd_buffer):
+        # only buffers with reached deadline are processed
+        for buffer_type, bufid in self._deadline_index.pop_expired(now):
+            if buffer_type == self.BufferType.RCV:
+                # check receive buffers for timeout
+                if bufid not in self._rcv_buffer:
+                    continue
+                buf = self._rcv_buffer[bufid]
+                # deadline reached
+                logger.info("Deadline reached for rcv_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
+                self._statistics.count_tp_timeout()
+                if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
+                    # TODO: should we handle retries?
+                    self.__send_tp_abort(buf['dest_address'], buf['src_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
+                # TODO: should we notify our CAs about the cancelled transfer?
+                self.__remove_rcv_buffer(bufid)
+                continue
+
+            # check send buffers
+            if bufid not in self._snd_buffer:
+                continue
             buf = self._snd_buffer[bufid]
-            if buf['deadline'] != 0:
-                if buf['deadline'] > now:
-                    if next_wakeup > buf['deadline']:
-                        next_wakeup = buf['deadline']
+            # deadline reached
+            if buf['state'] == self.SendBufferState.WAITING_CTS:
+                logger.info("Deadline WAITING_CTS reached for snd_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
+                self._statistics.count_tp_timeout()
+                self.__send_tp_abort(buf['src_address'], buf['dest_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
+                # TODO: should we notify our CAs about the cancelled transfer?
+                self.__remove_snd_buffer(bufid)
+                self.__transmission_finished(buf, False)
+            elif buf['state'] == self.SendBufferState.SENDING_IN_CTS:
+                while buf['next_packet_to_send'] < buf['num_packages']:
+                    package = buf['next_packet_to_send']
+                    data = self._tp_dt_data(buf['data'], package)
+
+                    # modify the snd_buffer state in anticipation
+                    # of the message we are about to transmit
+
+                    buf['next_packet_to_send'] += 1
+
+                    should_break = False
+                    if package == buf['next_wait_on_cts']:
+                        # wait on next cts
+                        buf['state'] = self.SendBufferState.WAITING_CTS
+                        self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self.Timeout.T3, wakeup=False)
+                        should_break = True
+                    elif self._minimum_tp_rts_cts_dt_interval != None:
+                        self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self._minimum_tp_rts_cts_dt_interval, wakeup=False)
+                        should_break = True
+
+                    # state is ready for recv - Now send the message
+                    self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                    if should_break:
+                        break
+
+            elif buf['state'] == self.SendBufferState.SENDING_BM:
+                # send next broadcast message...
+                data = self._tp_dt_data(buf['data'], buf['next_packet_to_send'])
+
+                # modify the snd_buffer state in anticipation
+                # of the message we are about to transmit
+
+                buf['next_packet_to_send'] += 1
+
+                if buf['next_packet_to_send'] < buf['num_packages']:
+                    self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self._minimum_tp_bam_dt_interval, wakeup=False)
                 else:
-                    # deadline reached
-                    if buf['state'] == self.SendBufferState.WAITING_CTS:
-                        logger.info("Deadline WAITING_CTS reached for snd_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
-                        self.__send_tp_abort(buf['src_address'], buf['dest_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
-                        # TODO: should we notify our CAs about the cancelled transfer?
-                        del self._snd_buffer[bufid]
-                    elif buf['state'] == self.SendBufferState.SENDING_IN_CTS:
-                        while buf['next_packet_to_send'] < buf['num_packages']:
-                            package = buf['next_packet_to_send']
-                            offset = package * 7
-                            data = buf['data'][offset:]
-                            if len(data)>7:
-                                data = data[:7]
-                            else:
-                                while len(data)<7:
-                                    data.append(255)
-                            data.insert(0, package+1)
-
-                            # modify the snd_buffer state in anticipation
-                            # of the message we are about to transmit
-
-                            buf['next_packet_to_send'] += 1
-
-                            should_break = False
-                            if package == buf['next_wait_on_cts']:
-                                # wait on next cts
-                                buf['state'] = self.SendBufferState.WAITING_CTS
-                                buf['deadline'] = time.time() + self.Timeout.T3
-                                should_break = True
-                            elif self._minimum_tp_rts_cts_dt_interval != None:
-                                buf['deadline'] = time.time() + self._minimum_tp_rts_cts_dt_interval
-                                should_break = True
-
-                            # state is ready for recv - Now send the message
-                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
-                            if should_break:
-                                break
-
-                        # recalc next wakeup
-                        if next_wakeup > buf['deadline']:
-                            next_wakeup = buf['deadline']
-
-                    elif buf['state'] == self.SendBufferState.SENDING_BM:
-                        # send next broadcast message...
-                        offset = buf['next_packet_to_send'] * 7
-                        data = buf['data'][offset:]
-                        if len(data)>7:
-                            data = data[:7]
-                        else:
-                            while len(data)<7:
-                                data.append(255)
-                        data.insert(0, buf['next_packet_to_send']+1)
-
-                        # modify the snd_buffer state in anticipation
-                        # of the message we are about to transmit
-
-                        buf['next_packet_to_send'] += 1
-
-                        if buf['next_packet_to_send'] < buf['num_packages']:
-                            buf['deadline'] = time.time() + self._minimum_tp_bam_dt_interval
-                            # recalc next wakeup
-                            if next_wakeup > buf['deadline']:
-                                next_wakeup = buf['deadline']
-                        else:
-                            # done
-                            del self._snd_buffer[bufid]
-
-                        # state is updated and ready for recv - now send data
-                        self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
-                    elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
-                        del self._snd_buffer[bufid]
-                    else:
-                        logger.critical("unknown SendBufferState %d", buf['state'])
-                        del self._snd_buffer[bufid]
+                    # done
+                    self.__remove_snd_buffer(bufid)
+
+                # state is updated and ready for recv - now send data
+                self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                if buf['next_packet_to_send'] >= buf['num_packages']:
+                    self._statistics.count_tp_completed()
+                    self.__transmission_finished(buf, True)
+            elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
+                self.__remove_snd_buffer(bufid)
+            else:
+                logger.critical("unknown SendBufferState %d", buf['state'])
+                self.__remove_snd_buffer(bufid)
+                self.__transmission_finished(buf, False)
+
+        # recalc next wakeup
+        next_deadline = self._deadline_index.next_deadline()
+        if (next_deadline is not None) and (next_wakeup > next_deadline):
+            next_wakeup = next_deadline
 
         return next_wakeup
 
+    @staticmethod
+    def _tp_dt_data(payload, package):
+        """Returns the data of a TP.DT frame
+
+        :param memoryview payload:
+            The payload of the transfer.
+        :param int package:
+            Zero-based number of the package.
+        :return:
+            bytearray with the sequence number and 7 bytes of the payload, padded with 0xFF.
+        """
+        offset = package * 7
+        chunk = payload[offset:offset + 7]
+        data = bytearray(b'\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF')
+        data[0] = package + 1
+        data[1:1 + len(chunk)] = chunk
+        return data
 
     def _process_tp_cm(self, mid, dest_address, data, timestamp):
         """Processes a Transport Protocol Connection Management (TP.CM) message
@@ -301,14 +413,16 @@ class J1939_21:
                     'next_packet': min(self._max_cmdt_packets, max_num_packages),
                     'max_cmdt_packages': self._max_cmdt_packets,
                     'num_packages_max_rec': min(self._max_cmdt_packets, max_num_packages),
-                    'data': [],
-                    'deadline': time.time() + self.Timeout.T2,
+                    'data': bytearray(message_size),
+                    'received': 0,
+                    'deadline': 0,
                     'src_address' : src_address,
                     'dest_address' : dest_address,
                 }
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T2)
+            self._statistics.count_tp_opened()
 
             self.__send_tp_cts(dest_address, src_address, self._rcv_buffer[buffer_hash]['num_packages_max_rec'], 1, pgn)
-            self.__job_thread_wakeup()
         elif control_byte == self.ConnectionMode.CTS:
             num_packages = data[1]
             next_package_number = data[2] - 1
@@ -319,8 +433,8 @@ class J1939_21:
             if num_packages == 0:
                 # SAE J1939/21
                 # receiver requests a pause
-                self._snd_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.Th
-                self.__job_thread_wakeup()
+                self._statistics.count_cts_pause()
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self.Timeout.Th)
                 return
 
             num_packages_all = self._snd_buffer[buffer_hash]["num_packages"]
@@ -334,8 +448,8 @@ class J1939_21:
             self._snd_buffer[buffer_hash]['next_wait_on_cts'] = self._snd_buffer[buffer_hash]['next_packet_to_send'] + num_packages - 1
 
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.SENDING_IN_CTS
-            self._snd_buffer[buffer_hash]['deadline'] = time.time()
-            self.__job_thread_wakeup()
+            # wake up immediately
+            self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock())
 
 
         elif control_byte == self.ConnectionMode.EOM_ACK:
@@ -345,19 +459,20 @@ class J1939_21:
                 return
             # TODO: should we inform the application about the successful transmission?
             # Notify subscribers here to be used for the memory access server to know when to send operation complete
-            self.__notify_subscribers(mid.priority,pgn,mid.source_address,dest_address,timestamp,data)
+            self.__notify_eom_ack(mid.priority,pgn,mid.source_address,dest_address,timestamp,data)
 
+            self._statistics.count_tp_completed()
+
+            self.__transmission_finished(self._snd_buffer[buffer_hash], True)
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
-            self._snd_buffer[buffer_hash]['deadline'] = time.time()
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock())
         elif control_byte == self.ConnectionMode.BAM:
             message_size = data[1] | (data[2] << 8)
             num_packages = data[3]
             buffer_hash = self._buffer_hash(src_address, dest_address)
             if buffer_hash in self._rcv_buffer:
                 # TODO: should we deliver the partly received message to our CAs?
-                del self._rcv_buffer[buffer_hash]
-                self.__job_thread_wakeup()
+                self.__remove_rcv_buffer(buffer_hash)
 
             # init new buffer for this connection
             self._rcv_buffer[buffer_hash] = {
@@ -366,18 +481,22 @@ class J1939_21:
                     "num_packages": num_packages,
                     "next_packet": 1,
                     "max_cmdt_packages": self._max_cmdt_packets,
-                    "data": [],
-                    "deadline": time.time() + self.Timeout.T1,
+                    "data": bytearray(message_size),
+                    "received": 0,
+                    "deadline": 0,
                     'src_address' : src_address,
                     'dest_address' : dest_address,
                 }
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T1)
+            self._statistics.count_tp_opened()
         elif control_byte == self.ConnectionMode.ABORT:
+            self._statistics.count_tp_aborted(data[1])
             # if abort received before transmission established -> cancel transmission
             buffer_hash = self._buffer_hash(dest_address, src_address)
             if buffer_hash in self._snd_buffer and self._snd_buffer[buffer_hash]['state'] == self.SendBufferState.WAITING_CTS:
+                self.__transmission_finished(self._snd_buffer[buffer_hash], False)
                 self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
-                self._snd_buffer[buffer_hash]['deadline'] = time.time()
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock())
             # TODO: any more abort responses?
             pass
         else:
@@ -393,20 +512,24 @@ class J1939_21:
             # TODO: LOG/TRACE/EXCEPTION?
             return
 
-        # get data
-        self._rcv_buffer[buffer_hash]['data'].extend(data[1:])
+        # copy data into the preallocated buffer, padding bytes behind the message size are dropped
+        buf = self._rcv_buffer[buffer_hash]
+        offset = buf['received']
+        length = min(len(data) - 1, buf['message_size'] - offset)
+        buf['data'][offset:offset + length] = data[1:1 + length]
+        buf['received'] = offset + length
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.TP_SEGMENT_STORED, mid.can_id)
 
         # message is complete with sending an acknowledge
-        if len(self._rcv_buffer[buffer_hash]['data']) >= self._rcv_buffer[buffer_hash]['message_size']:
+        if buf['received'] >= buf['message_size']:
             logger.info("finished RCV of PGN {} with size {}".format(self._rcv_buffer[buffer_hash]['pgn'], self._rcv_buffer[buffer_hash]['message_size']))
-            # shorten data to message_size
-            self._rcv_buffer[buffer_hash]['data'] = self._rcv_buffer[buffer_hash]['data'][:self._rcv_buffer[buffer_hash]['message_size']]
             # finished reassembly
+            self._statistics.count_tp_completed()
             if dest_address != ParameterGroupNumber.Address.GLOBAL:
                 self.__send_tp_eom_ack(dest_address, src_address, self._rcv_buffer[buffer_hash]['message_size'], self._rcv_buffer[buffer_hash]['num_packages'], self._rcv_buffer[buffer_hash]['pgn'])
             self.__notify_subscribers(mid.priority, self._rcv_buffer[buffer_hash]['pgn'], src_address, dest_address, timestamp, self._rcv_buffer[buffer_hash]['data'])
-            del self._rcv_buffer[buffer_hash]
-            self.__job_thread_wakeup()
+            self.__remove_rcv_buffer(buffer_hash)
             return
 
         # clear to send
@@ -421,52 +544,45 @@ class J1939_21:
             self._rcv_buffer[buffer_hash]['next_packet'] = min(self._rcv_buffer[buffer_hash]['next_packet'] + self._rcv_buffer[buffer_hash]['num_packages_max_rec'],
                                                                self._rcv_buffer[buffer_hash]['num_packages'])
 
-            self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T2
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T2)
             return
 
-        self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T1
-        self.__job_thread_wakeup()
+        # a later deadline does not require to wake up the job thread
+        self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T1)
 
     def __send_tp_dt(self, src_address, dest_address, data):
-        pgn = ParameterGroupNumber(0, 235, dest_address)
-        mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
-        self.__send_message(mid.can_id, True, data)
+        self.__send_message(self._can_id(ParameterGroupNumber.PGN.DATATRANSFER, 7, src_address, dest_address), True, data)
 
     def __send_tp_abort(self, src_address, dest_address, reason, pgn_value):
-        pgn = ParameterGroupNumber(0, 236, dest_address)
-        mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
-        data = [self.ConnectionMode.ABORT, reason, 0xFF, 0xFF, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF]
-        self.__send_message(mid.can_id, True, data)
+        self._statistics.count_tp_aborted(reason)
+        can_id = self._can_id(ParameterGroupNumber.PGN.TP_CM, 7, src_address, dest_address)
+        data = bytearray((self.ConnectionMode.ABORT, reason, 0xFF, 0xFF, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF))
+        self.__send_message(can_id, True, data)
 
     def __send_tp_cts(self, src_address, dest_address, num_packets, next_packet, pgn_value):
-        pgn = ParameterGroupNumber(0, 236, dest_address)
-        mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
-        data = [self.ConnectionMode.CTS, num_packets, next_packet, 0xFF, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF]
-        self.__send_message(mid.can_id, True, data)
+        can_id = self._can_id(ParameterGroupNumber.PGN.TP_CM, 7, src_address, dest_address)
+        data = bytearray((self.ConnectionMode.CTS, num_packets, next_packet, 0xFF, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF))
+        self.__send_message(can_id, True, data)
 
     def __send_tp_eom_ack(self, src_address, dest_address, message_size, num_packets, pgn_value):
-        pgn = ParameterGroupNumber(0, 236, dest_address)
-        mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
-        data = [self.ConnectionMode.EOM_ACK, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF]
-        self.__send_message(mid.can_id, True, data)
+        can_id = self._can_id(ParameterGroupNumber.PGN.TP_CM, 7, src_address, dest_address)
+        data = bytearray((self.ConnectionMode.EOM_ACK, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF))
+        self.__send_message(can_id, True, data)
 
     def __send_tp_rts(self, src_address, dest_address, priority, pgn_value, message_size, num_packets, max_cmdt_packets):
-        pgn = ParameterGroupNumber(0, 236, dest_address)
-        mid = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address)
-        data = [self.ConnectionMode.RTS, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, max_cmdt_packets, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF]
-        self.__send_message(mid.can_id, True, data)
+        can_id = self._can_id(ParameterGroupNumber.PGN.TP_CM, priority, src_address, dest_address)
+        data = bytearray((self.ConnectionMode.RTS, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, max_cmdt_packets, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF))
+        self.__send_message(can_id, True, data)
 
     def __send_acknowledgement(self, control_byte, group_function_value, address_acknowledged, pgn):
-        data = [control_byte, group_function_value, 0xFF, 0xFF, address_acknowledged, (pgn & 0xFF), ((pgn >> 8) & 0xFF), ((pgn >> 16) & 0xFF)]
+        data = bytearray((control_byte, group_function_value, 0xFF, 0xFF, address_acknowledged, (pgn & 0xFF), ((pgn >> 8) & 0xFF), ((pgn >> 16) & 0xFF)))
         mid = MessageId(priority=6, parameter_group_number=0x00E800, source_address=255)
         self.__send_message(mid.can_id, True, data)
 
     def __send_tp_bam(self, src_address, priority, pgn_value, message_size, num_packets):
-        pgn = ParameterGroupNumber(0, 236, ParameterGroupNumber.Address.GLOBAL)
-        mid = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address)
-        data = [self.ConnectionMode.BAM, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF]
-        self.__send_message(mid.can_id, True, data)
+        can_id = self._can_id(ParameterGroupNumber.PGN.TP_CM, priority, src_address, ParameterGroupNumber.Address.GLOBAL)
+        data = bytearray((self.ConnectionMode.BAM, message_size & 0xFF, (message_size >> 8) & 0xFF, num_packets, 0xFF, pgn_value & 0xFF, (pgn_value >> 8) & 0xFF, (pgn_value >> 16) & 0xFF))
+        self.__send_message(can_id, True, data)
 
     def notify(self, can_id, data, timestamp):
         """Feed incoming CAN message into this ecu.
@@ -485,43 +601,94 @@ class J1939_21:
             Where possible this will be timestamped in hardware.
         """
 
-        mid = MessageId(can_id=can_id)
-        pgn = ParameterGroupNumber()
-        pgn.from_message_id(mid)
+        priority, pgn_value, src_address, dest_address, is_pdu2 = decode_can_id(can_id)
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.FRAME_CLASSIFIED, can_id)
 
-        if pgn.is_pdu2_format:
+        if is_pdu2:
             # direct broadcast
-            self.__notify_subscribers(mid.priority, pgn.value, mid.source_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
+            self.__notify_subscribers(priority, pgn_value, src_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
             return
 
         # peer to peer
-        # pdu_specific is destination Address
-        pgn_value = pgn.value & 0x1FF00
-        dest_address = pgn.pdu_specific # may be Address.GLOBAL
-
-        # iterate all CAs to check if we have to handle this destination address
-        if dest_address != ParameterGroupNumber.Address.GLOBAL:
-            if not self.__ecu_is_message_acceptable(dest_address): # simple peer-to-peer reception without adding a controller-application
-                reject = True
-                for ca in self._cas:
-                    if ca.message_acceptable(dest_address):
-                        reject = False
-                        break
-                if reject == True:
-                    return
+        # pdu_specific is destination Address (may be Address.GLOBAL)
+
+        # check if we have to handle this destination address
+        if not self._acceptance_table[dest_address]:
+            return
 
         if pgn_value == ParameterGroupNumber.PGN.ADDRESSCLAIM:
+            mid = MessageId.from_can_id(can_id)
             for ca in self._cas:
                 ca._process_addressclaim(mid, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.REQUEST:
+            mid = MessageId.from_can_id(can_id)
             for ca in self._cas:
                 if ca.message_acceptable(dest_address):
                     ca._process_request(mid, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.TP_CM:
-            self._process_tp_cm(mid, dest_address, data, timestamp)
+            self._process_tp_cm(MessageId.from_can_id(can_id), dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.DATATRANSFER:
-            self._process_tp_dt(mid, dest_address, data, timestamp)
+            self._process_tp_dt(MessageId.from_can_id(can_id), dest_address, data, timestamp)
         else:
-            self.__notify_subscribers(mid.priority, pgn_value, mid.source_address, dest_address, timestamp, data)
+            self.__notify_subscribers(priority, pgn_value, src_address, dest_address, timestamp, data)
+            return
+
+    # PGNs handled by the data link layer itself, not delivered directly to the subscribers (with PDU specific == 0)
+    _PROTOCOL_PGNS = np.array([
+        ParameterGroupNumber.PGN.ADDRESSCLAIM,
+        ParameterGroupNumber.PGN.REQUEST,
+        ParameterGroupNumber.PGN.TP_CM,
+        ParameterGroupNumber.PGN.DATATRANSFER,
+    ], dtype=np.uint32)
+
+    def notify_batch(self, can_ids, datas, timestamps):
+        """Feed a block of incoming CAN messages into this ecu.
+
+        The CAN-IDs of the whole block are classified in one vectorized pass.
+        Plain PDUs are delivered directly to the subscribers, all other messages
+        (e.g. transport protocol, address claim, request) are processed by :meth:`notify`.
+        The messages are handled in the given order.
+
+        :param can_ids:
+            Sequence or array of 29-bit CAN-IDs
+        :param datas:
+            Sequence with the data part of each message
+        :param timestamps:
+            Sequence with the timestamp of each message
+        """
+        can_ids = np.asarray(can_ids, dtype=np.uint32)
+        if can_ids.size == 0:
             return
 
+        priorities = ((can_ids >> 26) & 0x7).tolist()
+        source_addresses = (can_ids & 0xFF).tolist()
+        pgns = (can_ids >> 8) & 0x1FFFF
+        pdu_specifics = pgns & 0xFF
+        is_pdu2 = ((pgns >> 8) & 0xFF) >= 240
+        # PDU1: the pdu_specific is the destination address and not part of the pgn
+        pgn_values = np.where(is_pdu2, pgns, pgns & 0x1FF00).tolist()
+        dest_addresses = np.where(is_pdu2, ParameterGroupNumber.Address.GLOBAL, pdu_specifics)
+        special = (~is_pdu2 & np.isin(pgns & 0x1FF00, self._PROTOCOL_PGNS)).tolist()
+
+        def acceptance(table):
+            return (is_pdu2 | (np.frombuffer(table, dtype=np.uint8)[pdu_specifics] != 0)).tolist()
+
+        table = self._acceptance_table
+        accepted = acceptance(table)
+        dest_addresses = dest_addresses.tolist()
+
+        for i in range(len(pgn_values)):
+            if table is not self._acceptance_table:
+                # the acceptance table was updated by a previous message (e.g. address claim)
+                table = self._acceptance_table
+                accepted = acceptance(table)
+            if (self._tracer is not None) and not special[i]:
+                # special messages are classified by notify()
+                self._tracer.record(Tracer.Event.FRAME_CLASSIFIED, int(can_ids[i]))
+            if not accepted[i]:
+                continue
+            if special[i]:
+                self.notify(int(can_ids[i]), datas[i], timestamps[i])
+            else:
+                self.__notify_subscribers(priorities[i], pgn_values[i], source_addresses[i], dest_addresses[i], timestamps[i], datas[i])
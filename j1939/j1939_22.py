@@ -1,5 +1,8 @@
 from .parameter_group_number import ParameterGroupNumber
-from .message_id import MessageId, FrameFormat
+from .message_id import MessageId, FrameFormat, decode_can_id
+from .deadline_index import DeadlineIndex
+from .statistics import Statistics
+from .tracing import Tracer
 import logging
 import time
 import numpy as np
@@ -52,19 +55,26 @@ class J1939_22:
         EOM_ACK_RECEIVED        = 5 # eom acknowledge received successfully
         TRANSMISSION_FINISHED   = 6 # finished, remove buffer
 
+    class BufferType:
+        RCV = 0         # receive buffer
+        SND = 1         # send buffer
+        MULTI_PG = 2    # multi-pg send buffer
+
     class Acknowledgement:
         ACK = 0
         NACK = 1
         AccessDenied = 2
         CannotRespond = 3
 
-    def __init__(self, send_message, job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable):
+    def __init__(self, send_message, job_thread_wakeup, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable, notify_eom_ack=None, statistics=None, tracer=None, clock=None):
         # Receive buffers
         self._rcv_buffer = {}
         # Send buffers
         self._snd_buffer = {}
         # Multi-PG Send buffers
         self._multi_pg_snd_buffer = {}
+        # Deadlines of all buffers, the keys are (BufferType, buffer_hash)
+        self._deadline_index = DeadlineIndex()
 
         # List of ControllerApplication
         self._cas = []
@@ -102,18 +112,110 @@ class J1939_22:
         self.__job_thread_wakeup = job_thread_wakeup
         self.__send_message = send_message
         self.__notify_subscribers = notify_subscribers
+        # receiver of the end of message acknowledgements, by default the subscribers
+        self.__notify_eom_ack = notify_eom_ack if notify_eom_ack is not None else notify_subscribers
         self.__ecu_is_message_acceptable = ecu_is_message_acceptable
+        # runtime counters of the transport protocol and multi-pg packing
+        self._statistics = statistics if statistics is not None else Statistics()
+        # optional j1939.Tracer recording the classification and reassembly of the frames
+        self._tracer = tracer
+        # time source of the deadlines, the wall clock or the virtual clock of a log replay
+        self._clock = clock if clock is not None else time.time
+
+        # acceptance table for peer-to-peer messages, indexed by the destination address
+        # 1: the destination address is handled by this ECU, 0: the message is rejected
+        self._acceptance_table = bytes(255) + b'\x01'
+
+        # CAN-ID cache for the transport protocol and control frames, keyed by (pgn, priority, sa, da)
+        self._can_id_cache = {}
 
     def add_ca(self, ca):
         self._cas.append(ca)
+        self.update_acceptance_table()
 
     def remove_ca(self, device_address):
         for ca in self._cas:
             if device_address == ca._device_address_preferred:
                 self._cas.remove(ca)
+                self.update_acceptance_table()
                 return True
         return False
 
+    def update_acceptance_table(self):
+        """Recalculates the acceptance table for peer-to-peer messages
+
+        Has to be called whenever the result of the acceptance check for a
+        destination address may change, e.g. after an address claim,
+        after adding/removing subscribers with a device address or when a CA
+        overriding message_acceptable() changes its acceptance, see
+        :meth:`ControllerApplication.update_acceptance`.
+        """
+        table = bytearray(256)
+        for dest_address in range(256):
+            if self.__ecu_is_message_acceptable(dest_address): # simple peer-to-peer reception without adding a controller-application
+                table[dest_address] = 1
+                continue
+            for ca in self._cas:
+                if ca.message_acceptable(dest_address):
+                    table[dest_address] = 1
+                    break
+        table[ParameterGroupNumber.Address.GLOBAL] = 1
+        # replace the whole table, so the receive path never sees a partly updated table
+        self._acceptance_table = bytes(table)
+
+    def _can_id(self, pgn_value, priority, src_address, dest_address):
+        """Returns the 29-bit CAN-ID for a PDU1 message from the CAN-ID cache
+
+        :param int pgn_value:
+            The PGN with PDU specific 0.
+        :param int priority:
+            The priority of the message.
+        :param src_address:
+            The Source-Address of the message.
+        :param dest_address:
+            The Destination-Address of the message.
+        """
+        key = (pgn_value, priority, src_address, dest_address)
+        can_id = self._can_id_cache.get(key)
+        if can_id is None:
+            pgn = ParameterGroupNumber((pgn_value >> 16) & 0x1, (pgn_value >> 8) & 0xFF, dest_address)
+            can_id = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address).can_id
+            self._can_id_cache[key] = can_id
+        return can_id
+
+    def invalidate_can_id_cache(self):
+        """Clears the CAN-ID cache
+
+        Called whenever an address is (re-)claimed, so the cache only holds the IDs of current connections.
+        """
+        self._can_id_cache = {}
+
+    def __set_deadline(self, buffer_type, buffer_hash, buf, deadline, wakeup=True):
+        """Sets the deadline of a buffer and updates the deadline index
+
+        The job thread is only woken up if the deadline is the earliest one.
+        """
+        buf['deadline'] = deadline
+        if self._deadline_index.set((buffer_type, buffer_hash), deadline) and wakeup:
+            self.__job_thread_wakeup()
+
+    def __remove_rcv_buffer(self, buffer_hash):
+        del self._rcv_buffer[buffer_hash]
+        self._deadline_index.discard((self.BufferType.RCV, buffer_hash))
+
+    def __remove_snd_buffer(self, buffer_hash):
+        del self._snd_buffer[buffer_hash]
+        self._deadline_index.discard((self.BufferType.SND, buffer_hash))
+
+    def __transmission_finished(self, buf, success):
+        """Informs the sender of a pgn about the end of its transmission
+
+        The completion callback of the buffer is called only once.
+        """
+        on_complete = buf.pop('on_complete', None)
+        if on_complete is not None:
+            on_complete(success)
+
     def _buffer_hash(self, session_num, src_address, dest_address):
         """Calculates a hash value for the given address pair
 
@@ -190,7 +292,7 @@ class J1939_22:
     def __put_rts_cts_session(self, session):
         self.__rts_cts_session_list[session] = True
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, tos=2, trailer_format=0):
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, tos=2, trailer_format=0, on_complete=None):
         pgn = ParameterGroupNumber(data_page, pdu_format, pdu_specific)
         data_length = len(data)
 
@@ -212,33 +314,39 @@ class J1939_22:
                     return False
 
             # create header dict
-            cpg = {'priority': (priority & 0x7), 'tos': (tos & 0x7), 'tf': (trailer_format & 0x7), 'cpgn': (cpgn & 0x3FFFF), 'data_length': data_length, 'data': data.copy()}
+            cpg = {'priority': (priority & 0x7), 'tos': (tos & 0x7), 'tf': (trailer_format & 0x7), 'cpgn': (cpgn & 0x3FFFF), 'data_length': data_length, 'data': bytes(data)}
 
             # send immediately
             if time_limit == 0:
                 self.__send_multi_pg(frame_format, [cpg], src_address, dst_address)
+                if on_complete is not None:
+                    on_complete(True)
             else:
                 session = 0
-                deadline = time.time() + time_limit
+                deadline = self._clock() + time_limit
                 while True:
                     hash = self._buffer_hash_mpg(frame_format, session, src_address, dst_address)
                     #hash = self._buffer_hash(session, src_address, dst_address)
                     if hash not in self._multi_pg_snd_buffer:
-                        self._multi_pg_snd_buffer[hash] = {'deadline': deadline, 'cpg': [cpg], 'fill_level': 4 + data_length}
+                        self._multi_pg_snd_buffer[hash] = {'deadline': 0, 'cpg': [cpg], 'fill_level': 4 + data_length, 'on_complete': []}
+                        if on_complete is not None:
+                            self._multi_pg_snd_buffer[hash]['on_complete'].append(on_complete)
+                        self.__set_deadline(self.BufferType.MULTI_PG, hash, self._multi_pg_snd_buffer[hash], deadline)
                         break
                     elif (self._multi_pg_snd_buffer[hash]['fill_level'] <= (self.DataLength.TP - data_length)):
                         # update fill level
                         self._multi_pg_snd_buffer[hash]['fill_level'] += 4 + data_length
                         # update deadline
                         if self._multi_pg_snd_buffer[hash]['deadline'] > deadline:
-                            self._multi_pg_snd_buffer[hash]['deadline'] = deadline
+                            self.__set_deadline(self.BufferType.MULTI_PG, hash, self._multi_pg_snd_buffer[hash], deadline)
                         # append c-pg
                         self._multi_pg_snd_buffer[hash]['cpg'].append(cpg)
+                        if on_complete is not None:
+                            self._multi_pg_snd_buffer[hash]['on_complete'].append(on_complete)
                         break
                     else:
                         # trigger sending
-                        self._multi_pg_snd_buffer[hash]['deadline'] = time.time()
-                        self.__job_thread_wakeup()
+                        self.__set_deadline(self.BufferType.MULTI_PG, hash, self._multi_pg_snd_buffer[hash], self._clock())
                         # get next buffer
                         session += 1
         else:
@@ -266,19 +374,14 @@ class J1939_22:
             # set default priority
             if priority == None: priority = 7
 
-            # get chunks from data
-            full_tp_size_packages = int(data_length/self.DataLength.TP)
-            arr = np.array(data)
-            list_of_arr = np.split(arr, [full_tp_size_packages*self.DataLength.TP])
-            arr = np.reshape(list_of_arr[0], (-1,self.DataLength.TP))
-            data_list = arr.tolist()
-            if len(list_of_arr) > 1:
-                data_list.append(list_of_arr[1].tolist())
+            # the segments are sliced from an immutable copy of the payload without further copies
+            data = memoryview(bytes(data))
 
             # if the PF is between 240 and 255, the message can only be broadcast
             if dest_address == ParameterGroupNumber.Address.GLOBAL:
 
                 # send BAM
+                self._statistics.count_tp_opened()
                 self.__send_tp_bam(priority, src_address, session_num, pgn.value, message_size, num_segments)
 
                 # init new buffer for this connection
@@ -288,13 +391,15 @@ class J1939_22:
                         'session': session_num,
                         'message_size': message_size,
                         'num_segments': num_segments,
-                        'data': data_list,
+                        'data': data,
                         'state': self.SendBufferState.SENDING_BAM,
-                        'deadline': time.time() + self._minimum_tp_bam_dt_interval,
+                        'deadline': 0,
                         'src_address' : src_address,
                         'dest_address' : ParameterGroupNumber.Address.GLOBAL,
                         'next_packet_to_send' : 0,
+                        'on_complete': on_complete,
                     }
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self._minimum_tp_bam_dt_interval)
             else:
                 # send RTS/CTS
                 pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
@@ -305,31 +410,32 @@ class J1939_22:
                         'session': session_num,
                         'message_size': message_size,
                         'num_segments': num_segments,
-                        'data': data_list,
+                        'data': data,
                         'state': self.SendBufferState.WAITING_CTS,
-                        'deadline': time.time() + self.Timeout.T3,
+                        'deadline': 0,
                         'src_address' : src_address,
                         'dest_address' : pdu_specific,
                         'next_packet_to_send' : 0,
                         'next_wait_on_cts': 0,
+                        'on_complete': on_complete,
                     }
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self.Timeout.T3)
+                self._statistics.count_tp_opened()
                 self.__send_tp_rts(priority, src_address, pdu_specific, session_num, pgn.value, message_size, num_segments, min(self._max_cmdt_packets, num_segments))
 
-            self.__job_thread_wakeup()
-
         return True
 
     def __send_multi_pg(self, frame_format, cpg_list, src_address, dst_address):
         # deadline reached
         priority = 7
-        data = []
+        data = bytearray()
         for cpg in cpg_list:
             priority = min(cpg['priority'], priority)
             data.append( (cpg['tos'] << 5) | (cpg['tf'] << 2) | ((cpg['cpgn'] >> 16) & 0x3) )
             data.append( ((cpg['cpgn'] >> 8) & 0xFF) )
             data.append( (cpg['cpgn'] & 0xFF) )
             data.append( cpg['data_length'] )
-            data.extend( cpg['data'])
+            data += cpg['data']
 
         # padding
         next_valid_fd_length = self._LUT_FD_DLC[len(data)]
@@ -337,145 +443,135 @@ class J1939_22:
             next_valid_fd_length = 0
 
         # padding with service header 0
-        padding_cnt = 0
-        while len(data)<next_valid_fd_length:
-            if padding_cnt < 3:
-                data.append(0)
-                padding_cnt += 1
-            else:
-                data.append(0xAA)
+        padding_cnt = next_valid_fd_length - len(data)
+        if padding_cnt > 0:
+            data += bytes(min(padding_cnt, 3))
+            data += b'\xAA' * (padding_cnt - 3)
+
+        self._statistics.count_multi_pg(len(cpg_list), sum(cpg['data_length'] for cpg in cpg_list), len(data))
 
         if frame_format == FrameFormat.FBFF:
             self.__send_message(src_address, False, data, fd_format=True)
         else:
-            mid = MessageId(priority=priority,
-                            parameter_group_number=ParameterGroupNumber.PGN.FEFF_MULTI_PG | (dst_address & 0xFF),
-                            source_address=src_address)
-            self.__send_message(mid.can_id, True, data, fd_format=True)
+            self.__send_message(self._can_id(ParameterGroupNumber.PGN.FEFF_MULTI_PG, priority, src_address, dst_address & 0xFF), True, data, fd_format=True)
 
 
     def async_job_thread(self, now):
 
         next_wakeup = now + 5.0 # wakeup in 5 seconds
 
-        # check receive buffers for timeout
-        # using 'list(x)' to prevent 'RuntimeError: dictionary changed size during iteration'
-        for bufid in list(self._rcv_buffer):
-            buf = self._rcv_buffer[bufid]
-            if buf['deadline'] != 0:
-                if buf['deadline'] > now:
-                    if next_wakeup > buf['deadline']:
-                        next_wakeup = buf['deadline']
+        # only buffers with reached deadline are processed
+        for buffer_type, bufid in self._deadline_index.pop_expired(now):
+            if buffer_type == self.BufferType.RCV:
+                # check receive buffers for timeout
+                if bufid not in self._rcv_buffer:
+                    continue
+                buf = self._rcv_buffer[bufid]
+                # deadline reached
+                logger.info('Deadline reached for rcv_buffer src 0x%02X dst 0x%02X', buf['src_address'], buf['dest_address'] )
+                self._statistics.count_tp_timeout()
+                if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
+                    self.__send_tp_abort(buf['dest_address'], buf['src_address'], buf['session'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
+                    self.__remove_rcv_buffer(bufid)
+                    self.__put_rts_cts_session(buf['session'])
                 else:
-                    # deadline reached
-                    logger.info('Deadline reached for rcv_buffer src 0x%02X dst 0x%02X', buf['src_address'], buf['dest_address'] )
-                    if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
-                        self.__send_tp_abort(buf['dest_address'], buf['src_address'], buf['session'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
-                        del self._rcv_buffer[bufid]
-                        self.__put_rts_cts_session(buf['session'])
-                    else:
-                        del self._rcv_buffer[bufid]
-                        self.__put_bam_session(buf['session'])
-                    # TODO: should we notify our CAs about the cancelled transfer?
-
-        # check multi-pg send buffers for timeout
-        # using 'list(x)' to prevent 'RuntimeError: dictionary changed size during iteration'
-        for bufid in list(self._multi_pg_snd_buffer):
-            buf = self._multi_pg_snd_buffer[bufid]
-            if buf['deadline'] > now:
-                if next_wakeup > buf['deadline']:
-                    next_wakeup = buf['deadline']
-            else:
+                    self.__remove_rcv_buffer(bufid)
+                    self.__put_bam_session(buf['session'])
+                # TODO: should we notify our CAs about the cancelled transfer?
+                continue
+
+            if buffer_type == self.BufferType.MULTI_PG:
+                # check multi-pg send buffers for timeout
+                # the buffer is removed before sending, send_pgn may create a new buffer with the same hash meanwhile
+                # (its deadline must not be discarded, the expired deadline is already removed from the index)
+                buf = self._multi_pg_snd_buffer.pop(bufid, None)
+                if buf is None:
+                    continue
                 # deadline reached
                 frame_format, session_num, src_address, dst_address = self._buffer_unhash_mpg(bufid)
 
                 self.__send_multi_pg(frame_format, buf['cpg'], src_address, dst_address)
 
-                del self._multi_pg_snd_buffer[bufid]
+                for on_complete in buf['on_complete']:
+                    on_complete(True)
+                continue
 
-
-        # check send buffers
-        # using 'list(x)' to prevent 'RuntimeError: dictionary changed size during iteration'
-        for bufid in list(self._snd_buffer):
+            # check send buffers
+            if bufid not in self._snd_buffer:
+                continue
             buf = self._snd_buffer[bufid]
-            if buf['deadline'] != 0:
-                if buf['deadline'] > now:
-                    if next_wakeup > buf['deadline']:
-                        next_wakeup = buf['deadline']
-                else:
-                    # deadline reached
-                    if buf['state'] == self.SendBufferState.WAITING_CTS:
-                        logger.info('Deadline WAITING_CTS reached for snd_buffer src 0x%02X dst 0x%02X', buf['src_address'], buf['dest_address'] )
-                        self.__send_tp_abort(buf['src_address'], buf['dest_address'], buf['session'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
-                        del self._snd_buffer[bufid]
-                        self.__put_rts_cts_session(buf['session'])
-                        # TODO: should we notify our CAs about the cancelled transfer?
-
-                    elif buf['state'] == self.SendBufferState.SENDING_RTS_CTS:
-                        while buf['next_packet_to_send'] < buf['num_segments']:
-                            package = buf['next_packet_to_send']
-                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package])
-
-                            buf['next_packet_to_send'] += 1
-                            # send end of message status
-                            if (package+1) == buf['num_segments']:
-                                self.__send_tp_eom_status(buf['src_address'], buf['dest_address'], buf['session'], buf['message_size'], buf['num_segments'], buf['pgn'])
-                                buf['deadline'] = time.time() + self.Timeout.T5
-                                buf['state'] = self.SendBufferState.WAITING_EOM_ACK
-                                break
-                            elif package == buf['next_wait_on_cts']:
-                                # wait on next cts
-                                buf['state'] = self.SendBufferState.WAITING_CTS
-                                buf['deadline'] = time.time() + self.Timeout.T3
-                                break
-                            elif self._minimum_tp_rts_cts_dt_interval != None:
-                                buf['deadline'] = time.time() + self._minimum_tp_rts_cts_dt_interval
-                                break
-
-                        # recalc next wakeup
-                        if next_wakeup > buf['deadline']:
-                            next_wakeup = buf['deadline']
-
-                    elif buf['state'] == self.SendBufferState.WAITING_EOM_ACK:
-                        # TODO: should we inform the application about the eom ack timeout?
-                        del self._snd_buffer[bufid]
-                        self.__put_rts_cts_session(buf['session'])
-
-                    elif buf['state'] == self.SendBufferState.EOM_ACK_RECEIVED:
-                        # TODO: should we inform the application about the successful transmission?
-                        del self._snd_buffer[bufid]
-                        self.__put_rts_cts_session(buf['session'])
-
-                    elif buf['state'] == self.SendBufferState.SENDING_BAM:
-                        # send next broadcast message...
-                        package = buf['next_packet_to_send']
-                        self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package])
-                        buf['next_packet_to_send'] += 1
-
-                        if buf['next_packet_to_send'] < buf['num_segments']:
-                            buf['deadline'] = time.time() + self._minimum_tp_bam_dt_interval
-                            # recalc next wakeup
-                            if next_wakeup > buf['deadline']:
-                                next_wakeup = buf['deadline']
-                        else:
-                            buf['state'] = self.SendBufferState.SENDING_EOM_STATUS
-                            # recalc next wakeup
-                            buf['deadline'] = time.time() + self._minimum_tp_bam_dt_interval
-                            if next_wakeup > buf['deadline']:
-                                next_wakeup = buf['deadline']
-
-                    elif buf['state'] == self.SendBufferState.SENDING_EOM_STATUS:
-                        # done
-                        self.__send_tp_eom_status(buf['src_address'], buf['dest_address'],
-                                                  buf['session'],
-                                                  buf['message_size'], buf['num_segments'], buf['pgn'])
-                        del self._snd_buffer[bufid]
-                        self.__put_bam_session(buf['session'])
-                    elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
-                        del self._snd_buffer[bufid]
-                    else:
-                        logger.critical('unknown SendBufferState %d', buf['state'])
-                        del self._snd_buffer[bufid]
+            # deadline reached
+            if buf['state'] == self.SendBufferState.WAITING_CTS:
+                logger.info('Deadline WAITING_CTS reached for snd_buffer src 0x%02X dst 0x%02X', buf['src_address'], buf['dest_address'] )
+                self._statistics.count_tp_timeout()
+                self.__send_tp_abort(buf['src_address'], buf['dest_address'], buf['session'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
+                self.__remove_snd_buffer(bufid)
+                self.__put_rts_cts_session(buf['session'])
+                self.__transmission_finished(buf, False)
+
+            elif buf['state'] == self.SendBufferState.SENDING_RTS_CTS:
+                while buf['next_packet_to_send'] < buf['num_segments']:
+                    package = buf['next_packet_to_send']
+                    self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package*self.DataLength.TP:(package+1)*self.DataLength.TP])
+
+                    buf['next_packet_to_send'] += 1
+                    # send end of message status
+                    if (package+1) == buf['num_segments']:
+                        self.__send_tp_eom_status(buf['src_address'], buf['dest_address'], buf['session'], buf['message_size'], buf['num_segments'], buf['pgn'])
+                        buf['state'] = self.SendBufferState.WAITING_EOM_ACK
+                        self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self.Timeout.T5, wakeup=False)
+                        break
+                    elif package == buf['next_wait_on_cts']:
+                        # wait on next cts
+                        buf['state'] = self.SendBufferState.WAITING_CTS
+                        self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self.Timeout.T3, wakeup=False)
+                        break
+                    elif self._minimum_tp_rts_cts_dt_interval != None:
+                        self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self._minimum_tp_rts_cts_dt_interval, wakeup=False)
+                        break
+
+            elif buf['state'] == self.SendBufferState.WAITING_EOM_ACK:
+                self._statistics.count_tp_timeout()
+                self.__remove_snd_buffer(bufid)
+                self.__put_rts_cts_session(buf['session'])
+                self.__transmission_finished(buf, False)
+
+            elif buf['state'] == self.SendBufferState.EOM_ACK_RECEIVED:
+                self._statistics.count_tp_completed()
+                self.__remove_snd_buffer(bufid)
+                self.__put_rts_cts_session(buf['session'])
+                self.__transmission_finished(buf, True)
+
+            elif buf['state'] == self.SendBufferState.SENDING_BAM:
+                # send next broadcast message...
+                package = buf['next_packet_to_send']
+                self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package*self.DataLength.TP:(package+1)*self.DataLength.TP])
+                buf['next_packet_to_send'] += 1
+
+                if buf['next_packet_to_send'] >= buf['num_segments']:
+                    buf['state'] = self.SendBufferState.SENDING_EOM_STATUS
+                self.__set_deadline(self.BufferType.SND, bufid, buf, self._clock() + self._minimum_tp_bam_dt_interval, wakeup=False)
+
+            elif buf['state'] == self.SendBufferState.SENDING_EOM_STATUS:
+                # done
+                self.__send_tp_eom_status(buf['src_address'], buf['dest_address'],
+                                          buf['session'],
+                                          buf['message_size'], buf['num_segments'], buf['pgn'])
+                self.__remove_snd_buffer(bufid)
+                self.__put_bam_session(buf['session'])
+                self._statistics.count_tp_completed()
+                self.__transmission_finished(buf, True)
+            elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
+                self.__remove_snd_buffer(bufid)
+            else:
+                logger.critical('unknown SendBufferState %d', buf['state'])
+                self.__remove_snd_buffer(bufid)
+                self.__transmission_finished(buf, False)
+
+        # recalc next wakeup
+        next_deadline = self._deadline_index.next_deadline()
+        if (next_deadline is not None) and (next_wakeup > next_deadline):
+            next_wakeup = next_deadline
 
         return next_wakeup
 
@@ -528,13 +624,15 @@ class J1939_22:
                     'next_packet': 1,
                     'next_cts_border': min(self._max_cmdt_packets, num_segments),
                     'num_segments_max_rec': min(self._max_cmdt_packets, num_segments),
-                    'data': [],
-                    'deadline': time.time() + self.Timeout.T2,
+                    'data': bytearray(message_size),
+                    'received': 0,
+                    'deadline': 0,
                     'src_address' : src_address,
                     'dest_address' : dest_address,
                 }
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T2)
+            self._statistics.count_tp_opened()
             self.__send_tp_cts(dest_address, src_address, session_num, self._rcv_buffer[buffer_hash]['num_segments_max_rec'], 1, pgn)
-            self.__job_thread_wakeup()
 
         elif control_byte == self.TpControlType.CTS:
             buffer_hash   = self._buffer_hash(session_num, dest_address, src_address)
@@ -546,8 +644,8 @@ class J1939_22:
             if num_segments == 0:
                 # SAE J1939/22
                 # receiver requests a pause
-                self._snd_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.Th
-                self.__job_thread_wakeup()
+                self._statistics.count_cts_pause()
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock() + self.Timeout.Th)
                 return
 
             num_segments_all = self._snd_buffer[buffer_hash]['num_segments']
@@ -566,8 +664,7 @@ class J1939_22:
             self._snd_buffer[buffer_hash]['next_wait_on_cts'] = self._snd_buffer[buffer_hash]['next_packet_to_send'] + num_segments - 1
 
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.SENDING_RTS_CTS
-            self._snd_buffer[buffer_hash]['deadline'] = time.time() # wake up immediately
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock()) # wake up immediately
 
         elif control_byte == self.TpControlType.EOM_STATUS:
             buffer_hash = self._buffer_hash(session_num, src_address, dest_address)
@@ -576,12 +673,13 @@ class J1939_22:
                 return
             pgn = self._rcv_buffer[buffer_hash]['pgn']
             if (self._rcv_buffer[buffer_hash]['message_size'] == message_size) and (self._rcv_buffer[buffer_hash]['num_segments'] == segment_num):
+                self._statistics.count_tp_completed()
                 self.__notify_subscribers(mid.priority, pgn, src_address, dest_address, timestamp, self._rcv_buffer[buffer_hash]['data'])
                 if dest_address != ParameterGroupNumber.Address.GLOBAL:
                     self.__send_tp_eom_ack(dest_address, src_address, session_num, message_size, segment_num, pgn)
             else:
                 self.__send_tp_abort(dest_address, src_address, session_num, self.ConnectionAbortReason.RESOURCES, pgn)
-            del self._rcv_buffer[buffer_hash]
+            self.__remove_rcv_buffer(buffer_hash)
             self.__put_rts_cts_session(session_num)
 
         elif control_byte == self.TpControlType.EOM_ACK:
@@ -592,10 +690,9 @@ class J1939_22:
                 return
             # TODO: should we inform the application about the successful transmission?
             # Notify subscribers here to be used for the memory access server to know when to send operation complete
-            self.__notify_subscribers(mid.priority, pgn, mid.source_address, dest_address, timestamp, data)
+            self.__notify_eom_ack(mid.priority, pgn, mid.source_address, dest_address, timestamp, data)
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.EOM_ACK_RECEIVED
-            self._snd_buffer[buffer_hash]['deadline'] = time.time() # wake up immediately
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock()) # wake up immediately
 
         # BAM FD.TP.CM received
         elif control_byte == self.TpControlType.BAM:
@@ -603,7 +700,7 @@ class J1939_22:
             if buffer_hash in self._rcv_buffer:
                 # buffer already in use
                 logger.info('bam receive buffer already in use 0x%x', buffer_hash )
-                del self._rcv_buffer[buffer_hash]
+                self.__remove_rcv_buffer(buffer_hash)
                 self.__put_bam_session(self._rcv_buffer['session'])
                 return
 
@@ -614,20 +711,24 @@ class J1939_22:
                     'message_size': message_size, # Total message size, number of bytes
                     'num_segments': segment_num,  # Total number of segments
                     'next_packet': 1,
-                    'data': [],
-                    'deadline': time.time() + self.Timeout.T1,
+                    'data': bytearray(message_size),
+                    'received': 0,
+                    'deadline': 0,
                     'src_address' : src_address,
                     'dest_address' : dest_address,
                 }
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T1)
+            self._statistics.count_tp_opened()
 
         elif control_byte == self.TpControlType.ABORT:
+            self._statistics.count_tp_aborted(data[8])
             # if abort received before transmission established -> cancel transmission
             buffer_hash = self._buffer_hash(session_num, dest_address, src_address)
             if buffer_hash in self._snd_buffer and self._snd_buffer[buffer_hash]['state'] == self.SendBufferState.WAITING_CTS:
                 # cancel transmission
+                self.__transmission_finished(self._snd_buffer[buffer_hash], False)
                 self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
-                self._snd_buffer[buffer_hash]['deadline'] = time.time()
+                self.__set_deadline(self.BufferType.SND, buffer_hash, self._snd_buffer[buffer_hash], self._clock())
             # TODO: any more abort responses?
         else:
             raise RuntimeError('Received TP.CM with unknown control_byte %d', control_byte)
@@ -657,21 +758,24 @@ class J1939_22:
             logger.critical('packet error. required: '+ str(self._rcv_buffer[buffer_hash]['next_packet']) + ' received: ' + str(segment_num) )
             return
 
-        # get data
-        self._rcv_buffer[buffer_hash]['data'].extend(data[4:])
+        # copy data into the preallocated buffer, padding bytes behind the message size are dropped
+        buf = self._rcv_buffer[buffer_hash]
+        offset = buf['received']
+        length = min(len(data) - 4, buf['message_size'] - offset)
+        buf['data'][offset:offset + length] = data[4:4 + length]
+        buf['received'] = offset + length
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.TP_SEGMENT_STORED, mid.can_id)
 
         self._rcv_buffer[buffer_hash]['next_packet'] = segment_num + 1
 
         # message is complete with sending an acknowledge
-        if len(self._rcv_buffer[buffer_hash]['data']) >= self._rcv_buffer[buffer_hash]['message_size']:
+        if buf['received'] >= buf['message_size']:
             logger.info('finished RCV of PGN {} with size {}'.format(self._rcv_buffer[buffer_hash]['pgn'], self._rcv_buffer[buffer_hash]['message_size']))
-            # shorten data to message_size
-            self._rcv_buffer[buffer_hash]['data'] = self._rcv_buffer[buffer_hash]['data'][:self._rcv_buffer[buffer_hash]['message_size']]
             # finished reassembly
             if dest_address != ParameterGroupNumber.Address.GLOBAL:
                 # set deadlin for waiting on eom status
-                self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T1
-            self.__job_thread_wakeup()
+                self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T1)
             return
 
         # send clear to send
@@ -685,39 +789,44 @@ class J1939_22:
             self._rcv_buffer[buffer_hash]['next_cts_border'] = min(self._rcv_buffer[buffer_hash]['next_cts_border'] + self._rcv_buffer[buffer_hash]['num_segments_max_rec'],
                                                                self._rcv_buffer[buffer_hash]['num_segments'])
 
-            self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T2
-            self.__job_thread_wakeup()
+            self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T2)
             return
 
-        self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T1
-        #self.__job_thread_wakeup()
+        # a later deadline does not require to wake up the job thread
+        self.__set_deadline(self.BufferType.RCV, buffer_hash, self._rcv_buffer[buffer_hash], self._clock() + self.Timeout.T1)
 
     def _process_multi_pg(self, mid : MessageId, dest_address, data, timestamp):
         # currently "SAE J1939 with no assurance data" trailer format supported only
         src_address = mid.source_address
 
+        # the c-pgs are delivered as views into the received frame
+        if isinstance(data, (bytes, bytearray)):
+            data = memoryview(data)
+
+        offset = 0
         while True:
-            if len(data) <= 4:
+            if len(data) - offset <= 4:
                 break
-            tos            = (data[0] >> 5) & 0x7
+            tos            = (data[offset] >> 5) & 0x7
             # padding service
             if tos == 0:
                 break
 
-            trailer_format = (data[0] >> 2) & 0x7
-            cpgn           = ((data[0] & 0x3) << 16) | (data[1] << 8)  | data[2]
-            payload_length = (data[3] & 0xFF)
+            trailer_format = (data[offset] >> 2) & 0x7
+            cpgn           = ((data[offset] & 0x3) << 16) | (data[offset+1] << 8)  | data[offset+2]
+            payload_length = (data[offset+3] & 0xFF)
             if (tos == 2) and (trailer_format == 0):
                 # SAE J1939 with no assurance data
-                self.__notify_subscribers(mid.priority, cpgn, src_address, dest_address, timestamp, data[4:(4+payload_length)].copy())
+                self.__notify_subscribers(mid.priority, cpgn, src_address, dest_address, timestamp, data[(offset+4):(offset+4+payload_length)])
             else:
                 # TODO
                 print('other tos/tf formats currently not supported')
 
-            # trim data
-            data = data[(4+payload_length):]
+            # next c-pg
+            offset += 4 + payload_length
 
     def __send_tp_abort(self, src_address, dest_address, session_num, reason, pgn_value):
+        self._statistics.count_tp_aborted(reason)
         self.__send_tp_cm(src_address, dest_address, self.TpControlType.ABORT, session_num, 0xFFFFFF, 0xFFFFFF, 0xFFFFFF, reason, pgn_value)
 
     def __send_tp_rts(self, priority, src_address, dest_address, session_num, pgn_value, message_size, num_segments, max_cmdt_packets, adt=Adt.NO_ADT):
@@ -744,10 +853,9 @@ class J1939_22:
                             pgn,
                             priority=7):
 
-        pgn_tp_cm = ParameterGroupNumber(0, (ParameterGroupNumber.PGN.FD_TP_CM>>8) & 0xFF, dest_address)
-        mid = MessageId(priority=priority, parameter_group_number=pgn_tp_cm.value, source_address=src_address)
+        can_id = self._can_id(ParameterGroupNumber.PGN.FD_TP_CM, priority, src_address, dest_address)
 
-        data = [0] * 12
+        data = bytearray(12)
         data[0]  = ( (TpControlType & 0xF) | ((session_num & 0xF) << 4))
         data[1]  = (  message_size & 0xFF )
         data[2]  = ( (message_size >> 8)  & 0xFF )
@@ -761,29 +869,21 @@ class J1939_22:
         data[10] = ( (pgn >> 8) & 0xFF )
         data[11] = ( (pgn >> 16) & 0xFF )
         # 13 up to 64 Assurance Data of full message calculated using AD Type. Total length = Size in byte 8.
-        self.__send_message(mid.can_id, True, data, fd_format=True)
+        self.__send_message(can_id, True, data, fd_format=True)
 
     def __send_tp_dt(self, src_address, dest_address, session_num, segment_num, data, Dtfi=0):
-        pgn = ParameterGroupNumber(0, (ParameterGroupNumber.PGN.FD_TP_DT>>8) & 0xFF, dest_address)
-        mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
+        can_id = self._can_id(ParameterGroupNumber.PGN.FD_TP_DT, 7, src_address, dest_address)
 
-        data.insert(0, (Dtfi & 0xF) | ((session_num & 0xF) << 4))
-        data.insert(1,  segment_num & 0xFF)
-        data.insert(2, (segment_num >> 8) & 0xFF)
-        data.insert(3, (segment_num >> 16) & 0xFF)
-
-        next_valid_fd_length = 0
-        if len(data)>=(self.DataLength.TP+4):
-            data = data[:(self.DataLength.TP+4)]
-        else:
-            # padding
-            next_valid_fd_length = self._LUT_FD_DLC[len(data)]
-            if next_valid_fd_length < 0: next_valid_fd_length = 0
+        # data is a segment of at most DataLength.TP bytes, padded to the next valid fd length
+        length = 4 + len(data)
+        frame = bytearray(b'\xFF') * max(self._LUT_FD_DLC[length], length)
+        frame[0] = (Dtfi & 0xF) | ((session_num & 0xF) << 4)
+        frame[1] =  segment_num & 0xFF
+        frame[2] = (segment_num >> 8) & 0xFF
+        frame[3] = (segment_num >> 16) & 0xFF
+        frame[4:length] = data
 
-            while len(data)<next_valid_fd_length:
-                data.append(255)
-
-        self.__send_message(mid.can_id, True, data, fd_format=True)
+        self.__send_message(can_id, True, frame, fd_format=True)
 
 
     def notify(self, can_id, data, timestamp):
@@ -802,46 +902,99 @@ class J1939_22:
             seconds.
             Where possible this will be timestamped in hardware.
         """
-        mid = MessageId(can_id=can_id)
-        pgn = ParameterGroupNumber()
-        pgn.from_message_id(mid)
-
-        # peer to peer
-        # pdu_specific is destination Address
-        pgn_value = pgn.value & 0x1FF00
-        dest_address = pgn.pdu_specific # may be Address.GLOBAL
-
-        # iterate all CAs to check if we have to handle this destination address
-        if dest_address != ParameterGroupNumber.Address.GLOBAL:
-            if not self.__ecu_is_message_acceptable(dest_address): # simple peer-to-peer reception without adding a controller-application
-                reject = True
-                for ca in self._cas:
-                    if ca.message_acceptable(dest_address):
-                        reject = False
-                        break
-                if reject == True:
-                    return
+        priority, pgn_value, src_address, dest_address, is_pdu2 = decode_can_id(can_id)
+        if self._tracer is not None:
+            self._tracer.record(Tracer.Event.FRAME_CLASSIFIED, can_id)
 
-        if pgn_value == ParameterGroupNumber.PGN.FEFF_MULTI_PG:
-            self._process_multi_pg(mid, dest_address, data, timestamp)
+        # check if we have to handle this destination address
+        # the pdu specific is checked for PDU2 messages too
+        if not self._acceptance_table[(can_id >> 8) & 0xFF]:
+            return
+
+        if is_pdu2:
+            # direct broadcast
+            self.__notify_subscribers(priority, pgn_value, src_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
+        elif pgn_value == ParameterGroupNumber.PGN.FEFF_MULTI_PG:
+            self._process_multi_pg(MessageId.from_can_id(can_id), dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.ADDRESSCLAIM:
+            mid = MessageId.from_can_id(can_id)
             for ca in self._cas:
                 ca._process_addressclaim(mid, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.REQUEST:
+            mid = MessageId.from_can_id(can_id)
             for ca in self._cas:
                 if ca.message_acceptable(dest_address):
                     ca._process_request(mid, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.FD_TP_CM:
-            self._process_tp_cm(mid, dest_address, data, timestamp)
+            self._process_tp_cm(MessageId.from_can_id(can_id), dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.FD_TP_DT:
-            self._process_tp_dt(mid, dest_address, data, timestamp)
+            self._process_tp_dt(MessageId.from_can_id(can_id), dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.TP_CM:
             logger.info('j1939-21 transport protocol cm not allowed in j1939-22 network')
         elif pgn_value == ParameterGroupNumber.PGN.DATATRANSFER:
             logger.info('j1939-21 transport protocol dt not allowed in j1939-22 network')
-        elif pgn.is_pdu2_format:
-            # direct broadcast
-            self.__notify_subscribers(mid.priority, pgn.value, mid.source_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
         else:
-            self.__notify_subscribers(mid.priority, pgn_value, mid.source_address, dest_address, timestamp, data)
+            self.__notify_subscribers(priority, pgn_value, src_address, dest_address, timestamp, data)
+
+    # PGNs handled by the data link layer itself, not delivered directly to the subscribers (with PDU specific == 0)
+    _PROTOCOL_PGNS = np.array([
+        ParameterGroupNumber.PGN.FEFF_MULTI_PG,
+        ParameterGroupNumber.PGN.ADDRESSCLAIM,
+        ParameterGroupNumber.PGN.REQUEST,
+        ParameterGroupNumber.PGN.FD_TP_CM,
+        ParameterGroupNumber.PGN.FD_TP_DT,
+        ParameterGroupNumber.PGN.TP_CM,
+        ParameterGroupNumber.PGN.DATATRANSFER,
+    ], dtype=np.uint32)
+
+    def notify_batch(self, can_ids, datas, timestamps):
+        """Feed a block of incoming CAN messages into this ecu.
+
+        The CAN-IDs of the whole block are classified in one vectorized pass.
+        Plain PDUs are delivered directly to the subscribers, all other messages
+        (e.g. transport protocol, multi-pg, address claim, request) are processed by :meth:`notify`.
+        The messages are handled in the given order.
+
+        :param can_ids:
+            Sequence or array of 29-bit CAN-IDs
+        :param datas:
+            Sequence with the data part of each message
+        :param timestamps:
+            Sequence with the timestamp of each message
+        """
+        can_ids = np.asarray(can_ids, dtype=np.uint32)
+        if can_ids.size == 0:
+            return
 
+        priorities = ((can_ids >> 26) & 0x7).tolist()
+        source_addresses = (can_ids & 0xFF).tolist()
+        pgns = (can_ids >> 8) & 0x1FFFF
+        pdu_specifics = pgns & 0xFF
+        is_pdu2 = ((pgns >> 8) & 0xFF) >= 240
+        # PDU1: the pdu_specific is the destination address and not part of the pgn
+        pgn_values = np.where(is_pdu2, pgns, pgns & 0x1FF00).tolist()
+        dest_addresses = np.where(is_pdu2, ParameterGroupNumber.Address.GLOBAL, pdu_specifics)
+        special = (~is_pdu2 & np.isin(pgns & 0x1FF00, self._PROTOCOL_PGNS)).tolist()
+
+        def acceptance(table):
+            # the acceptance table is applied to all messages (see notify)
+            return (np.frombuffer(table, dtype=np.uint8)[pdu_specifics] != 0).tolist()
+
+        table = self._acceptance_table
+        accepted = acceptance(table)
+        dest_addresses = dest_addresses.tolist()
+
+        for i in range(len(pgn_values)):
+            if table is not self._acceptance_table:
+                # the acceptance table was updated by a previous message (e.g. address claim)
+                table = self._acceptance_table
+                accepted = acceptance(table)
+            if (self._tracer is not None) and not special[i]:
+                # special messages are classified by notify()
+                self._tracer.record(Tracer.Event.FRAME_CLASSIFIED, int(can_ids[i]))
+            if not accepted[i]:
+                continue
+            if special[i]:
+                self.notify(int(can_ids[i]), datas[i], timestamps[i])
+            else:
+                self.__notify_subscribers(priorities[i], pgn_values[i], source_addresses[i], dest_addresses[i], timestamps[i], datas[i])
@@ -0,0 +1,65 @@
+class LatestValues:
+    """Latest received PDU per (source address, PGN) of an ECU
+
+    Each entry is an immutable tuple (timestamp, count, data). The receiving thread
+    replaces the whole tuple with a single dict assignment, which is atomic in CPython,
+    so other threads poll the entries without locks and always see a consistent entry.
+    The entries are updated without a lock to keep the overhead per PDU low, if PDUs are
+    delivered by several threads at once, an increment of a count may get lost occasionally.
+
+    Enable it with ``ElectronicControlUnit(latest_values=True)``, see
+    :attr:`j1939.ElectronicControlUnit.latest_values`.
+    """
+
+    def __init__(self, pgns=None):
+        """
+        :param pgns:
+            Optional PGN or iterable of PGNs to keep. If omitted, every PGN is kept.
+        """
+        self._pgns = None if pgns is None else (frozenset([pgns]) if isinstance(pgns, int) else frozenset(pgns))
+        # (sa, pgn) -> (timestamp, count, data)
+        self._entries = {}
+
+    def update(self, pgn, sa, timestamp, data):
+        """Stores a received PDU, called by the ECU for each PDU received on its bus or segments
+
+        :param int pgn:
+            The PGN of the PDU.
+        :param int sa:
+            The source address.
+        :param float timestamp:
+            The timestamp of the PDU.
+        :param data:
+            The bytes-like payload, stored as copy.
+        """
+        if (self._pgns is not None) and (pgn not in self._pgns):
+            return
+        entries = self._entries
+        key = (sa, pgn)
+        entry = entries.get(key)
+        entries[key] = (timestamp, 1 if entry is None else entry[1] + 1, bytes(data))
+
+    def get(self, sa, pgn):
+        """Returns the latest PDU of a source address and PGN
+
+        :param int sa:
+            The source address.
+        :param int pgn:
+            The PGN.
+        :return:
+            tuple (timestamp, count, data) with the number of PDUs received so far and
+            the payload as bytes, None if no PDU was received.
+        """
+        return self._entries.get((sa, pgn))
+
+    def snapshot(self):
+        """Returns a copy of all entries
+
+        :return:
+            dict (sa, pgn) -> (timestamp, count, data), see :meth:`get`.
+        """
+        return self._entries.copy()
+
+    def clear(self):
+        """Discards all entries"""
+        self._entries = {}
@@ -39,7 +39,13 @@ class MemoryAccess:
         if pgn == j1939.ParameterGroupNumber.PGN.DM14:
             match self.state:
                 case DMState.IDLE:
-                    if self.server.state.value == DMState.IDLE.value:
+                    # the operation completed message of the previous request is handled by the server,
+                    # it is dispatched to this listener too and must not start a new request
+                    command = ((data[1] - 1) & 0x0F) >> 1
+                    if (
+                        self.server.state.value == DMState.IDLE.value
+                        and command != j1939.Command.OPERATION_COMPLETED.value
+                    ):
                         self.state = DMState.REQUEST_STARTED
                         self.server.parse_dm14(priority, pgn, sa, timestamp, data)
                         if not self.seed_security:
@@ -1,4 +1,22 @@
 
+# PDU format -> (PGN mask, destination address mask, PDU2 format)
+# PDU1 PGNs are returned without destination address, PDU2 messages are addressed to GLOBAL
+_PF_LUT = tuple((0x1FFFF, 0xFF, True) if pdu_format >= 240 else (0x1FF00, 0x00, False) for pdu_format in range(256))
+
+def decode_can_id(can_id):
+    """Decodes a 29-bit CAN-Id without creating any objects
+
+    :param int can_id:
+        A 29-bit CAN-Id
+    :return:
+        tuple (priority, pgn, sa, da, is_pdu2).
+        The PGN of a PDU1 message has the PDU specific 0, the DA of a PDU2 message is GLOBAL (255).
+    """
+    pgn_mask, da_mask, is_pdu2 = _PF_LUT[(can_id >> 16) & 0xFF]
+    pgn = (can_id >> 8) & 0x1FFFF
+    return (can_id >> 26) & 0x7, pgn & pgn_mask, can_id & 0xFF, (pgn | da_mask) & 0xFF, is_pdu2
+
+
 class MessageId:
     """The CAN MessageId of an PDU.
 
@@ -8,6 +26,8 @@ class MessageId:
       * Source Address
     """
 
+    __slots__ = ('priority', 'parameter_group_number', 'source_address')
+
     def __init__(self, **kwargs): #priority=0, parameter_group_number=0, source_address=0):
         """
         :param priority:
@@ -31,6 +51,13 @@ class MessageId:
             self.parameter_group_number = kwargs.get('parameter_group_number', 0) & 0x3FFFF
             self.source_address = kwargs.get('source_address', 0) & 0xFF
 
+    @classmethod
+    def from_can_id(cls, can_id):
+        """Creates a MessageId from a 29-bit CAN-Id without keyword argument parsing"""
+        mid = cls.__new__(cls)
+        mid.can_id = can_id
+        return mid
+
     @property
     def can_id(self):
         """Transforms the MessageId object to a 29 bit CAN-Id"""
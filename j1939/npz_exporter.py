@@ -0,0 +1,179 @@
+import array
+import os
+import threading
+
+import numpy as np
+
+
+class _PgnColumns:
+    """Columns of the PDUs of one PGN
+
+    The columns grow by appending to :class:`array.array` and bytearray objects
+    (amortized O(1), without converting each value to a numpy scalar).
+    """
+
+    def __init__(self):
+        self.timestamps = array.array('d')
+        self.priorities = bytearray()
+        self.source_addresses = bytearray()
+        self.dest_addresses = bytearray()
+        # concatenated payloads
+        self.payloads = bytearray()
+        # length of all payloads as long as it is fixed
+        self.payload_length = None
+        # end offsets of the payloads, starting with 0, as soon as the length varies
+        self.offsets = None
+
+    def append(self, timestamp, priority, sa, da, payload):
+        if self.offsets is None:
+            if self.payload_length is None:
+                self.payload_length = len(payload)
+            elif len(payload) != self.payload_length:
+                # first payload with a different length, switch to offsets
+                self.offsets = array.array('q', (i * self.payload_length for i in range(len(self.timestamps) + 1)))
+        self.timestamps.append(timestamp)
+        self.priorities.append(priority)
+        self.source_addresses.append(sa)
+        self.dest_addresses.append(da)
+        self.payloads += payload
+        if self.offsets is not None:
+            self.offsets.append(len(self.payloads))
+
+    def arrays(self):
+        """Returns copies of the columns as numpy arrays, see :meth:`NpzExporter.arrays`"""
+        def column(buffer, dtype):
+            # a copy, the buffer must not be exported while it may grow
+            return np.frombuffer(buffer, dtype=dtype).copy()
+
+        columns = {
+            'timestamp': column(self.timestamps, np.float64),
+            'priority': column(self.priorities, np.uint8),
+            'sa': column(self.source_addresses, np.uint8),
+            'da': column(self.dest_addresses, np.uint8),
+        }
+        payloads = column(self.payloads, np.uint8)
+        if self.offsets is None:
+            columns['payload'] = payloads.reshape(len(self.timestamps), self.payload_length or 0)
+        else:
+            columns['payload_offsets'] = column(self.offsets, np.int64)
+            columns['payload_data'] = payloads
+        return columns
+
+
+class NpzExporter:
+    """Collects PDUs per PGN in columns and exports them as numpy arrays or ``.npz`` files
+
+    The PDUs are collected from the subscribers of an ECU and/or added from a stream,
+    e.g. of :func:`j1939.decode_stream` or :meth:`j1939.PduReader.records`.
+    See :meth:`arrays` for the exported columns.
+    """
+
+    def __init__(self, ecu=None, pgns=None):
+        """
+        :param ecu:
+            Optional :class:`j1939.ElectronicControlUnit` whose delivered PDUs are collected.
+        :param pgns:
+            Optional PGN or iterable of PGNs to collect. If omitted, every PGN is collected.
+        """
+        self._ecu = ecu
+        self._pgns = None if pgns is None else (frozenset([pgns]) if isinstance(pgns, int) else frozenset(pgns))
+        # pgn -> _PgnColumns
+        self._columns = {}
+        self._lock = threading.Lock()
+        if ecu is not None:
+            ecu.subscribe(self._on_message, pgns=pgns, with_dest_address=True)
+
+    def _on_message(self, priority, pgn, sa, dest, timestamp, data):
+        self.add(timestamp, priority, pgn, sa, dest, data)
+
+    def add(self, timestamp, priority, pgn, sa, da, payload):
+        """Adds a PDU
+
+        :param float timestamp:
+            The timestamp of the PDU.
+        :param int priority:
+            The priority of the PDU.
+        :param int pgn:
+            The PGN of the PDU.
+        :param int sa:
+            The source address.
+        :param int da:
+            The destination address, GLOBAL (255) for broadcasts.
+        :param payload:
+            The bytes-like payload.
+        """
+        if (self._pgns is not None) and (pgn not in self._pgns):
+            return
+        with self._lock:
+            columns = self._columns.get(pgn)
+            if columns is None:
+                columns = self._columns[pgn] = _PgnColumns()
+            columns.append(timestamp, priority, sa, da, payload)
+
+    def add_stream(self, pdus):
+        """Adds PDUs from an iterable of tuples (timestamp, priority, pgn, sa, da, payload)
+
+        :return:
+            The number of PDUs read from the iterable.
+        """
+        count = 0
+        for pdu in pdus:
+            self.add(*pdu)
+            count += 1
+        return count
+
+    def pgns(self):
+        """Returns the sorted list of collected PGNs"""
+        with self._lock:
+            return sorted(self._columns)
+
+    def arrays(self, pgn):
+        """Returns the collected PDUs of a PGN as numpy arrays
+
+        :param int pgn:
+            The PGN.
+        :return:
+            dict with the (independent) arrays of the N PDUs:
+
+            * 'timestamp': float64
+            * 'priority', 'sa', 'da': uint8
+            * 'payload': (N, L) uint8 matrix if all payloads have the same length L
+            * 'payload_offsets' (N + 1 int64) and 'payload_data' (uint8) otherwise,
+              the payload i is ``payload_data[payload_offsets[i]:payload_offsets[i + 1]]``
+        :raises KeyError:
+            If no PDU of the PGN was collected.
+        """
+        with self._lock:
+            return self._columns[pgn].arrays()
+
+    def save(self, directory, compressed=False):
+        """Writes one ``.npz`` file per PGN
+
+        The files are named after the PGN in hex, e.g. ``0FEF1.npz``, and hold the arrays
+        of :meth:`arrays` and the PGN as 'pgn'.
+
+        :param str directory:
+            The directory of the files, created if necessary.
+        :param bool compressed:
+            If True, the files are written with :func:`numpy.savez_compressed`.
+        :return:
+            The list of written file names.
+        """
+        os.makedirs(directory, exist_ok=True)
+        savez = np.savez_compressed if compressed else np.savez
+        filenames = []
+        for pgn in self.pgns():
+            filename = os.path.join(directory, '{:05X}.npz'.format(pgn))
+            savez(filename, pgn=np.uint32(pgn), **self.arrays(pgn))
+            filenames.append(filename)
+        return filenames
+
+    def clear(self):
+        """Discards the collected PDUs"""
+        with self._lock:
+            self._columns.clear()
+
+    def close(self):
+        """Stops collecting the PDUs of the ECU"""
+        if self._ecu is not None:
+            self._ecu.unsubscribe(self._on_message)
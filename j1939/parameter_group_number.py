@@ -33,6 +33,8 @@ class ParameterGroupNumber:
         ADDRESSCLAIM        = 60928  # EE00
         DATATRANSFER        = 60160  # EB00
         TP_CM               = 60416  # EC00
+        ETP_DT              = 50944  # C700
+        ETP_CM              = 51200  # C800
         #COMMANDED_ADDRESS  = 65240
         #PROPRIETARY_A      = 61184
         #SOFTWARE_IDENT     = 65242
@@ -98,6 +100,8 @@ class ParameterGroupNumber:
         NULL                = 254
         GLOBAL              = 255
 
+    __slots__ = ('data_page', 'pdu_format', 'pdu_specific')
+
     def __init__(self, data_page=0, pdu_format=0, pdu_specific=0):
         """
         :param data_page:
@@ -0,0 +1,245 @@
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+
+# Data file: header, followed by the records (record header + payload)
+_DATA_MAGIC = b'J1939PDU'
+# Index file: header, followed by one fixed size entry per record
+_INDEX_MAGIC = b'J1939IDX'
+_VERSION = 1
+# magic, version, reserved
+_FILE_HEADER = struct.Struct('<8sH6x')
+# timestamp, pgn, sa, da, priority, payload length
+_RECORD_HEADER = struct.Struct('<dIBBBxI')
+# timestamp, offset of the record in the data file, pgn, sa, da, priority
+_INDEX_ENTRY = struct.Struct('<dQIBBBx')
+
+#: numpy dtype of the entries of the index file
+INDEX_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('offset', '<u8'),
+    ('pgn', '<u4'),
+    ('sa', 'u1'),
+    ('da', 'u1'),
+    ('priority', 'u1'),
+    ('reserved', 'u1'),
+])
+
+
+def _open_append(filename, magic, entry_size=1):
+    """Opens a data or index file for appending, writes the header of a new file
+
+    :param int entry_size:
+        Size of the entries of the file, a partly written entry at the end of an existing file is removed.
+    :return:
+        tuple (file, size of the file)
+    """
+    f = open(filename, 'ab')
+    size = f.tell()
+    if size == 0:
+        f.write(_FILE_HEADER.pack(magic, _VERSION))
+        size = _FILE_HEADER.size
+    else:
+        with open(filename, 'rb') as existing:
+            _check_header(existing.read(_FILE_HEADER.size), magic, filename)
+        partial = (size - _FILE_HEADER.size) % entry_size
+        if partial:
+            size -= partial
+            f.truncate(size)
+    return f, size
+
+
+def _check_header(header, magic, filename):
+    if len(header) < _FILE_HEADER.size:
+        raise ValueError("{} is not a PDU recording".format(filename))
+    file_magic, version = _FILE_HEADER.unpack(header)
+    if file_magic != magic:
+        raise ValueError("{} is not a PDU recording".format(filename))
+    if version != _VERSION:
+        raise ValueError("unsupported version {} of {}".format(version, filename))
+
+
+class PduRecorder:
+    """Records the PDUs delivered to the subscribers of an ECU into an append-only binary file
+
+    Each record holds the timestamp, PGN, source and destination address, priority and
+    the (reassembled) payload of a PDU. The records are collected in memory and written in
+    batches. For each record an entry of :data:`INDEX_DTYPE` is appended to the sidecar
+    index file ``<filename>.idx``, after the record itself is written. The index lets
+    :class:`PduReader` select records by time and PGN without parsing the data file.
+
+    An existing recording is continued.
+    """
+
+    def __init__(self, ecu, filename, pgns=None, batch_size=1024, flush_interval=1.0):
+        """
+        :param ecu:
+            The :class:`j1939.ElectronicControlUnit` whose PDUs are recorded.
+        :param str filename:
+            Name of the data file, the index is written to ``filename + '.idx'``.
+        :param pgns:
+            Optional PGN or iterable of PGNs to record, see :meth:`j1939.ElectronicControlUnit.subscribe`.
+            If omitted, every PDU is recorded.
+        :param int batch_size:
+            Number of records collected before they are written.
+        :param float flush_interval:
+            Maximum time in seconds the records are kept in memory, 0 to write by batch size only.
+        """
+        if batch_size < 1:
+            raise ValueError("the batch size must be at least 1")
+        self._ecu = ecu
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._data_file, self._offset = _open_append(filename, _DATA_MAGIC)
+        self._index_file, _ = _open_append(filename + '.idx', _INDEX_MAGIC, _INDEX_ENTRY.size)
+        self._data = bytearray()
+        self._index = bytearray()
+        self._count = 0
+
+        #: Number of records written
+        self.records = 0
+
+        ecu.subscribe(self._on_message, pgns=pgns, with_dest_address=True)
+        self._timer = ecu.add_timer(flush_interval, self._on_timer) if flush_interval > 0 else None
+
+    def _on_message(self, priority, pgn, sa, dest, timestamp, data):
+        length = len(data)
+        with self._lock:
+            if self._data_file is None:
+                return
+            self._index += _INDEX_ENTRY.pack(timestamp, self._offset + len(self._data), pgn, sa, dest, priority)
+            self._data += _RECORD_HEADER.pack(timestamp, pgn, sa, dest, priority, length)
+            self._data += data
+            self._count += 1
+            if self._count >= self._batch_size:
+                self._write()
+
+    def _on_timer(self, cookie):
+        self.flush()
+        return True
+
+    def _write(self):
+        """Writes the collected records, the data before the index entries pointing to it"""
+        if self._count == 0:
+            return
+        self._data_file.write(self._data)
+        self._data_file.flush()
+        self._index_file.write(self._index)
+        self._index_file.flush()
+        self._offset += len(self._data)
+        self.records += self._count
+        self._data.clear()
+        self._index.clear()
+        self._count = 0
+
+    def flush(self):
+        """Writes the collected records to the files"""
+        with self._lock:
+            if self._data_file is not None:
+                self._write()
+
+    def close(self):
+        """Stops recording, writes the collected records and closes the files"""
+        self._ecu.unsubscribe(self._on_message)
+        if self._timer is not None:
+            self._timer.cancel()
+        with self._lock:
+            if self._data_file is None:
+                return
+            self._write()
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = None
+            self._index_file = None
+
+
+class PduReader:
+    """Reads a recording of :class:`PduRecorder`
+
+    The data and index files are memory-mapped. Records are selected with vectorized
+    operations on the index, only the payloads of the selected records are read.
+    Records written while the reader is open are not visible.
+    """
+
+    def __init__(self, filename):
+        """
+        :param str filename:
+            Name of the data file, the index is read from ``filename + '.idx'``.
+        """
+        with open(filename, 'rb') as f:
+            _check_header(f.read(_FILE_HEADER.size), _DATA_MAGIC, filename)
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_filename = filename + '.idx'
+        with open(index_filename, 'rb') as f:
+            _check_header(f.read(_FILE_HEADER.size), _INDEX_MAGIC, index_filename)
+        # a partly written entry at the end is ignored
+        num_entries = (os.path.getsize(index_filename) - _FILE_HEADER.size) // INDEX_DTYPE.itemsize
+        if num_entries > 0:
+            #: The index, a read-only numpy array of :data:`INDEX_DTYPE` mapped from the index file
+            self.index = np.memmap(index_filename, dtype=INDEX_DTYPE, mode='r', offset=_FILE_HEADER.size, shape=(num_entries,))
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        timestamps = self.index['timestamp']
+        self._sorted = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+
+    def __len__(self):
+        return len(self.index)
+
+    def select(self, start=None, end=None, pgns=None):
+        """Selects records by time and PGN
+
+        :param float start:
+            Optional minimum timestamp (inclusive).
+        :param float end:
+            Optional maximum timestamp (exclusive).
+        :param pgns:
+            Optional PGN or iterable of PGNs.
+        :return:
+            numpy array with the numbers of the selected records in recording order
+        """
+        timestamps = self.index['timestamp']
+        if self._sorted:
+            # time range by binary search
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='left'))
+            selected = np.arange(first, max(first, last))
+        else:
+            mask = np.ones(len(timestamps), dtype=bool)
+            if start is not None:
+                mask &= timestamps >= start
+            if end is not None:
+                mask &= timestamps < end
+            selected = np.nonzero(mask)[0]
+        if pgns is not None:
+            pgns = [pgns] if isinstance(pgns, int) else list(pgns)
+            selected = selected[np.isin(self.index['pgn'][selected], pgns)]
+        return selected
+
+    def read(self, record):
+        """Reads a record
+
+        :param int record:
+            Number of the record.
+        :return:
+            tuple (timestamp, priority, pgn, sa, da, payload), the payload is bytes.
+        """
+        offset = int(self.index['offset'][record])
+        timestamp, pgn, sa, da, priority, length = _RECORD_HEADER.unpack_from(self._data, offset)
+        start = offset + _RECORD_HEADER.size
+        return timestamp, priority, pgn, sa, da, self._data[start:start + length]
+
+    def records(self, start=None, end=None, pgns=None):
+        """Iterates over the records, optionally selected by time and PGN
+
+        See :meth:`select` for the parameters and :meth:`read` for the records.
+        """
+        for record in self.select(start, end, pgns).tolist():
+            yield self.read(record)
+
+    def close(self):
+        """Closes the memory-mapped files"""
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._data.close()
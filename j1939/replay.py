@@ -0,0 +1,123 @@
+import logging
+import time
+
+import can
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """Clock following the timestamps of replayed messages
+
+    Pass an instance as ``clock`` to :class:`j1939.ElectronicControlUnit` to run the
+    timeouts of the transport protocols and the timer events in the time of a log.
+    The clock never goes backwards.
+    """
+
+    def __init__(self, start=0.0):
+        """
+        :param float start:
+            The initial time in seconds. Timer events added before the first message
+            is replayed are relative to this time.
+        """
+        self._now = start
+
+    def __call__(self):
+        return self._now
+
+    def advance(self, timestamp):
+        """Advances the clock to the given time, earlier times are ignored
+
+        :param float timestamp:
+            The new time in seconds.
+        """
+        if timestamp > self._now:
+            self._now = timestamp
+
+
+class LogReplay:
+    """Feeds recorded CAN traffic into an ECU
+
+    The messages are read by :class:`can.LogReader` (candump, ASC, BLF, CSV, TRC, ...)
+    and passed to :meth:`j1939.ElectronicControlUnit.notify` with their original timestamps.
+
+    If the ECU was created with a :class:`VirtualClock` as clock, the clock is advanced to the
+    timestamp of each message and the jobs of the ECU are processed before the message is fed.
+    The timeouts of the transport protocols follow the time of the log and the log is replayed
+    as fast as possible.
+    With ``realtime=True`` the messages are paced to the wall clock instead, which also works
+    for an ECU with the default clock.
+
+    The frames the ECU sends during the replay (e.g. CTS of a transport protocol session
+    addressed to one of its CAs) go to its send function as usual.
+    """
+
+    def __init__(self, ecu, source, realtime=False, speed=1.0, channel=None):
+        """
+        :param ecu:
+            The :class:`j1939.ElectronicControlUnit` to feed.
+        :param source:
+            File name of the log or an iterable of :class:`can.Message`.
+        :param bool realtime:
+            If True, the messages are paced to the wall clock.
+        :param float speed:
+            Factor of the replay speed in real time, 2.0 replays twice as fast as recorded.
+        :param channel:
+            If given, only the messages of this channel are replayed.
+        :raises ValueError:
+            When replaying at full speed with an ECU without :class:`VirtualClock`.
+        """
+        self._clock = ecu._clock if isinstance(ecu._clock, VirtualClock) else None
+        if (not realtime) and (self._clock is None):
+            raise ValueError("replaying at full speed requires an ECU created with a j1939.VirtualClock")
+        if speed <= 0:
+            raise ValueError("the speed must be positive")
+        self._ecu = ecu
+        self._source = source
+        self._realtime = realtime
+        self._speed = speed
+        self._channel = channel
+
+    def run(self):
+        """Replays the log
+
+        :return:
+            The number of messages fed into the ECU.
+        """
+        if isinstance(self._source, str):
+            reader = can.LogReader(self._source)
+            try:
+                return self._replay(reader)
+            finally:
+                reader.stop()
+        return self._replay(self._source)
+
+    def _replay(self, messages):
+        ecu = self._ecu
+        clock = self._clock
+        count = 0
+        start = None
+        for msg in messages:
+            if msg.is_error_frame or msg.is_remote_frame or (not msg.is_extended_id):
+                continue
+            if (self._channel is not None) and (msg.channel != self._channel):
+                continue
+
+            if self._realtime:
+                if start is None:
+                    start = (time.perf_counter(), msg.timestamp)
+                delay = start[0] + (msg.timestamp - start[1]) / self._speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if clock is not None:
+                clock.advance(msg.timestamp)
+                ecu.process_jobs()
+
+            try:
+                ecu.notify(msg.arbitration_id, msg.data, msg.timestamp)
+            except Exception as e:
+                # Exceptions in any callbaks should not stop the replay
+                logger.error(str(e))
+            count += 1
+        return count
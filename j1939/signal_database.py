@@ -0,0 +1,344 @@
+import json
+import os
+
+import numpy as np
+
+from .controller_application import ControllerApplication
+
+FieldValue = ControllerApplication.FieldValue
+
+
+def _default_ranges(length):
+    """Returns the raw ranges of a parameter with the given length in bits
+
+    The ranges of parameters with 8 or more bits follow :class:`j1939.ControllerApplication.FieldValue`,
+    scaled to the length: e.g. for 16 bits the values up to 0xFAFF are valid, 0xFE00 and above
+    indicate an error, 0xFF00 and above "not available".
+    Parameters with 2 to 7 bits use the highest value for "not available" and the one below for "error".
+
+    :return:
+        tuple (maximum valid value, minimum error value, minimum "not available" value)
+    """
+    if length >= 8:
+        shift = length - 8
+        return ((FieldValue.MAX_8 + 1) << shift) - 1, FieldValue.NOT_VALID_8 << shift, FieldValue.NOT_AVAILABLE_8 << shift
+    if length >= 2:
+        na = (1 << length) - 1
+        return na - 2, na - 1, na
+    # a single bit has no error or "not available" indication
+    return 1, 2, 2
+
+
+class SpnDefinition:
+    """Definition of a Suspect Parameter Number (SPN) within the payload of a PGN
+
+    The raw value is a little endian integer of ``length`` bits, starting at bit ``start_bit``
+    of the payload (bit 0 is the least significant bit of the first byte), unsigned unless ``signed``.
+    The physical value is ``raw * scale + offset``.
+    """
+
+    class Status:
+        VALID = 0
+        RESERVED = 1        # above the valid range, but below the error indication
+        ERROR = 2           # error indication
+        NOT_AVAILABLE = 3   # parameter not available
+
+    def __init__(self, name, start_bit, length, scale=1.0, offset=0.0, spn=None, unit='', valid_max=None, error_min=None, not_available_min=None, signed=False, choices=None):
+        """
+        :param str name:
+            Name of the parameter, unique within the PGN.
+        :param int start_bit:
+            Position of the least significant bit in the payload.
+        :param int length:
+            Number of bits (1..57, the parameter must fit into 8 bytes starting at its first byte).
+        :param float scale:
+            Resolution per bit.
+        :param float offset:
+            Offset of the physical value.
+        :param int spn:
+            Optional number of the SPN.
+        :param str unit:
+            Optional unit of the physical value.
+        :param int valid_max:
+            Maximum valid raw value, overrides the default derived from the length.
+        :param int error_min:
+            Minimum raw value indicating an error, overrides the default derived from the length.
+        :param int not_available_min:
+            Minimum raw value indicating "not available", overrides the default derived from the length.
+        :param bool signed:
+            If True, the raw value is a two's complement integer without error and "not available" ranges.
+        :param dict choices:
+            Optional descriptions of raw values, raw value -> str.
+        """
+        if (start_bit < 0) or (length < 1) or ((start_bit % 8) + length > 64):
+            raise ValueError("invalid start bit {} or length {} of SPN {}".format(start_bit, length, name))
+        self.name = name
+        self.start_bit = start_bit
+        self.length = length
+        self.scale = scale
+        self.offset = offset
+        self.spn = spn
+        self.unit = unit
+        self.signed = signed
+        self.choices = {int(raw): description for raw, description in choices.items()} if choices else {}
+        if signed:
+            # the whole raw range is valid
+            default_valid_max, default_error_min, default_not_available_min = (1 << length) - 1, 1 << length, 1 << length
+        else:
+            default_valid_max, default_error_min, default_not_available_min = _default_ranges(length)
+        self.valid_max = default_valid_max if valid_max is None else valid_max
+        self.error_min = default_error_min if error_min is None else error_min
+        self.not_available_min = default_not_available_min if not_available_min is None else not_available_min
+        # error_min and not_available_min of 2 ** length mean "no such range"
+        if (self.valid_max < 0) or not (1 <= self.error_min <= (1 << length)) or not (1 <= self.not_available_min <= (1 << length)):
+            raise ValueError("invalid raw value ranges of SPN {}".format(name))
+
+    @classmethod
+    def from_dict(cls, definition):
+        """Creates the definition from a dict with the keys of the constructor arguments"""
+        return cls(**definition)
+
+
+class PgnDefinition:
+    """Definition of the SPNs of a PGN, compiled into decoders and an encoder
+
+    The decoders handle a single payload or a matrix of payloads. The matrix decoder extracts
+    all SPNs of the PGN with one vectorized shift, mask and scale over an (N, number of SPNs) array.
+    """
+
+    def __init__(self, pgn, spns, name='', length=None):
+        """
+        :param int pgn:
+            The Parameter Group Number.
+        :param spns:
+            Iterable of :class:`SpnDefinition`.
+        :param str name:
+            Optional name (acronym) of the PGN.
+        :param int length:
+            Length of an encoded payload in bytes, by default the bytes covered by the SPNs, at least 8.
+        """
+        self.pgn = pgn
+        self.name = name
+        self.spns = list(spns)
+        names = [spn.name for spn in self.spns]
+        if len(set(names)) != len(names):
+            raise ValueError("SPN names of PGN {} are not unique".format(pgn))
+        self._names = names
+
+        # number of payload bytes covered by the SPNs
+        self._num_bytes = max([(spn.start_bit + spn.length + 7) // 8 for spn in self.spns], default=0)
+        self.length = max(self._num_bytes, 8) if length is None else length
+
+        # single payload: (name, start bit, mask, scale, offset, valid max, sign bit)
+        self._single = [(spn.name, spn.start_bit, (1 << spn.length) - 1, spn.scale, spn.offset, spn.valid_max,
+                         (1 << (spn.length - 1)) if spn.signed else None) for spn in self.spns]
+
+        # matrix: each SPN is read from a 64 bit little endian word starting at a byte of the payload,
+        # all SPNs within the first 8 bytes share the first word
+        byte_offsets = [0 if spn.start_bit + spn.length <= 64 else spn.start_bit // 8 for spn in self.spns]
+        self._word_offsets = sorted(set(byte_offsets))
+        self._word_index = np.array([self._word_offsets.index(byte) for byte in byte_offsets], dtype=np.intp)
+        self._word_bytes = (max(self._word_offsets) + 8) if self.spns else 8
+        self._shifts = np.array([spn.start_bit - 8 * byte for spn, byte in zip(self.spns, byte_offsets)], dtype=np.uint64)
+        self._masks = np.array([(1 << spn.length) - 1 for spn in self.spns], dtype=np.uint64)
+        self._scales = np.array([spn.scale for spn in self.spns], dtype=np.float64)
+        self._offsets = np.array([spn.offset for spn in self.spns], dtype=np.float64)
+        # signed SPNs are sign extended by shifting their sign bit to bit 63 and back (arithmetic shift)
+        self._signed_columns = np.array([i for i, spn in enumerate(self.spns) if spn.signed], dtype=np.intp)
+        self._sign_shifts = np.array([64 - spn.length for spn in self.spns if spn.signed], dtype=np.uint64)
+        # the ranges as the highest raw value below them, 2 ** 64 does not fit into uint64
+        self._valid_max = np.array([min(spn.valid_max, (1 << spn.length) - 1) for spn in self.spns], dtype=np.uint64)
+        self._error_below = np.array([spn.error_min - 1 for spn in self.spns], dtype=np.uint64)
+        self._not_available_below = np.array([spn.not_available_min - 1 for spn in self.spns], dtype=np.uint64)
+
+    @classmethod
+    def from_dict(cls, definition):
+        """Creates the definition from a dict with the keys 'pgn', 'spns' (list of dicts) and optional 'name' and 'length'"""
+        return cls(definition['pgn'], [SpnDefinition.from_dict(spn) for spn in definition.get('spns', [])], definition.get('name', ''), definition.get('length'))
+
+    def decode(self, payload):
+        """Decodes a single payload
+
+        Missing bytes at the end of the payload are treated as 0xFF (not available).
+
+        :param payload:
+            The bytes-like payload.
+        :return:
+            dict SPN name -> physical value, None if the raw value is not valid
+            (reserved, error or not available)
+        """
+        data = bytes(payload[:self._num_bytes])
+        if len(data) < self._num_bytes:
+            data += b'\xFF' * (self._num_bytes - len(data))
+        word = int.from_bytes(data, 'little')
+        values = {}
+        for name, start_bit, mask, scale, offset, valid_max, sign_bit in self._single:
+            raw = (word >> start_bit) & mask
+            if raw > valid_max:
+                values[name] = None
+                continue
+            if (sign_bit is not None) and (raw >= sign_bit):
+                raw -= mask + 1
+            values[name] = raw * scale + offset
+        return values
+
+    def encode(self, values):
+        """Encodes a payload
+
+        :param dict values:
+            SPN name -> physical value. The bits of SPNs which are missing or None are set to 1 (not available).
+            The values are rounded to the resolution and limited to the valid range.
+        :return:
+            bytearray of :attr:`length` bytes, the bytes not covered by the SPNs are 0xFF.
+        """
+        word = (1 << (8 * self.length)) - 1
+        for name, start_bit, mask, scale, offset, valid_max, sign_bit in self._single:
+            value = values.get(name)
+            if value is None:
+                continue
+            raw = round((value - offset) / scale)
+            if sign_bit is not None:
+                raw = min(max(raw, -sign_bit), sign_bit - 1) & mask
+            else:
+                raw = min(max(raw, 0), valid_max)
+            word = (word & ~(mask << start_bit)) | (raw << start_bit)
+        return bytearray(word.to_bytes(self.length, 'little'))
+
+    def _raw(self, matrix):
+        """Returns the (N, number of SPNs) matrix of the raw values"""
+        matrix = np.asarray(matrix, dtype=np.uint8)
+        if matrix.ndim != 2:
+            raise ValueError("the payloads must be a (N, L) matrix")
+        num_bytes = min(matrix.shape[1], self._word_bytes)
+        if (num_bytes == self._word_bytes) and (len(self._word_offsets) == 1):
+            words = np.ascontiguousarray(matrix[:, :8]).view('<u8')
+        else:
+            padded = np.full((matrix.shape[0], self._word_bytes), 0xFF, dtype=np.uint8)
+            padded[:, :num_bytes] = matrix[:, :num_bytes]
+            words = np.concatenate([np.ascontiguousarray(padded[:, byte:byte + 8]).view('<u8') for byte in self._word_offsets], axis=1)
+        return (words[:, self._word_index] >> self._shifts) & self._masks
+
+    def decode_matrix(self, matrix, status=False):
+        """Decodes a matrix of payloads
+
+        :param matrix:
+            (N, L) uint8 array-like with one payload per row, e.g. the 'payload' of
+            :meth:`j1939.NpzExporter.arrays`. Missing bytes are treated as 0xFF (not available).
+        :param bool status:
+            If True, the status of each value is returned as well.
+        :return:
+            dict SPN name -> float64 array of the physical values, NaN where the raw value is not valid.
+            With status=True a tuple of this dict and a dict SPN name -> uint8 array of
+            :class:`SpnDefinition.Status`.
+        """
+        raw = self._raw(matrix)
+        statuses = ((raw > self._valid_max).astype(np.uint8) + (raw > self._error_below) + (raw > self._not_available_below))
+        values = raw.astype(np.float64)
+        if len(self._signed_columns):
+            signed = (raw[:, self._signed_columns] << self._sign_shifts).view(np.int64) >> self._sign_shifts.astype(np.int64)
+            values[:, self._signed_columns] = signed
+        values = values * self._scales + self._offsets
+        values[statuses != SpnDefinition.Status.VALID] = np.nan
+        columns = {name: values[:, i] for i, name in enumerate(self._names)}
+        if status:
+            return columns, {name: statuses[:, i] for i, name in enumerate(self._names)}
+        return columns
+
+
+class SignalDatabase:
+    """Collection of PGN definitions, loaded from JSON or YAML
+
+    The definition file holds a list of PGNs under the key 'pgns'::
+
+        pgns:
+          - pgn: 61444
+            name: EEC1
+            spns:
+              - {name: EngineSpeed, spn: 190, start_bit: 24, length: 16, scale: 0.125, unit: rpm}
+
+    Loading YAML requires PyYAML.
+    """
+
+    def __init__(self, pgns=()):
+        """
+        :param pgns:
+            Iterable of :class:`PgnDefinition`.
+        """
+        # pgn -> PgnDefinition
+        self._pgns = {}
+        for definition in pgns:
+            self.add(definition)
+
+    @classmethod
+    def from_dict(cls, definition):
+        """Creates the database from a dict with the key 'pgns' (list of dicts, see :meth:`PgnDefinition.from_dict`)"""
+        return cls([PgnDefinition.from_dict(pgn) for pgn in definition.get('pgns', [])])
+
+    @classmethod
+    def load(cls, filename, cache_dir=None):
+        """Loads the database from a JSON file or, with the extension .yaml or .yml, from a YAML file
+        or, with the extension .dbc, from a DBC file (see :func:`j1939.load_dbc`)
+
+        :param str filename:
+            The definition file.
+        :param cache_dir:
+            Cache directory of parsed DBC files, see :func:`j1939.load_dbc`.
+        """
+        if os.path.splitext(filename)[1].lower() == '.dbc':
+            from .dbc import load_dbc
+            return load_dbc(filename, cache_dir)
+        with open(filename, 'r') as f:
+            if os.path.splitext(filename)[1].lower() in ('.yaml', '.yml'):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("loading {} requires PyYAML".format(filename))
+                definition = yaml.safe_load(f)
+            else:
+                definition = json.load(f)
+        return cls.from_dict(definition)
+
+    def add(self, definition):
+        """Adds or replaces the definition of a PGN
+
+        :param PgnDefinition definition:
+            The definition.
+        """
+        self._pgns[definition.pgn] = definition
+
+    def __contains__(self, pgn):
+        return pgn in self._pgns
+
+    def __getitem__(self, pgn):
+        return self._pgns[pgn]
+
+    def __len__(self):
+        return len(self._pgns)
+
+    def pgns(self):
+        """Returns the sorted list of defined PGNs"""
+        return sorted(self._pgns)
+
+    def decode(self, pgn, payload):
+        """Decodes a single payload, see :meth:`PgnDefinition.decode`
+
+        :raises KeyError:
+            If the PGN is not defined.
+        """
+        return self._pgns[pgn].decode(payload)
+
+    def decode_matrix(self, pgn, matrix, status=False):
+        """Decodes a matrix of payloads, see :meth:`PgnDefinition.decode_matrix`
+
+        :raises KeyError:
+            If the PGN is not defined.
+        """
+        return self._pgns[pgn].decode_matrix(matrix, status)
+
+    def encode(self, pgn, values):
+        """Encodes a payload, see :meth:`PgnDefinition.encode`
+
+        :raises KeyError:
+            If the PGN is not defined.
+        """
+        return self._pgns[pgn].encode(values)
@@ -0,0 +1,215 @@
+import bisect
+
+import numpy as np
+
+class Statistics:
+    """Runtime counters of an ECU or a bus segment.
+
+    The counters are always active and updated in place by the receiving thread,
+    the job thread and the senders. They are not protected by a lock to keep the
+    overhead per frame low, concurrent updates of the same counter from different
+    threads may get lost occasionally.
+
+    Counters per PGN use the PGN with PDU specific 0 for PDU1 messages.
+    """
+
+    #: Upper bounds in seconds of the buckets of the callback duration histograms,
+    #: the last bucket counts all longer durations.
+    HISTOGRAM_BOUNDS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Resets all counters and the base of :meth:`delta`"""
+        self._rx = self._new_traffic()
+        self._tx = self._new_traffic()
+        self._tp = {'opened': 0, 'completed': 0, 'aborted': {}, 'timeouts': 0, 'cts_pauses': 0}
+        self._multi_pg = {'frames': 0, 'c_pgs': 0, 'payload_bytes': 0, 'frame_bytes': 0}
+        self.job_wakeups = 0
+        # subscription id -> [name, calls, total time, histogram]
+        # keyed by the id, not by the callback, to keep no reference to unsubscribed callbacks
+        self._callbacks = {}
+        self._last = self._raw()
+
+    @staticmethod
+    def _new_traffic():
+        return {'frames': 0, 'bytes': 0, 'frames_by_pgn': {}, 'bytes_by_pgn': {}, 'frames_by_sa': {}, 'bytes_by_sa': {}}
+
+    @staticmethod
+    def _count_frame(traffic, can_id, extended_id, length):
+        traffic['frames'] += 1
+        traffic['bytes'] += length
+        if not extended_id:
+            return
+        pgn = (can_id >> 8) & 0x1FFFF
+        if ((pgn >> 8) & 0xFF) < 240:
+            pgn &= 0x1FF00
+        sa = can_id & 0xFF
+        frames, octets = traffic['frames_by_pgn'], traffic['bytes_by_pgn']
+        frames[pgn] = frames.get(pgn, 0) + 1
+        octets[pgn] = octets.get(pgn, 0) + length
+        frames, octets = traffic['frames_by_sa'], traffic['bytes_by_sa']
+        frames[sa] = frames.get(sa, 0) + 1
+        octets[sa] = octets.get(sa, 0) + length
+
+    def count_rx(self, can_id, length, extended_id=True):
+        """Counts a received frame"""
+        self._count_frame(self._rx, can_id, extended_id, length)
+
+    def count_rx_batch(self, can_ids, lengths):
+        """Counts a block of received frames with 29-bit CAN-IDs in one vectorized pass
+
+        :param can_ids:
+            Sequence or numpy array of the CAN-IDs.
+        :param lengths:
+            Sequence or numpy array of the data lengths.
+        """
+        can_ids = np.asarray(can_ids, dtype=np.uint32)
+        if can_ids.size == 0:
+            return
+        lengths = np.asarray(lengths, dtype=np.int64)
+        traffic = self._rx
+        traffic['frames'] += int(can_ids.size)
+        traffic['bytes'] += int(lengths.sum())
+        pgns = (can_ids >> 8) & 0x1FFFF
+        pgns = np.where(((pgns >> 8) & 0xFF) < 240, pgns & 0x1FF00, pgns)
+        self._count_keys(traffic['frames_by_pgn'], traffic['bytes_by_pgn'], pgns, lengths)
+        self._count_keys(traffic['frames_by_sa'], traffic['bytes_by_sa'], can_ids & 0xFF, lengths)
+
+    @staticmethod
+    def _count_keys(frames, octets, keys, lengths):
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        sums = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(sums, inverse, lengths)
+        for key, count, length in zip(keys.tolist(), counts.tolist(), sums.tolist()):
+            frames[key] = frames.get(key, 0) + count
+            octets[key] = octets.get(key, 0) + length
+
+    def count_tx(self, can_id, length, extended_id=True):
+        """Counts a sent frame"""
+        self._count_frame(self._tx, can_id, extended_id, length)
+
+    def count_tp_opened(self):
+        """Counts an opened transport protocol session (sent or received)"""
+        self._tp['opened'] += 1
+
+    def count_tp_completed(self):
+        """Counts a successfully finished transport protocol session"""
+        self._tp['completed'] += 1
+
+    def count_tp_aborted(self, reason):
+        """Counts a sent or received transport protocol abort
+
+        :param int reason:
+            The connection abort reason.
+        """
+        aborted = self._tp['aborted']
+        aborted[reason] = aborted.get(reason, 0) + 1
+
+    def count_tp_timeout(self):
+        """Counts a transport protocol session closed by a timeout"""
+        self._tp['timeouts'] += 1
+
+    def count_cts_pause(self):
+        """Counts a received CTS requesting a pause of the transmission"""
+        self._tp['cts_pauses'] += 1
+
+    def count_multi_pg(self, c_pgs, payload_bytes, frame_bytes):
+        """Counts a sent multi-pg frame
+
+        :param int c_pgs:
+            Number of contained parameter groups.
+        :param int payload_bytes:
+            Sum of the payload lengths of the contained parameter groups.
+        :param int frame_bytes:
+            Length of the frame including headers and padding.
+        """
+        self._multi_pg['frames'] += 1
+        self._multi_pg['c_pgs'] += c_pgs
+        self._multi_pg['payload_bytes'] += payload_bytes
+        self._multi_pg['frame_bytes'] += frame_bytes
+
+    def record_callback(self, subscription_id, name, duration):
+        """Records the execution time of a subscriber callback
+
+        :param int subscription_id:
+            The id of the subscription, each subscription is counted separately.
+        :param str name:
+            The display name of the callback.
+        :param float duration:
+            Execution time in seconds.
+        """
+        entry = self._callbacks.get(subscription_id)
+        if entry is None:
+            entry = self._callbacks[subscription_id] = [name, 0, 0.0, [0] * (len(self.HISTOGRAM_BOUNDS) + 1)]
+        entry[1] += 1
+        entry[2] += duration
+        entry[3][bisect.bisect_left(self.HISTOGRAM_BOUNDS, duration)] += 1
+
+    def snapshot(self):
+        """Returns the current counters
+
+        :return:
+            dict with the keys
+
+            * 'rx', 'tx': dicts with 'frames', 'bytes' and the dicts 'frames_by_pgn',
+              'bytes_by_pgn', 'frames_by_sa' and 'bytes_by_sa'
+            * 'tp': dict with 'opened', 'completed', 'timeouts', 'cts_pauses' and
+              'aborted', a dict abort reason -> count
+            * 'multi_pg': dict with 'frames', 'c_pgs', 'payload_bytes', 'frame_bytes' and 'efficiency',
+              the share of the payload in the sent multi-pg frames (None if nothing was sent)
+            * 'job_wakeups': number of runs of the job handling
+            * 'callbacks': dict subscription id -> dict with 'name', the display name of the callback,
+              'calls', 'total_time' and 'histogram', the counts per bucket of :attr:`HISTOGRAM_BOUNDS`
+        """
+        return self._derive(self._raw())
+
+    def delta(self):
+        """Returns the change of the counters since the last call of :meth:`delta` or :meth:`reset`
+
+        The structure is the same as of :meth:`snapshot`.
+        """
+        raw = self._raw()
+        result = self._subtract(raw, self._last)
+        self._last = raw
+        return self._derive(result)
+
+    def _raw(self):
+        callbacks = {subscription_id: {'name': name, 'calls': calls, 'total_time': total_time, 'histogram': list(histogram)}
+                     for subscription_id, (name, calls, total_time, histogram) in list(self._callbacks.items())}
+        return {
+            'rx': self._copy(self._rx),
+            'tx': self._copy(self._tx),
+            'tp': self._copy(self._tp),
+            'multi_pg': dict(self._multi_pg),
+            'job_wakeups': self.job_wakeups,
+            'callbacks': callbacks,
+        }
+
+    @staticmethod
+    def _copy(counters):
+        # dict() copies without running python code, so the copy is consistent although other threads update the counters
+        return {key: dict(value) if isinstance(value, dict) else value for key, value in dict(counters).items()}
+
+    @classmethod
+    def _subtract(cls, current, last):
+        if isinstance(current, dict):
+            result = {}
+            for key, value in current.items():
+                if key in last:
+                    value = cls._subtract(value, last[key])
+                result[key] = value
+            return result
+        if isinstance(current, list):
+            return [a - b for a, b in zip(current, last)]
+        if isinstance(current, str):
+            return current
+        return current - last
+
+    @staticmethod
+    def _derive(counters):
+        multi_pg = counters['multi_pg']
+        multi_pg['efficiency'] = (multi_pg['payload_bytes'] / multi_pg['frame_bytes']) if multi_pg['frame_bytes'] else None
+        return counters
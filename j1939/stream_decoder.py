@@ -0,0 +1,489 @@
+import collections
+import itertools
+import logging
+import multiprocessing
+import operator
+import os
+import queue
+
+import numpy as np
+
+from .parameter_group_number import ParameterGroupNumber
+from .message_id import decode_can_id
+from .j1939_21 import J1939_21
+from .j1939_22 import J1939_22
+
+logger = logging.getLogger(__name__)
+
+
+class EtpConnectionMode:
+    """Control bytes of the Extended Transport Protocol Connection Management (ETP.CM) according SAE J1939-21"""
+    RTS = 20
+    CTS = 21
+    DPO = 22 # data packet offset
+    EOM_ACK = 23
+    ABORT = 255
+
+
+class _Protocol:
+    TP = 0      # SAE J1939-21 transport protocol (BAM and RTS/CTS)
+    ETP = 1     # SAE J1939-21 extended transport protocol
+    FD_TP = 2   # SAE J1939-22 transport protocol
+
+
+class _Session:
+    """Reassembly state of one transport protocol session"""
+
+    __slots__ = ('pgn', 'message_size', 'num_packets', 'next_packet', 'packet_offset', 'received', 'timeout', 'deadline', 'data')
+
+    def __init__(self, pgn, message_size, num_packets, timeout, timestamp):
+        self.pgn = pgn
+        self.message_size = message_size
+        self.num_packets = num_packets
+        # expected sequence number of the next data transfer frame
+        self.next_packet = 1
+        # number of packets transferred before the current ETP.DPO
+        self.packet_offset = 0
+        self.received = 0
+        self.timeout = timeout
+        self.deadline = timestamp + timeout
+        self.data = bytearray(message_size)
+
+
+class _StreamDecoder:
+    """Reassembles the transport protocol sessions of a recorded stream of frames
+
+    The sessions are observed from the outside, no frame is sent. Each session is
+    keyed by an int built from the protocol, the session number, source and destination address.
+    Timeouts are evaluated with the timestamps of the frames only.
+    """
+
+    def __init__(self, timeouts):
+        self._timeouts = timeouts
+        # key -> _Session
+        self._sessions = {}
+        self.handlers = {
+            ParameterGroupNumber.PGN.TP_CM: self._process_tp_cm,
+            ParameterGroupNumber.PGN.DATATRANSFER: self._process_tp_dt,
+            ParameterGroupNumber.PGN.ETP_CM: self._process_etp_cm,
+            ParameterGroupNumber.PGN.ETP_DT: self._process_etp_dt,
+            ParameterGroupNumber.PGN.FD_TP_CM: self._process_fd_tp_cm,
+            ParameterGroupNumber.PGN.FD_TP_DT: self._process_fd_tp_dt,
+            ParameterGroupNumber.PGN.FEFF_MULTI_PG: self._process_multi_pg,
+        }
+
+    @staticmethod
+    def _key(protocol, session_num, src_address, dest_address):
+        return (protocol << 24) | ((session_num & 0xF) << 16) | ((src_address & 0xFF) << 8) | (dest_address & 0xFF)
+
+    def _open(self, key, pgn, message_size, num_packets, timeout, timestamp):
+        if (message_size == 0) or (num_packets == 0):
+            return
+        # a new announcement replaces an unfinished session of the same key
+        self._sessions[key] = _Session(pgn, message_size, num_packets, timeout, timestamp)
+
+    def _refresh(self, key, timestamp):
+        session = self._sessions.get(key)
+        if session is not None:
+            session.deadline = timestamp + session.timeout
+        return session
+
+    def _abort(self, key, reverse_key):
+        self._sessions.pop(key, None)
+        self._sessions.pop(reverse_key, None)
+
+    def _store(self, key, timestamp, sequence_number, data, start, segment_size):
+        """Copies the data of a data transfer frame into its session
+
+        :param int key:
+            The key of the session.
+        :param float timestamp:
+            The timestamp of the frame.
+        :param int sequence_number:
+            The sequence number of the frame.
+        :param data:
+            The data of the frame.
+        :param int start:
+            The index of the first payload byte in the data.
+        :param int segment_size:
+            The number of payload bytes of a full data transfer frame.
+        :return:
+            The session, if the reassembly is complete, None otherwise.
+        """
+        session = self._sessions.get(key)
+        if session is None:
+            return None
+        if self._timeouts and (timestamp > session.deadline):
+            logger.debug("session 0x%x of PGN %d timed out", key, session.pgn)
+            del self._sessions[key]
+            return None
+        if sequence_number != session.next_packet:
+            if sequence_number > session.next_packet:
+                # data transfer frames are missing in the stream
+                logger.debug("session 0x%x of PGN %d: expected packet %d, got %d", key, session.pgn, session.next_packet, sequence_number)
+                del self._sessions[key]
+            # a lower sequence number repeats a frame, the session continues
+            return None
+
+        # padding bytes behind the message size are dropped
+        offset = (session.packet_offset + sequence_number - 1) * segment_size
+        length = max(0, min(len(data) - start, session.message_size - offset))
+        session.data[offset:offset + length] = data[start:start + length]
+        session.received = offset + length
+        session.next_packet = sequence_number + 1
+        session.deadline = timestamp + session.timeout
+        if session.received >= session.message_size:
+            return session
+        return None
+
+    def _process_tp_cm(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) < 8:
+            return ()
+        control_byte = data[0]
+        pgn = data[5] | (data[6] << 8) | (data[7] << 16)
+        if control_byte == J1939_21.ConnectionMode.RTS:
+            self._open(self._key(_Protocol.TP, 0, src_address, dest_address), pgn, data[1] | (data[2] << 8), data[3], J1939_21.Timeout.T2, timestamp)
+        elif control_byte == J1939_21.ConnectionMode.BAM:
+            self._open(self._key(_Protocol.TP, 0, src_address, dest_address), pgn, data[1] | (data[2] << 8), data[3], J1939_21.Timeout.T1, timestamp)
+        elif control_byte == J1939_21.ConnectionMode.CTS:
+            # sent by the receiver, the next packet may repeat already received packets
+            session = self._refresh(self._key(_Protocol.TP, 0, dest_address, src_address), timestamp)
+            if (session is not None) and (data[1] != 0):
+                session.next_packet = data[2]
+        elif control_byte == J1939_21.ConnectionMode.EOM_ACK:
+            self._sessions.pop(self._key(_Protocol.TP, 0, dest_address, src_address), None)
+        elif control_byte == J1939_21.ConnectionMode.ABORT:
+            # sent by either side of the connection
+            self._abort(self._key(_Protocol.TP, 0, src_address, dest_address), self._key(_Protocol.TP, 0, dest_address, src_address))
+        return ()
+
+    def _process_tp_dt(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) < 2:
+            return ()
+        key = self._key(_Protocol.TP, 0, src_address, dest_address)
+        session = self._store(key, timestamp, data[0], data, 1, 7)
+        if session is None:
+            return ()
+        del self._sessions[key]
+        return ((timestamp, priority, session.pgn, src_address, dest_address, session.data),)
+
+    def _process_etp_cm(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) < 8:
+            return ()
+        control_byte = data[0]
+        pgn = data[5] | (data[6] << 8) | (data[7] << 16)
+        if control_byte == EtpConnectionMode.RTS:
+            message_size = data[1] | (data[2] << 8) | (data[3] << 16) | (data[4] << 24)
+            self._open(self._key(_Protocol.ETP, 0, src_address, dest_address), pgn, message_size, (message_size + 6) // 7, J1939_21.Timeout.T2, timestamp)
+        elif control_byte == EtpConnectionMode.CTS:
+            self._refresh(self._key(_Protocol.ETP, 0, dest_address, src_address), timestamp)
+        elif control_byte == EtpConnectionMode.DPO:
+            # the sequence numbers of the following data transfer frames start at 1 again
+            session = self._refresh(self._key(_Protocol.ETP, 0, src_address, dest_address), timestamp)
+            if session is not None:
+                session.packet_offset = data[2] | (data[3] << 8) | (data[4] << 16)
+                session.next_packet = 1
+        elif control_byte == EtpConnectionMode.EOM_ACK:
+            self._sessions.pop(self._key(_Protocol.ETP, 0, dest_address, src_address), None)
+        elif control_byte == EtpConnectionMode.ABORT:
+            self._abort(self._key(_Protocol.ETP, 0, src_address, dest_address), self._key(_Protocol.ETP, 0, dest_address, src_address))
+        return ()
+
+    def _process_etp_dt(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) < 2:
+            return ()
+        key = self._key(_Protocol.ETP, 0, src_address, dest_address)
+        session = self._store(key, timestamp, data[0], data, 1, 7)
+        if session is None:
+            return ()
+        del self._sessions[key]
+        return ((timestamp, priority, session.pgn, src_address, dest_address, session.data),)
+
+    def _process_fd_tp_cm(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) < 12:
+            return ()
+        control_byte = data[0] & 0xF
+        session_num  = (data[0] >> 4) & 0xF
+        message_size = data[1] | (data[2] << 8) | (data[3] << 16)
+        segment_num  = data[4] | (data[5] << 8) | (data[6] << 16)
+        pgn          = data[9] | (data[10] << 8) | (data[11] << 16)
+        if control_byte == J1939_22.TpControlType.RTS:
+            self._open(self._key(_Protocol.FD_TP, session_num, src_address, dest_address), pgn, message_size, segment_num, J1939_22.Timeout.T2, timestamp)
+        elif control_byte == J1939_22.TpControlType.BAM:
+            self._open(self._key(_Protocol.FD_TP, session_num, src_address, dest_address), pgn, message_size, segment_num, J1939_22.Timeout.T1, timestamp)
+        elif control_byte == J1939_22.TpControlType.CTS:
+            session = self._refresh(self._key(_Protocol.FD_TP, session_num, dest_address, src_address), timestamp)
+            if (session is not None) and (data[7] != 0):
+                session.next_packet = segment_num
+        elif control_byte == J1939_22.TpControlType.EOM_STATUS:
+            # the message is delivered with the end of message status, as done by J1939_22
+            session = self._sessions.pop(self._key(_Protocol.FD_TP, session_num, src_address, dest_address), None)
+            if ((session is not None) and (session.received >= session.message_size)
+                    and (session.message_size == message_size) and (session.num_packets == segment_num)
+                    and not (self._timeouts and (timestamp > session.deadline))):
+                return ((timestamp, priority, session.pgn, src_address, dest_address, session.data),)
+        elif control_byte == J1939_22.TpControlType.ABORT:
+            self._abort(self._key(_Protocol.FD_TP, session_num, src_address, dest_address), self._key(_Protocol.FD_TP, session_num, dest_address, src_address))
+        return ()
+
+    def _process_fd_tp_dt(self, timestamp, priority, src_address, dest_address, data):
+        if len(data) <= 4:
+            return ()
+        session_num = (data[0] >> 4) & 0xF
+        segment_num = data[1] | (data[2] << 8) | (data[3] << 16)
+        # the reassembled message waits for the end of message status
+        self._store(self._key(_Protocol.FD_TP, session_num, src_address, dest_address), timestamp, segment_num, data, 4, J1939_22.DataLength.TP)
+        return ()
+
+    def _process_multi_pg(self, timestamp, priority, src_address, dest_address, data):
+        # currently "SAE J1939 with no assurance data" trailer format supported only, as by J1939_22
+        pdus = []
+        offset = 0
+        while len(data) - offset > 4:
+            tos = (data[offset] >> 5) & 0x7
+            # padding service
+            if tos == 0:
+                break
+            trailer_format = (data[offset] >> 2) & 0x7
+            cpgn           = ((data[offset] & 0x3) << 16) | (data[offset+1] << 8) | data[offset+2]
+            payload_length = data[offset+3]
+            if (tos == 2) and (trailer_format == 0):
+                pdus.append((timestamp, priority, cpgn, src_address, dest_address, bytes(data[(offset+4):(offset+4+payload_length)])))
+            # next c-pg
+            offset += 4 + payload_length
+        return pdus
+
+
+def decode_stream(frames, timeouts=True, processes=1, batch_size=65536):
+    """Decodes a recorded stream of J1939 frames into PDUs
+
+    The messages of the transport protocols are reassembled without a bus, a job thread
+    or any ControllerApplication: BAM and RTS/CTS of SAE J1939-21, the extended
+    transport protocol (ETP) of SAE J1939-21 and the transport protocol of SAE J1939-22 (FD-TP).
+    The c-PGs of SAE J1939-22 multi-PG frames are delivered one by one.
+    All other frames are delivered as they are, the connection management and data transfer
+    frames of the transport protocols are consumed.
+
+    The stream is observed from the outside: the sessions between any addresses are reassembled
+    and a session is dropped if one of its data transfer frames is missing.
+
+    Example for a candump, ASC or BLF file::
+
+        reader = can.LogReader('trace.blf')
+        frames = ((msg.timestamp, msg.arbitration_id, msg.data) for msg in reader if msg.is_extended_id)
+        for timestamp, priority, pgn, sa, da, payload in j1939.decode_stream(frames):
+            ...
+
+    :param frames:
+        Iterable of tuples (timestamp, can_id, data) ordered by timestamp.
+        The can_id is a 29-bit CAN-ID, the data is bytes-like.
+    :param bool timeouts:
+        If True, a session is dropped when the gap between two of its frames exceeds
+        the timeout of its protocol (e.g. T1 for a BAM). The timeouts are evaluated with the
+        timestamps of the frames.
+    :param int processes:
+        Number of worker processes reassembling the transport protocol sessions, None for
+        one per CPU. With more than one process the frames are read in batches, the transport
+        protocol frames are partitioned by the address of the session originator and each
+        partition is reassembled by its own process. The PDUs are merged back into the same
+        order as decoded by a single process. An exception raised by a worker is re-raised,
+        a worker exiting unexpectedly raises a RuntimeError.
+    :param int batch_size:
+        Number of frames per batch when decoding with more than one process.
+    :return:
+        Iterator of tuples (timestamp, priority, pgn, sa, da, payload) in the order of completion.
+        The timestamp and priority are those of the frame completing the PDU, the da of a PDU2
+        message is GLOBAL (255). The payload of a reassembled message is a bytearray owned by the caller.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1:
+        yield from _decode_parallel(frames, timeouts, processes, batch_size)
+        return
+
+    handlers = _StreamDecoder(timeouts).handlers
+    for timestamp, can_id, data in frames:
+        priority, pgn, sa, da, is_pdu2 = decode_can_id(can_id)
+        handler = None if is_pdu2 else handlers.get(pgn)
+        if handler is None:
+            yield (timestamp, priority, pgn, sa, da, data)
+        else:
+            yield from handler(timestamp, priority, sa, da, data)
+
+
+# PGNs of the frames reassembled by _StreamDecoder (with PDU specific == 0)
+_PROTOCOL_PGNS = np.array([
+    ParameterGroupNumber.PGN.TP_CM,
+    ParameterGroupNumber.PGN.DATATRANSFER,
+    ParameterGroupNumber.PGN.ETP_CM,
+    ParameterGroupNumber.PGN.ETP_DT,
+    ParameterGroupNumber.PGN.FD_TP_CM,
+    ParameterGroupNumber.PGN.FD_TP_DT,
+    ParameterGroupNumber.PGN.FEFF_MULTI_PG,
+], dtype=np.uint32)
+
+# connection management PGN -> (mask of the control byte, control bytes sent by the receiver of a session, abort control byte)
+_CONTROL_BYTES = {
+    ParameterGroupNumber.PGN.TP_CM: (0xFF, (J1939_21.ConnectionMode.CTS, J1939_21.ConnectionMode.EOM_ACK), J1939_21.ConnectionMode.ABORT),
+    ParameterGroupNumber.PGN.ETP_CM: (0xFF, (EtpConnectionMode.CTS, EtpConnectionMode.EOM_ACK), EtpConnectionMode.ABORT),
+    ParameterGroupNumber.PGN.FD_TP_CM: (0x0F, (J1939_22.TpControlType.CTS, J1939_22.TpControlType.EOM_ACK), J1939_22.TpControlType.ABORT),
+}
+_CONTROL_PGNS = np.array(list(_CONTROL_BYTES), dtype=np.uint32)
+
+
+# seconds between the checks whether the worker processes are still alive
+_RESULT_POLL_INTERVAL = 0.5
+
+
+def _take(sequence, indices):
+    return list(map(sequence.__getitem__, indices))
+
+
+def _decode_worker(tasks, results, timeouts):
+    """Reassembles the transport protocol frames of one partition
+
+    Each task is a batch (batch number, indices, timestamps, can_ids, datas), the result
+    of a batch is (batch number, list of (index of the completing frame, pdu), None).
+    The sessions are kept across the batches. If decoding fails, the result is
+    (batch number, None, exception) and the worker stops.
+    """
+    handlers = _StreamDecoder(timeouts).handlers
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_number, indices, timestamps, can_ids, datas = task
+        pdus = []
+        try:
+            for index, timestamp, can_id, data in zip(indices, timestamps, can_ids, datas):
+                priority, pgn, sa, da, _ = decode_can_id(can_id)
+                for pdu in handlers[pgn](timestamp, priority, sa, da, data):
+                    pdus.append((index, pdu))
+        except Exception as exc:
+            results.put((batch_number, None, exc))
+            break
+        results.put((batch_number, pdus, None))
+
+
+def _get_result(results, workers):
+    """Waits for the next result of the workers
+
+    :raises RuntimeError:
+        If a worker exited without sending a result.
+    """
+    while True:
+        try:
+            return results.get(timeout=_RESULT_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+        # the workers run until the end of the stream, an exit before is a failure
+        dead = [worker for worker in workers if worker.exitcode is not None]
+        if dead:
+            try:
+                # a result sent just before the exit may still be in transit
+                return results.get(timeout=_RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                raise RuntimeError("decoder worker process exited unexpectedly with exit code {}".format(dead[0].exitcode)) from None
+
+
+def _dispatch(batch, batch_number, tasks):
+    """Classifies a batch, sends its transport protocol frames to the workers
+
+    The frames of a session are sent by its originator, except the CTS and EOM_ACK of the receiver.
+    These are sent to the partition of their destination address, aborts to both partitions.
+
+    :return:
+        tuple (indices of the other frames, their PDUs)
+    """
+    processes = len(tasks)
+    timestamps, can_ids, datas = zip(*batch)
+    ids = np.array(can_ids, dtype=np.uint32)
+    pgns = (ids >> 8) & 0x1FFFF
+    is_pdu2 = ((pgns >> 8) & 0xFF) >= 240
+    # PDU1: the pdu_specific is the destination address and not part of the pgn
+    pgn_values = np.where(is_pdu2, pgns, pgns & 0x1FF00)
+    source_addresses = ids & 0xFF
+    dest_addresses = np.where(is_pdu2, ParameterGroupNumber.Address.GLOBAL, pgns & 0xFF)
+    protocol = ~is_pdu2 & np.isin(pgn_values, _PROTOCOL_PGNS)
+
+    partitions = source_addresses % processes
+    aborts = [[] for _ in range(processes)]
+    for i in np.nonzero(protocol & np.isin(pgn_values, _CONTROL_PGNS))[0].tolist():
+        data = datas[i]
+        if len(data) == 0:
+            continue
+        mask, receiver_control_bytes, abort = _CONTROL_BYTES[int(pgn_values[i])]
+        control_byte = data[0] & mask
+        dest_partition = int(dest_addresses[i]) % processes
+        if control_byte in receiver_control_bytes:
+            partitions[i] = dest_partition
+        elif (control_byte == abort) and (dest_partition != partitions[i]):
+            aborts[dest_partition].append(i)
+
+    for partition, task_queue in enumerate(tasks):
+        indices = np.nonzero(protocol & (partitions == partition))[0]
+        if aborts[partition]:
+            indices = np.union1d(indices, aborts[partition])
+        indices = indices.tolist()
+        task_queue.put((batch_number, indices, _take(timestamps, indices), _take(can_ids, indices), _take(datas, indices)))
+
+    plain = np.nonzero(~protocol)[0]
+    indices = plain.tolist()
+    pdus = list(zip(_take(timestamps, indices), ((ids[plain] >> 26) & 0x7).tolist(), pgn_values[plain].tolist(),
+                    source_addresses[plain].tolist(), dest_addresses[plain].tolist(), _take(datas, indices)))
+    return plain, pdus
+
+
+def _merge(plain, pdus, partition_results):
+    """Inserts the reassembled PDUs of the workers at the index of their completing frame"""
+    reassembled = sorted(itertools.chain.from_iterable(partition_results), key=operator.itemgetter(0))
+    if not reassembled:
+        return pdus
+    positions = np.searchsorted(plain, [index for index, _ in reassembled]).tolist()
+    merged = []
+    start = 0
+    for position, (_, pdu) in zip(positions, reassembled):
+        merged.extend(pdus[start:position])
+        merged.append(pdu)
+        start = position
+    merged.extend(pdus[start:])
+    return merged
+
+
+def _decode_parallel(frames, timeouts, processes, batch_size):
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    tasks = [context.Queue() for _ in range(processes)]
+    workers = [context.Process(target=_decode_worker, args=(task_queue, results, timeouts), daemon=True) for task_queue in tasks]
+    for worker in workers:
+        worker.start()
+
+    frames = iter(frames)
+    # batches sent to the workers: (batch number, indices of the other frames, their PDUs)
+    pending = collections.deque()
+    # batch number -> results of the workers
+    received = collections.defaultdict(list)
+    try:
+        for batch_number in itertools.count():
+            batch = list(itertools.islice(frames, batch_size))
+            if batch:
+                pending.append((batch_number, *_dispatch(batch, batch_number, tasks)))
+            # the workers decode the next batch while the PDUs of the previous one are merged
+            while pending and ((len(pending) > 1) or not batch):
+                number, plain, pdus = pending.popleft()
+                while len(received[number]) < processes:
+                    result_number, result, error = _get_result(results, workers)
+                    if error is not None:
+                        raise error
+                    received[result_number].append(result)
+                yield from _merge(plain, pdus, received.pop(number))
+            if not batch:
+                break
+    finally:
+        for task_queue in tasks:
+            task_queue.put(None)
+        for worker in workers:
+            worker.join(timeout=1.0)
+            if worker.is_alive():
+                # stopped early, the results of the worker were not consumed
+                worker.terminate()
@@ -0,0 +1,62 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+class SubscriberDispatcher:
+    """Executes the subscriber notifications of an ECU in worker threads.
+
+    The notifications are distributed to the workers by (source address, PGN).
+    All notifications with the same (source address, PGN) are executed by the
+    same worker, so their order is preserved. The receive path only enqueues
+    the notifications and is never blocked by slow subscribers.
+    """
+
+    def __init__(self, dispatch, num_workers=1):
+        """
+        :param dispatch:
+            Function called in the worker threads with the arguments
+            (priority, pgn, sa, dest, timestamp, data) of the notification.
+        :param int num_workers:
+            Number of worker threads.
+        """
+        if num_workers < 1:
+            raise ValueError("at least one worker is required")
+        self._dispatch = dispatch
+        self._queues = [queue.Queue() for _ in range(num_workers)]
+        self._threads = []
+        for i, q in enumerate(self._queues):
+            thread = threading.Thread(target=self._worker, args=(q,), name='j1939.ecu dispatcher {}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, priority, pgn, sa, dest, timestamp, data):
+        """Enqueues a notification for the worker responsible for (sa, pgn)"""
+        self._queues[hash((sa, pgn)) % len(self._queues)].put((priority, pgn, sa, dest, timestamp, data))
+
+    def join(self):
+        """Blocks until all enqueued notifications are executed"""
+        for q in self._queues:
+            q.join()
+
+    def stop(self):
+        """Executes the pending notifications and stops the worker threads"""
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            try:
+                if item is None:
+                    return
+                self._dispatch(*item)
+            except Exception as e:
+                # Exceptions in any callbaks should not stop the worker
+                logger.error(str(e))
+            finally:
+                q.task_done()
@@ -0,0 +1,127 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class SubscriberQueue:
+    """Bounded queue between the ECU and a single subscriber callback.
+
+    Incoming messages are put into the queue by the receiving thread and the
+    callback is executed by a dedicated thread of the queue. A consumer which
+    falls behind does therefore not block the bus handling; what happens when
+    the queue is full is defined by the overflow policy.
+    """
+
+    class OverflowPolicy:
+        DROP_OLDEST = 0     # the oldest queued message is discarded
+        DROP_NEWEST = 1     # the incoming message is discarded
+        COALESCE_LATEST = 2 # only the latest message per (source address, PGN) is queued
+        BLOCK = 3           # the receiving thread waits until there is space in the queue
+
+    def __init__(self, callback, maxsize, overflow_policy=OverflowPolicy.DROP_OLDEST):
+        """
+        :param callback:
+            Function to call with (priority, pgn, sa, timestamp, data) for each queued message.
+        :param int maxsize:
+            Maximum number of queued messages.
+        :param overflow_policy:
+            One of :class:`SubscriberQueue.OverflowPolicy`.
+        """
+        if maxsize < 1:
+            raise ValueError("the size of the queue must be at least 1")
+        if overflow_policy not in (self.OverflowPolicy.DROP_OLDEST, self.OverflowPolicy.DROP_NEWEST, self.OverflowPolicy.COALESCE_LATEST, self.OverflowPolicy.BLOCK):
+            raise ValueError("unknown overflow policy {}".format(overflow_policy))
+        self.callback = callback
+        self.maxsize = maxsize
+        self.overflow_policy = overflow_policy
+
+        #: Number of messages discarded because the queue was full
+        self.dropped = 0
+        #: Number of messages replaced by a newer message with the same (source address, PGN)
+        self.coalesced = 0
+        #: Maximum number of queued messages seen so far
+        self.high_watermark = 0
+
+        # queued messages, for COALESCE_LATEST the keys (sa, pgn) of self._pending
+        self._items = collections.deque()
+        # COALESCE_LATEST: (sa, pgn) -> latest message
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._worker, name='j1939.ecu subscriber queue')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, priority, pgn, sa, timestamp, data):
+        """Enqueues a message according the overflow policy"""
+        message = (priority, pgn, sa, timestamp, data)
+        with self._condition:
+            if self._stopped:
+                return
+            if self.overflow_policy == self.OverflowPolicy.COALESCE_LATEST:
+                key = (sa, pgn)
+                if key in self._pending:
+                    self._pending[key] = message
+                    self.coalesced += 1
+                    return
+                if len(self._items) >= self.maxsize:
+                    del self._pending[self._items.popleft()]
+                    self.dropped += 1
+                self._pending[key] = message
+                message = key
+            elif len(self._items) >= self.maxsize:
+                if self.overflow_policy == self.OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                elif self.overflow_policy == self.OverflowPolicy.DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped += 1
+                else:
+                    while (len(self._items) >= self.maxsize) and not self._stopped:
+                        self._condition.wait()
+                    if self._stopped:
+                        return
+            self._items.append(message)
+            if len(self._items) > self.high_watermark:
+                self.high_watermark = len(self._items)
+            self._condition.notify_all()
+
+    def reset_counters(self):
+        """Resets the drop, coalesce and high-watermark counters"""
+        with self._condition:
+            self.dropped = 0
+            self.coalesced = 0
+            self.high_watermark = len(self._items)
+
+    def stop(self):
+        """Discards the queued messages and stops the queue thread
+
+        A callback which is currently executed is finished.
+        """
+        with self._condition:
+            self._stopped = True
+            self._items.clear()
+            self._pending.clear()
+            self._condition.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._items and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                message = self._items.popleft()
+                if self.overflow_policy == self.OverflowPolicy.COALESCE_LATEST:
+                    message = self._pending.pop(message)
+                # wakeup a blocked producer
+                self._condition.notify_all()
+            try:
+                self.callback(*message)
+            except Exception as e:
+                # Exceptions in any callbaks should not stop the queue
+                logger.error(str(e))
@@ -0,0 +1,162 @@
+import array
+import collections
+import itertools
+import time
+
+import numpy as np
+
+class Tracer:
+    """Records the timestamps of the processing stages of frames and PDUs.
+
+    Each record holds a :func:`time.perf_counter_ns` timestamp, the event and a key.
+    The records are written into a ring buffer preallocated with the given capacity,
+    the oldest records are overwritten. Recording does not take a lock, it may be
+    called from the receiving thread, the job thread and the senders concurrently.
+    """
+
+    class Event:
+        FRAME_RECEIVED      = 0 # frame passed to the ECU by the MessageListener, key: CAN-ID
+        FRAME_CLASSIFIED    = 1 # CAN-ID decoded by the data link layer, key: CAN-ID
+        TP_SEGMENT_STORED   = 2 # transport protocol data stored in the reassembly buffer, key: CAN-ID
+        PDU_DELIVERED       = 3 # PDU handed over to the subscribers, key: see pdu_key()
+        SUBSCRIBER_RETURNED = 4 # the subscriber callbacks of a PDU returned, key: see pdu_key()
+        FRAME_QUEUED        = 5 # frame handed over by the data link layer for transmission, key: CAN-ID
+        FRAME_SENT          = 6 # frame written to the bus, key: CAN-ID
+
+    #: Stages evaluated by :meth:`stage_distributions`: name -> (start event, end event, match key)
+    #: The stages from a frame to a PDU pair the frames with the PDUs they carry as single frame,
+    #: the frames of transport protocol sessions are measured by 'classify->store'.
+    STAGES = {
+        'receive->classify': (Event.FRAME_RECEIVED, Event.FRAME_CLASSIFIED, True),
+        'classify->store': (Event.FRAME_CLASSIFIED, Event.TP_SEGMENT_STORED, True),
+        'classify->deliver': (Event.FRAME_CLASSIFIED, Event.PDU_DELIVERED, True),
+        'deliver->return': (Event.PDU_DELIVERED, Event.SUBSCRIBER_RETURNED, True),
+        'receive->return': (Event.FRAME_RECEIVED, Event.SUBSCRIBER_RETURNED, True),
+        'queue->send': (Event.FRAME_QUEUED, Event.FRAME_SENT, True),
+    }
+
+    def __init__(self, capacity=65536):
+        """
+        :param int capacity:
+            Number of records of the ring buffer.
+        """
+        if capacity < 1:
+            raise ValueError("the capacity must be at least 1")
+        self.capacity = capacity
+        self._times = array.array('q', bytes(8 * capacity))
+        self._keys = array.array('Q', bytes(8 * capacity))
+        self._events = bytearray(capacity)
+        # sequence number of each record, 0 for unused records
+        self._sequences = array.array('Q', bytes(8 * capacity))
+        # next() of itertools.count is atomic, concurrent records get different slots
+        self._sequence = itertools.count(1)
+        # records with a sequence number up to this one were discarded by clear()
+        self._cleared = 0
+
+    @staticmethod
+    def pdu_key(priority, pgn, sa, dest):
+        """Returns the key of a PDU, the CAN-ID of a single frame carrying the PDU
+
+        The PDU events thus share the key with the frame events of the frame carrying the PDU.
+
+        :param int priority:
+            The priority of the PDU.
+        :param int pgn:
+            The PGN of the PDU.
+        :param int sa:
+            The source address.
+        :param int dest:
+            The destination address, part of the key for PDU1 formats only.
+        """
+        if ((pgn >> 8) & 0xFF) < 240:
+            pgn |= dest
+        return (priority << 26) | (pgn << 8) | sa
+
+    def record(self, event, key):
+        """Records an event with the current time
+
+        :param int event:
+            One of :class:`Tracer.Event`.
+        :param int key:
+            Key of the frame or PDU, see :class:`Tracer.Event`.
+        """
+        sequence = next(self._sequence)
+        index = sequence % self.capacity
+        self._times[index] = time.perf_counter_ns()
+        self._events[index] = event
+        self._keys[index] = key
+        self._sequences[index] = sequence
+
+    def clear(self):
+        """Discards all records"""
+        self._cleared = next(self._sequence)
+
+    def records(self):
+        """Returns the recorded events in the order of recording
+
+        :return:
+            list of tuples (time in ns, event, key)
+        """
+        sequences = np.frombuffer(self._sequences, dtype=np.uint64).copy()
+        used = np.nonzero(sequences > self._cleared)[0]
+        order = used[np.argsort(sequences[used], kind='stable')]
+        times, events, keys = self._times, self._events, self._keys
+        return [(times[index], events[index], keys[index]) for index in order.tolist()]
+
+    def latencies(self, start_event, end_event, match_key=True):
+        """Returns the latencies between two events in ns
+
+        :param int start_event:
+            The event starting the measurement.
+        :param int end_event:
+            The event ending the measurement.
+        :param bool match_key:
+            If True, the start and end events with the same key are paired in order (first in, first out).
+            Otherwise each end event is paired with the latest start event before it, e.g. to
+            measure from the last frame of a transport protocol session to the delivery of the PDU.
+        :return:
+            numpy array of latencies in ns
+        """
+        latencies = []
+        pending = collections.defaultdict(collections.deque)
+        last_start = None
+        for timestamp, event, key in self.records():
+            if event == start_event:
+                if match_key:
+                    pending[key].append(timestamp)
+                else:
+                    last_start = timestamp
+            elif event == end_event:
+                if match_key:
+                    starts = pending.get(key)
+                    if starts:
+                        latencies.append(timestamp - starts.popleft())
+                elif last_start is not None:
+                    latencies.append(timestamp - last_start)
+        return np.array(latencies, dtype=np.int64)
+
+    @staticmethod
+    def distribution(latencies):
+        """Summarizes latencies
+
+        :param latencies:
+            Sequence of latencies in ns.
+        :return:
+            dict with 'count' and the 'min', 'mean', 'p50', 'p90', 'p99', 'p999' and 'max' latency in ns,
+            the latencies are None if the sequence is empty.
+        """
+        latencies = np.asarray(latencies)
+        if latencies.size == 0:
+            return dict(count=0, min=None, mean=None, p50=None, p90=None, p99=None, p999=None, max=None)
+        p50, p90, p99, p999 = np.percentile(latencies, [50, 90, 99, 99.9]).tolist()
+        return dict(count=int(latencies.size), min=int(latencies.min()), mean=float(latencies.mean()),
+                    p50=p50, p90=p90, p99=p99, p999=p999, max=int(latencies.max()))
+
+    def stage_distributions(self):
+        """Returns the latency distribution of each stage of :attr:`STAGES`
+
+        :return:
+            dict stage name -> distribution, see :meth:`distribution`
+        """
+        return {name: self.distribution(self.latencies(start, end, match_key))
+                for name, (start, end, match_key) in self.STAGES.items()}
@@ -0,0 +1,153 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class TransmitScheduler:
+    """Transmit queue ordered by the J1939 priority of the CAN-ID.
+
+    Messages are enqueued by :meth:`send` without blocking the calling thread.
+    A single writer thread drains the queue, messages with a higher priority
+    (lower priority value) leave first, messages of the same priority keep their order.
+    """
+
+    def __init__(self, send_message, batch_size=1, fbff_priority=0):
+        """
+        :param send_message:
+            Function writing a message to the bus, with the signature of
+            :meth:`j1939.ElectronicControlUnit.send_message`.
+        :param int batch_size:
+            Maximum number of messages taken from the queue per wakeup of the writer thread.
+        :param int fbff_priority:
+            Priority (0..7) in the queue of the messages with 11-bit identifiers (FBFF), which carry
+            no J1939 priority. The default 0 matches the bus arbitration, where an 11-bit identifier
+            wins against every 29-bit identifier with the same leading 11 bits.
+        """
+        if batch_size < 1:
+            raise ValueError("the batch size must be at least 1")
+        if not 0 <= fbff_priority <= 7:
+            raise ValueError("the priority of FBFF messages must be in the range 0..7")
+        self._send_message = send_message
+        self._batch_size = batch_size
+        self._fbff_priority = fbff_priority
+        # entries are (priority, sequence number, enqueue time, message)
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        # number of messages taken from the queue but not yet sent
+        self._in_flight = 0
+        self._stopped = False
+        self.reset_stats()
+        self._thread = threading.Thread(target=self._writer_thread, name='j1939.ecu transmit')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def send(self, can_id, extended_id, data, fd_format=False):
+        """Enqueues a message for transmission
+
+        The arguments are the same as for :meth:`j1939.ElectronicControlUnit.send_message`.
+        The data is copied, the caller may reuse its buffer when the method returns.
+        Errors of the transmission are logged and counted, they are not raised to the caller.
+        """
+        priority = (can_id >> 26) & 0x7 if extended_id else self._fbff_priority
+        message = (can_id, extended_id, bytes(data), fd_format)
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("transmit scheduler is stopped")
+            heapq.heappush(self._queue, (priority, next(self._sequence), time.perf_counter(), message))
+            if len(self._queue) > self._max_depth:
+                self._max_depth = len(self._queue)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all enqueued messages are sent
+
+        :param timeout:
+            Maximum time in seconds to wait or None to wait forever.
+        :return:
+            True if all messages are sent, False on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def stop(self):
+        """Sends the pending messages and stops the writer thread"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        """Returns the queue depth and latency statistics
+
+        The latency is the time between enqueuing a message and the return of the bus send,
+        it is recorded for successfully sent messages only.
+
+        :return:
+            dict with the keys 'depth', 'max_depth', 'sent', 'errors', 'batches',
+            'latency_min', 'latency_max' and 'latency_mean' (in seconds, None if nothing was sent).
+        """
+        with self._condition:
+            sent = self._sent
+            return {
+                'depth': len(self._queue),
+                'max_depth': self._max_depth,
+                'sent': sent,
+                'errors': self._errors,
+                'batches': self._batches,
+                'latency_min': self._latency_min if sent else None,
+                'latency_max': self._latency_max if sent else None,
+                'latency_mean': (self._latency_sum / sent) if sent else None,
+            }
+
+    def reset_stats(self):
+        """Resets the statistics"""
+        with self._condition:
+            self._max_depth = len(self._queue)
+            self._sent = 0
+            self._errors = 0
+            self._batches = 0
+            self._latency_min = float('inf')
+            self._latency_max = 0.0
+            self._latency_sum = 0.0
+
+    def _writer_thread(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if not self._queue:
+                    # stopped and all messages are sent
+                    return
+                batch = [heapq.heappop(self._queue) for _ in range(min(self._batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+
+            latencies = []
+            errors = 0
+            for _, _, enqueued, message in batch:
+                try:
+                    self._send_message(*message)
+                except Exception as e:
+                    errors += 1
+                    logger.error(str(e))
+                else:
+                    latencies.append(time.perf_counter() - enqueued)
+
+            with self._condition:
+                self._in_flight = 0
+                self._batches += 1
+                self._errors += errors
+                self._sent += len(latencies)
+                for latency in latencies:
+                    self._latency_sum += latency
+                    if latency < self._latency_min:
+                        self._latency_min = latency
+                    if latency > self._latency_max:
+                        self._latency_max = latency
+                self._condition.notify_all()
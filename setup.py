@@ -30,6 +30,9 @@ setup(
         "numpy >= 1.17.0",
         "pytest >= 6.2.5",
     ],
+    extras_require={
+        "yaml": ["PyYAML"],
+    },
     include_package_data=True,
 
     # Tests can be run using `python setup.py test`
@@ -0,0 +1,69 @@
+import asyncio
+
+import j1939
+
+
+def test_pdus():
+    """Test the reception of PDUs with the asynchronous iterator"""
+
+    async def run():
+        ecu = j1939.AsyncElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+        pdus = ecu.pdus(pgn=65202)
+
+        # start the iterator before feeding the messages
+        first = asyncio.ensure_future(pdus.__anext__())
+        await asyncio.sleep(0)
+        ecu.notify(0x18FEB001, [8, 7, 6, 5, 4, 3, 2, 1], 1.0)
+        ecu.notify(0x18FEB201, [1, 2, 3, 4, 5, 6, 7, 8], 2.0)
+        pdu = await asyncio.wait_for(first, 1.0)
+        await pdus.aclose()
+        ecu.stop()
+        return pdu
+
+    assert asyncio.run(run()) == (6, 65202, 0x01, 2.0, [1, 2, 3, 4, 5, 6, 7, 8])
+
+
+def test_send_pgn_bam():
+    """Test that sending a long broadcast message resolves when the BAM session is finished"""
+    sent = []
+
+    async def run():
+        ecu = j1939.AsyncElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: sent.append((can_id, list(data))), minimum_tp_bam_dt_interval=0.001)
+        ca = j1939.AsyncControllerApplication(None, 0x90, bypass_address_claim=True)
+        ecu.add_ca(controller_application=ca)
+        data = [1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6]
+        result = await asyncio.wait_for(ca.send_pgn(0, 0xFE, 0xB0, 6, data), 1.0)
+        ecu.stop()
+        return result
+
+    assert asyncio.run(run()) is True
+    assert sent == [
+        (0x18ECFF90, [32, 20, 0, 3, 255, 176, 254, 0]),     # TP.BAM
+        (0x1CEBFF90, [1, 1, 2, 3, 4, 5, 6, 7]),             # TP.DT 1
+        (0x1CEBFF90, [2, 1, 2, 3, 4, 5, 6, 7]),             # TP.DT 2
+        (0x1CEBFF90, [3, 1, 2, 3, 4, 5, 6, 255]),           # TP.DT 3
+    ]
+
+
+def test_request():
+    """Test a request waiting for the response of the destination"""
+
+    async def run():
+        loop = asyncio.get_running_loop()
+
+        def send_message(can_id, extended_id, data, fd_format=False):
+            # answer the request for PGN 65242 (Software Identification)
+            assert can_id == 0x18EA9B90
+            assert list(data) == [0xDA, 0xFE, 0x00]
+            loop.call_soon(ecu.notify, 0x18FEDA9B, [1, ord('V'), ord('1'), ord('*'), 255, 255, 255, 255], 3.0)
+
+        ecu = j1939.AsyncElectronicControlUnit(send_message=send_message)
+        ca = j1939.AsyncControllerApplication(None, 0x90, bypass_address_claim=True)
+        ecu.add_ca(controller_application=ca)
+        response = await ca.request(0, 65242, 0x9B, timeout=1.0)
+        ecu.stop()
+        return response
+
+    priority, pgn, sa, timestamp, data = asyncio.run(run())
+    assert (pgn, sa, timestamp) == (65242, 0x9B, 3.0)
+    assert data == [1, ord('V'), ord('1'), ord('*'), 255, 255, 255, 255]
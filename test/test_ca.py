@@ -181,3 +181,28 @@ def test_stop_method(feeder):
     assert new_ca.started
     new_ca.stop()
     assert not new_ca.started
+
+
+def test_update_acceptance():
+    """Test that a CA with state-dependent acceptance receives messages after update_acceptance()"""
+    class ListeningCA(j1939.ControllerApplication):
+        listening = False
+
+        def message_acceptable(self, dest_address):
+            return self.listening and (dest_address == 0x42)
+
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    ca = ListeningCA(None, 0x80, bypass_address_claim=True)
+    ecu.add_ca(controller_application=ca)
+    received = []
+    ca.subscribe(lambda priority, pgn, sa, timestamp, data: received.append(data[0]))
+
+    ecu.notify(0x18DC4201, bytes([1]) + bytes(7), 0.0)
+    ca.listening = True
+    # the cached acceptance is not updated yet
+    ecu.notify(0x18DC4201, bytes([2]) + bytes(7), 0.0)
+    ca.update_acceptance()
+    ecu.notify(0x18DC4201, bytes([3]) + bytes(7), 0.0)
+    ecu.stop()
+
+    assert received == [3]
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import j1939
+
+DBC = '''VERSION ""
+
+BU_: Engine Body
+
+BO_ 2364540158 EEC1: 8 Engine
+ SG_ EngineTorqueMode : 0|4@1+ (1,0) [0|15] "" Vector__XXX
+ SG_ DriversDemandTorque : 8|8@1+ (1,-125) [-125|125] "%" Vector__XXX
+ SG_ EngineSpeed : 24|16@1+ (0.125,0) [0|8031.875] "rpm" Vector__XXX
+ SG_ MotorolaSignal : 55|8@0+ (1,0) [0|255] "" Vector__XXX
+
+BO_ 2566844926 CCVS1: 8 Body
+ SG_ WheelBasedVehicleSpeed : 8|16@1+ (0.00390625,0) [0|250.996] "km/h" Vector__XXX
+ SG_ Deviation : 32|8@1- (1,0) [-128|127] "" Vector__XXX
+
+BO_ 256 StandardFrame: 8 Body
+ SG_ Ignored : 0|8@1+ (1,0) [0|255] "" Vector__XXX
+
+BA_ "SPN" SG_ 2364540158 EngineSpeed 190;
+BA_ "SPN" SG_ 2566844926 WheelBasedVehicleSpeed 84;
+VAL_ 2364540158 EngineTorqueMode 0 "Low idle governor" 1 "Accelerator pedal" 15 "Not available" ;
+'''
+
+
+def test_parse_dbc():
+    """
+    Test the import of messages, signals, value descriptions and SPN numbers
+    """
+    db = j1939.parse_dbc(DBC)
+    assert db.pgns() == [0xF004, 0xFEF1]
+    eec1 = db[0xF004]
+    assert eec1.name == 'EEC1'
+    assert [spn.name for spn in eec1.spns] == ['EngineTorqueMode', 'DriversDemandTorque', 'EngineSpeed']
+    assert eec1.spns[2].spn == 190
+    assert eec1.spns[0].choices == {0: 'Low idle governor', 1: 'Accelerator pedal', 15: 'Not available'}
+
+    payload = db.encode(0xF004, {'EngineTorqueMode': 1, 'DriversDemandTorque': 40, 'EngineSpeed': 1000})
+    assert list(payload) == [0xF1, 0xA5, 0xFF, 0x40, 0x1F, 0xFF, 0xFF, 0xFF]
+    assert db.decode(0xF004, payload) == {'EngineTorqueMode': 1, 'DriversDemandTorque': 40, 'EngineSpeed': 1000.0}
+
+    payloads = np.array([db.encode(0xFEF1, {'WheelBasedVehicleSpeed': 80.5, 'Deviation': deviation}) for deviation in (-5, 7)])
+    values = db.decode_matrix(0xFEF1, payloads)
+    assert values['WheelBasedVehicleSpeed'].tolist() == [80.5, 80.5]
+    assert values['Deviation'].tolist() == [-5, 7]
+
+
+def test_load_dbc_cache(tmp_path, monkeypatch):
+    """
+    Test that a DBC file is parsed only once and its cache is keyed by the content
+    """
+    filename = tmp_path / 'j1939.dbc'
+    filename.write_text(DBC)
+    cache_dir = str(tmp_path / 'cache')
+    parsed = []
+    parse_dbc = j1939.dbc.parse_dbc
+    monkeypatch.setattr(j1939.dbc, 'parse_dbc', lambda text: parsed.append(text) or parse_dbc(text))
+
+    assert j1939.SignalDatabase.load(str(filename), cache_dir=cache_dir).pgns() == [0xF004, 0xFEF1]
+    db = j1939.load_dbc(str(filename), cache_dir)
+    assert len(parsed) == 1
+    assert db.decode(0xF004, [0xF1, 0xA5, 0xFF, 0x40, 0x1F, 0xFF, 0xFF, 0xFF])['EngineSpeed'] == 1000.0
+
+    filename.write_text(DBC.replace('EEC1', 'EEC1_CHANGED'))
+    assert j1939.load_dbc(str(filename), cache_dir)[0xF004].name == 'EEC1_CHANGED'
+    assert len(parsed) == 2
+
+
+def test_parse_dbc_64_bit():
+    """
+    Test signals covering all 8 bytes, including a signed one whose ranges exceed 64 bits
+    """
+    db = j1939.parse_dbc('BO_ 2364540158 X: 8 E\n SG_ Big : 0|64@1- (1,0) [0|0] "" V\n'
+                         'BO_ 2566844926 Y: 8 E\n SG_ Counter : 0|64@1+ (1,0) [0|0] "" V\n')
+    assert db.pgns() == [0xF004, 0xFEF1]
+    payloads = np.array([[0xFF] * 8, [0xFE] + [0xFF] * 7, [0x05] + [0] * 7], dtype=np.uint8)
+    assert db.decode(0xF004, payloads[0]) == {'Big': -1}
+    assert db.decode_matrix(0xF004, payloads)['Big'].tolist() == [-1, -2, 5]
+    assert db.decode(0xFEF1, payloads[2]) == {'Counter': 5}
+    values, statuses = db.decode_matrix(0xFEF1, payloads, status=True)
+    assert statuses['Counter'].tolist() == [j1939.SpnDefinition.Status.NOT_AVAILABLE] * 2 + [j1939.SpnDefinition.Status.VALID]
+    assert db.encode(0xF004, {'Big': -2}) == bytearray([0xFE] + [0xFF] * 7)
+    with pytest.raises(ValueError):
+        j1939.SpnDefinition('Invalid', 0, 8, error_min=0x100 + 1)
@@ -0,0 +1,77 @@
+from j1939.deadline_index import DeadlineIndex
+
+
+def test_replace_deadline():
+    """
+    Test that replacing the deadline of a key invalidates the old entry
+    """
+    index = DeadlineIndex()
+    assert index.set('a', 1.0)
+    # the invalidated entry is dropped from the head, the new deadline is the earliest one
+    assert index.set('a', 2.0)
+    assert not index.set('c', 3.0)
+    index.discard('c')
+    assert len(index) == 1
+    assert index.pop_expired(1.5) == []
+    assert 'a' in index
+    assert index.pop_expired(2.0) == ['a']
+    assert 'a' not in index
+
+    # an earlier deadline replaces a later one
+    index.set('b', 5.0)
+    assert index.set('b', 3.0)
+    assert index.pop_expired(3.0) == ['b']
+    assert index.pop_expired(5.0) == []
+
+def test_discard():
+    """
+    Test that a discarded key does not expire
+    """
+    index = DeadlineIndex()
+    index.set('a', 1.0)
+    index.set('b', 2.0)
+    index.discard('a')
+    index.discard('unknown')
+    assert len(index) == 1
+    assert index.pop_expired(10.0) == ['b']
+    assert len(index) == 0
+
+def test_pop_expired_order():
+    """
+    Test that the expired keys are ordered by deadline and keys with equal deadlines in the order they were set
+    """
+    index = DeadlineIndex()
+    index.set('c', 2.0)
+    index.set('a', 1.0)
+    index.set('b', 1.0)
+    index.set('d', 3.0)
+    assert index.pop_expired(2.0) == ['a', 'b', 'c']
+    assert index.pop_expired(3.0) == ['d']
+
+def test_next_deadline():
+    """
+    Test that the next deadline skips the invalidated entries at the head of the queue
+    """
+    index = DeadlineIndex()
+    assert index.next_deadline() is None
+    index.set('a', 1.0)
+    index.set('b', 2.0)
+    index.discard('a')
+    assert index.next_deadline() == 2.0
+    index.set('b', 3.0)
+    assert index.next_deadline() == 3.0
+    index.discard('b')
+    assert index.next_deadline() is None
+
+def test_set_after_expiry():
+    """
+    Test that a key can be set again after its deadline expired
+    """
+    index = DeadlineIndex()
+    index.set('a', 1.0)
+    assert index.pop_expired(1.0) == ['a']
+    assert index.set('a', 4.0)
+    assert 'a' in index
+    assert index.next_deadline() == 4.0
+    assert index.pop_expired(3.0) == []
+    assert index.pop_expired(4.0) == ['a']
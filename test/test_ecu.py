@@ -1,6 +1,10 @@
+import gc
+import threading
 import time
+import weakref
 
 import can
+import pytest
 import j1939
 from test_helpers.feeder import Feeder
 from test_helpers.conftest import feeder
@@ -187,3 +191,716 @@ def test_add_notfier(feeder):
     assert feeder.ecu._notifier == notifier
     feeder.ecu.remove_notifier()
     assert feeder.ecu._notifier == None
+
+def test_subscribe_pgns(feeder):
+    """
+    Test that subscribers registered for dedicated PGNs only receive these PGNs
+    """
+    feeder.accept_all_messages()
+
+    feeder.can_messages = [
+        (Feeder.MsgType.CANRX, 0x00FEB201, [1, 2, 3, 4, 5, 6, 7, 8], 0.0),
+        (Feeder.MsgType.CANRX, 0x00FEB001, [8, 7, 6, 5, 4, 3, 2, 1], 0.0),
+    ]
+
+    feeder.pdus = [
+        (Feeder.MsgType.PDU, 65202, [1, 2, 3, 4, 5, 6, 7, 8]),
+        (Feeder.MsgType.PDU, 65200, [8, 7, 6, 5, 4, 3, 2, 1]),
+    ]
+
+    received = []
+    def on_pgn(priority, pgn, sa, timestamp, data):
+        received.append((pgn, list(data)))
+
+    feeder.ecu.subscribe(on_pgn, pgns=[65200])
+    feeder.receive()
+    feeder.ecu.unsubscribe(on_pgn)
+
+    assert received == [(65200, [8, 7, 6, 5, 4, 3, 2, 1])]
+
+def test_unsubscribe_during_dispatch():
+    """
+    Test that unsubscribing from another thread while a PDU is dispatched does not skip the other subscribers
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    received = []
+    def first(priority, pgn, sa, timestamp, data):
+        received.append('first')
+        # removed by another thread while the dispatch is iterating over the subscribers
+        thread = threading.Thread(target=ecu.unsubscribe, args=(first,))
+        thread.start()
+        thread.join()
+    def second(priority, pgn, sa, timestamp, data):
+        received.append('second')
+    def wildcard(priority, pgn, sa, timestamp, data):
+        received.append('wildcard')
+
+    ecu.subscribe(first, pgns=[65200])
+    ecu.subscribe(second, pgns=[65200])
+    ecu.subscribe(wildcard)
+    ecu.notify(0x18FEB001, bytes(8), 0.0)
+    ecu.notify(0x18FEB001, bytes(8), 0.0)
+    ecu.stop()
+
+    assert received == ['first', 'second', 'wildcard', 'second', 'wildcard']
+
+def test_peer_to_peer_acceptance(feeder):
+    """
+    Test that peer-to-peer messages are only accepted for subscribed device addresses
+    """
+    received = []
+    def on_message(priority, pgn, sa, timestamp, data):
+        received.append((pgn, sa))
+
+    feeder.ecu.subscribe(on_message, device_address=0x02)
+    assert feeder.ecu.j1939_dll._acceptance_table[0x02] == 1
+    assert feeder.ecu.j1939_dll._acceptance_table[0x03] == 0
+
+    feeder.ecu.notify(0x00DC0301, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)    # foreign destination address
+    feeder.ecu.notify(0x00DC0201, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)
+    feeder.ecu.notify(0x00FEB201, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)    # broadcast
+    feeder.ecu.unsubscribe(on_message)
+
+    assert received == [(56320, 0x01), (65202, 0x01)]
+    assert feeder.ecu.j1939_dll._acceptance_table[0x02] == 0
+
+def test_timer():
+    """
+    Test cyclic, single-shot and cancelled timer events
+    """
+    clock = j1939.VirtualClock(1.0)
+    ecu = j1939.ElectronicControlUnit(clock=clock)
+    calls = {'cyclic': 0, 'single': 0, 'cancelled': 0}
+    def on_timer(cookie):
+        calls[cookie] += 1
+        return cookie == 'cyclic'
+
+    ecu.add_timer(0.25, on_timer, 'cyclic')
+    ecu.add_timer(0.5, on_timer, 'single')
+    timer = ecu.add_timer(0.75, on_timer, 'cancelled')
+    timer.cancel()
+    for i in range(1, 21):
+        clock.advance(1.0 + i * 0.25)
+        ecu.process_jobs()
+    ecu.remove_timer(on_timer)
+    clock.advance(10.0)
+    ecu.process_jobs()
+    ecu.stop()
+
+    assert calls == {'cyclic': 20, 'single': 1, 'cancelled': 0}
+
+def test_timer_zero_delta():
+    """
+    Test that a repeating timer without delay is repeated after the minimum interval
+    """
+    clock = j1939.VirtualClock(1.0)
+    ecu = j1939.ElectronicControlUnit(clock=clock)
+    calls = []
+    ecu.add_timer(0, lambda cookie: calls.append(clock()) or True)
+    next_wakeup = 1.0 + j1939.electronic_control_unit.Timer.MINIMUM_INTERVAL
+    assert ecu.process_jobs() == next_wakeup
+    # the job thread sleeps until the next wakeup instead of spinning
+    assert ecu.process_jobs() == next_wakeup
+    clock.advance(2.0)
+    ecu.process_jobs()
+    assert calls == [1.0, 2.0]
+    ecu.stop()
+
+def test_timer_purge():
+    """
+    Test that cancelled timers do not stay in the priority queue until their deadline
+    """
+    clock = j1939.VirtualClock(1.0)
+    ecu = j1939.ElectronicControlUnit(clock=clock)
+    callback = lambda cookie: True
+    ecu.add_timer(10.0, callback)
+    ecu.remove_timer(callback)
+    assert ecu._timer_events == []
+
+    for _ in range(1000):
+        ecu.add_timer(10.0, lambda cookie: True).cancel()
+    assert len(ecu._timer_events) < 64
+    ecu.stop()
+
+def test_notify_batch(feeder):
+    """
+    Test that a block of messages is delivered in order, including transport protocol sessions
+    """
+    feeder.accept_all_messages()
+
+    can_ids = [0x00FEB201, 0x00ECFF01, 0x00EBFF01, 0x00DC0301, 0x00EBFF01, 0x00EBFF01, 0x00FEB201]
+    datas = [
+        [1, 2, 3, 4, 5, 6, 7, 8],
+        [32, 20, 0, 3, 255, 0xB0, 0xFE, 0],     # TP.CM BAM (to global Address)
+        [1, 1, 2, 3, 4, 5, 6, 7],               # TP.DT 1
+        [8, 7, 6, 5, 4, 3, 2, 1],               # peer-to-peer
+        [2, 1, 2, 3, 4, 5, 6, 7],               # TP.DT 2
+        [3, 1, 2, 3, 4, 5, 6, 255],             # TP.DT 3
+        [8, 7, 6, 5, 4, 3, 2, 1],
+    ]
+
+    feeder.pdus = [
+        (Feeder.MsgType.PDU, 65202, [1, 2, 3, 4, 5, 6, 7, 8]),
+        (Feeder.MsgType.PDU, 56320, [8, 7, 6, 5, 4, 3, 2, 1]),
+        (Feeder.MsgType.PDU, 65200, [1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6]),
+        (Feeder.MsgType.PDU, 65202, [8, 7, 6, 5, 4, 3, 2, 1]),
+    ]
+
+    feeder.ecu.subscribe(feeder._on_message)
+    feeder.ecu.notify_batch(can_ids, datas, [0.0] * len(can_ids))
+    feeder.ecu.unsubscribe(feeder._on_message)
+
+    assert feeder.pdus == []
+    rx = feeder.ecu.stats()['rx']
+    assert (rx['frames'], rx['bytes']) == (7, 56)
+    assert rx['frames_by_pgn'] == {0xFEB2: 2, 0xEC00: 1, 0xEB00: 3, 0xDC00: 1}
+    assert rx['bytes_by_pgn'] == {0xFEB2: 16, 0xEC00: 8, 0xEB00: 24, 0xDC00: 8}
+    assert (rx['frames_by_sa'], rx['bytes_by_sa']) == ({0x01: 7}, {0x01: 56})
+
+def test_send_frame():
+    """
+    Test that the frames of the controller applications are sent and counted by the ECU
+    """
+    sent = []
+    ecu = j1939.ElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: sent.append((can_id, bytes(data))))
+    ca = j1939.ControllerApplication(None, 0x80, bypass_address_claim=True)
+    ecu.add_ca(controller_application=ca)
+    ca.start()
+    ca.send_message(6, 0xFEF1, bytes(8))
+    ecu.stop()
+    assert sent == [(0x18FEF180, bytes(8))]
+    tx = ecu.stats()['tx']
+    assert (tx['frames'], tx['bytes'], tx['frames_by_pgn']) == (1, 8, {0xFEF1: 1})
+
+def test_subscriber_workers():
+    """
+    Test that slow subscribers do not block the receiving thread and the order per (SA, PGN) is preserved
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None, subscriber_workers=2)
+    # a second source address executed by the other worker, see SubscriberDispatcher.submit
+    sa = next(sa for sa in range(0x02, 0xFE) if hash((sa, 0xFEB0)) % 2 != hash((0x01, 0xFEB0)) % 2)
+    received = []
+    # both workers have to execute their first callback at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    release = threading.Event()
+    def on_message(priority, pgn, sa, timestamp, data):
+        if data[0] == 0:
+            barrier.wait()
+        release.wait(5)
+        received.append((sa, pgn, data[0]))
+
+    ecu.subscribe(on_message)
+    for i in range(5):
+        ecu.notify(0x18FEB001, bytearray([i, 0, 0, 0, 0, 0, 0, 0]), 0.0)
+        ecu.notify(0x18FEB000 | sa, bytearray([i, 0, 0, 0, 0, 0, 0, 0]), 0.0)
+    # all messages are received while the callbacks are blocked
+    assert received == []
+    release.set()
+    ecu._dispatcher.join()
+    ecu.unsubscribe(on_message)
+    ecu.stop()
+
+    assert not barrier.broken
+    assert [data for source, pgn, data in received if source == 0x01] == [0, 1, 2, 3, 4]
+    assert [data for source, pgn, data in received if source == sa] == [0, 1, 2, 3, 4]
+
+def test_subscriber_queue(feeder):
+    """
+    Test the overflow policies and counters of bounded subscriber queues
+    """
+    release = threading.Event()
+    received = {'oldest': [], 'newest': [], 'coalesce': []}
+    def make_callback(key):
+        def on_message(priority, pgn, sa, timestamp, data):
+            release.wait()
+            received[key].append((sa, data[0]))
+        return on_message
+
+    callbacks = {key: make_callback(key) for key in received}
+    queues = {
+        'oldest': feeder.ecu.subscribe(callbacks['oldest'], queue_size=2, overflow_policy=j1939.SubscriberQueue.OverflowPolicy.DROP_OLDEST),
+        'newest': feeder.ecu.subscribe(callbacks['newest'], queue_size=2, overflow_policy=j1939.SubscriberQueue.OverflowPolicy.DROP_NEWEST),
+        'coalesce': feeder.ecu.subscribe(callbacks['coalesce'], queue_size=2, overflow_policy=j1939.SubscriberQueue.OverflowPolicy.COALESCE_LATEST),
+    }
+
+    # the first message is taken by the queue threads, the callbacks are blocked
+    feeder.ecu.notify(0x18FEB001, [0, 0, 0, 0, 0, 0, 0, 0], 0.0)
+    time.sleep(0.05)
+    for i in range(1, 5):
+        feeder.ecu.notify(0x18FEB001, [i, 0, 0, 0, 0, 0, 0, 0], 0.0)
+    feeder.ecu.notify(0x18FEB002, [9, 0, 0, 0, 0, 0, 0, 0], 0.0)
+    release.set()
+    time.sleep(0.1)
+
+    for key, callback in callbacks.items():
+        feeder.ecu.unsubscribe(callback)
+
+    assert received['oldest'] == [(1, 0), (1, 4), (2, 9)]
+    assert (queues['oldest'].dropped, queues['oldest'].high_watermark) == (3, 2)
+    assert received['newest'] == [(1, 0), (1, 1), (1, 2)]
+    assert (queues['newest'].dropped, queues['newest'].high_watermark) == (3, 2)
+    assert received['coalesce'] == [(1, 0), (1, 4), (2, 9)]
+    assert (queues['coalesce'].dropped, queues['coalesce'].coalesced) == (0, 3)
+
+def test_subscriber_queue_block(feeder):
+    """
+    Test that the blocking policy delivers all messages
+    """
+    received = []
+    def on_message(priority, pgn, sa, timestamp, data):
+        time.sleep(0.005)
+        received.append(data[0])
+
+    subscriber_queue = feeder.ecu.subscribe(on_message, pgns=65200, queue_size=1, overflow_policy=j1939.SubscriberQueue.OverflowPolicy.BLOCK)
+    for i in range(10):
+        feeder.ecu.notify(0x18FEB001, [i, 0, 0, 0, 0, 0, 0, 0], 0.0)
+    time.sleep(0.05)
+    feeder.ecu.unsubscribe(on_message)
+
+    assert received == list(range(10))
+    assert subscriber_queue.dropped == 0
+    assert subscriber_queue.high_watermark == 1
+
+def test_transmit_queue():
+    """
+    Test that the transmit queue sends messages ordered by priority
+    """
+    sent = []
+    release = threading.Event()
+    def send_message(can_id, extended_id, data, fd_format=False):
+        release.wait()
+        sent.append(can_id)
+
+    ecu = j1939.ElectronicControlUnit(send_message=send_message, transmit_queue=True)
+    # the first message blocks the writer thread
+    ecu.send_pgn(0, 0xFE, 0xB0, 6, 0x01, [0] * 8)
+    time.sleep(0.05)
+    ecu.send_pgn(0, 0xFE, 0xB1, 7, 0x01, [0] * 8)
+    ecu.send_pgn(0, 0xFE, 0xB2, 6, 0x01, [0] * 8)
+    ecu.send_pgn(0, 0xFE, 0xB3, 3, 0x01, [0] * 8)
+    assert ecu.transmit_scheduler.stats()['depth'] == 3
+    release.set()
+    assert ecu.transmit_scheduler.flush(1.0)
+    stats = ecu.transmit_scheduler.stats()
+    ecu.stop()
+
+    assert sent == [0x18FEB001, 0x0CFEB301, 0x18FEB201, 0x1CFEB101]
+    assert stats['sent'] == 4
+    assert stats['max_depth'] == 3
+    assert stats['latency_max'] >= stats['latency_mean'] >= stats['latency_min'] > 0
+
+def test_transmit_queue_fbff():
+    """
+    Test the queue priority of 11-bit messages and that the queued data is a copy
+    """
+    for fbff_priority, expected in ((0, [0x000, 0x7FF, 0x0CFEB301, 0x1CFEB101]),
+                                    (4, [0x000, 0x0CFEB301, 0x7FF, 0x1CFEB101])):
+        sent = []
+        release = threading.Event()
+        def send_message(can_id, extended_id, data, fd_format=False):
+            release.wait()
+            sent.append((can_id, data))
+
+        scheduler = j1939.TransmitScheduler(send_message, fbff_priority=fbff_priority)
+        data = bytearray(8)
+        # the first message blocks the writer thread
+        scheduler.send(0x000, False, data)
+        time.sleep(0.05)
+        scheduler.send(0x1CFEB101, True, data)
+        scheduler.send(0x7FF, False, data)
+        scheduler.send(0x0CFEB301, True, data)
+        # the caller reuses its buffer
+        data[0] = 0xFF
+        release.set()
+        scheduler.stop()
+
+        assert [can_id for can_id, _ in sent] == expected
+        assert all(data == bytes(8) for _, data in sent)
+
+    with pytest.raises(ValueError):
+        j1939.TransmitScheduler(lambda *args: None, fbff_priority=8)
+
+def test_gateway_21_22():
+    """
+    Test forwarding of a long broadcast message from a J1939-21 to a J1939-22 segment and back
+    """
+    sent = {0: [], 1: []}
+    ecu = j1939.ElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: sent[0].append((can_id, list(data))), minimum_tp_bam_dt_interval=0.001)
+    segment = ecu.add_segment('j1939-22', send_message=lambda can_id, extended_id, data, fd_format=False: sent[1].append((can_id, list(data))))
+    assert segment.index == 1
+    ecu.add_route(0, 1, pgns=[65200])
+
+    payload = [1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6, 7, 1, 2, 3, 4, 5, 6]
+    ecu.notify(0x18FEB201, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)                 # not routed
+    ecu.notify(0x18ECFF01, [32, 20, 0, 3, 255, 0xB0, 0xFE, 0], 0.0)       # TP.CM BAM
+    ecu.notify(0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7], 0.0)                 # TP.DT 1
+    ecu.notify(0x1CEBFF01, [2, 1, 2, 3, 4, 5, 6, 7], 0.0)                 # TP.DT 2
+    ecu.notify(0x1CEBFF01, [3, 1, 2, 3, 4, 5, 6, 255], 0.0)               # TP.DT 3
+
+    # the reassembled PDU fits into one FD multi-pg frame
+    assert len(sent[1]) == 1
+    can_id, data = sent[1][0]
+    assert can_id & 0xFF == 0x01
+    assert payload == data[4:24]
+
+    # and back to the J1939-21 segment, segmented with BAM
+    ecu.remove_routes()
+    ecu.add_route(1, 0)
+    segment.notify(can_id, data, 0.0)
+    time.sleep(0.1)
+    ecu.stop()
+
+    assert [can_id & 0x00FFFFFF for can_id, data in sent[0]] == [0xECFF01, 0xEBFF01, 0xEBFF01, 0xEBFF01]
+    assert sent[0][0][1] == [32, 20, 0, 3, 255, 0xB0, 0xFE, 0]
+    assert [data for can_id, data in sent[0][1:]] == [[1, 1, 2, 3, 4, 5, 6, 7], [2, 1, 2, 3, 4, 5, 6, 7], [3, 1, 2, 3, 4, 5, 6, 255]]
+
+def test_segment_stop():
+    """
+    Test that stopping the ECU stops the reception of its segments
+    """
+    ecu = j1939.ElectronicControlUnit()
+    received = []
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: received.append(sa))
+
+    connected = ecu.add_segment()
+    connected.connect(interface="virtual", channel="segment_stop_1", receive_own_messages=True)
+    bus = can.interface.Bus(interface="virtual", channel="segment_stop_2", receive_own_messages=True)
+    notifier = can.Notifier(bus, [], 1)
+    added = ecu.add_segment()
+    added.add_bus(bus)
+    added.add_notifier(notifier)
+
+    connected.send_message(0x18FEF101, True, bytes(8))
+    added.send_frame(0x18FEF102, True, bytes(8))
+    time.sleep(0.1)
+    assert sorted(received) == [0x01, 0x02]
+    # the frames are counted by the segment sending them
+    assert (added.stats()['tx']['frames'], connected.stats()['tx']['frames'], ecu.stats()['tx']['frames']) == (1, 0, 0)
+
+    ecu.stop()
+    # the notifier created by connect() is stopped, the listeners are removed from the added one
+    assert not any(thread.is_alive() for thread in connected._notifier._readers)
+    assert notifier.listeners == []
+    added.send_message(0x18FEF103, True, bytes(8))
+    time.sleep(0.1)
+    assert sorted(received) == [0x01, 0x02]
+
+    notifier.stop()
+    bus.shutdown()
+    connected._bus.shutdown()
+
+def test_can_filters():
+    """
+    Test the derivation of the receive filters from the subscriptions and the claimed addresses
+    """
+    bus = can.Bus(interface='virtual', channel='test_can_filters')
+    ecu = j1939.ElectronicControlUnit(apply_can_filters=True)
+    ecu.add_bus(bus)
+
+    def accepts(can_id):
+        return bus._matches_filters(can.Message(arbitration_id=can_id, is_extended_id=True))
+
+    # no subscriber: only the transport protocol and network management messages to GLOBAL
+    assert bus.filters is not None
+    assert accepts(0x18EEFF01)          # address claim
+    assert accepts(0x1CEBFF01)          # TP.DT
+    assert not accepts(0x1CEB9001)      # TP.DT to an unknown address
+    assert not accepts(0x18FEF101)
+
+    def on_message(priority, pgn, sa, timestamp, data):
+        pass
+
+    ecu.subscribe(on_message, pgns=[0xFEF1, 0xEF00])
+    assert accepts(0x18FEF101)
+    assert not accepts(0x18FEF201)
+    assert accepts(0x18EFFF01)
+    assert not accepts(0x18EF9001)
+
+    ecu.subscribe(on_message, device_address=0x90)
+    assert accepts(0x18EF9001)
+    assert accepts(0x1CEB9001)
+    assert accepts(0x18FEF201)          # all broadcast messages
+    assert not accepts(0x18EF9101)
+
+    ecu.unsubscribe(on_message)
+    assert not accepts(0x18EF9001)
+    assert not accepts(0x18FEF101)
+
+    # subscriber for all messages
+    ecu.subscribe(on_message)
+    assert bus.filters is None
+
+    ecu.stop()
+    bus.shutdown()
+
+def test_bytes_payload():
+    """
+    Test the transmission of bytes payloads and the bytes-like payloads delivered to the subscribers
+    """
+    for data_link_layer, payloads in (('j1939-21', (bytes(range(5)), bytes(range(100)))),
+                                      ('j1939-22', (bytes(range(5)), bytes(range(100)), bytes(range(200))))):
+        receiver = j1939.ElectronicControlUnit(data_link_layer)
+        sender = j1939.ElectronicControlUnit(data_link_layer, minimum_tp_bam_dt_interval=0.001,
+                                             send_message=lambda can_id, extended_id, data, fd_format=False: receiver.notify(can_id, data, 0.0))
+        received = []
+        receiver.subscribe(lambda priority, pgn, sa, timestamp, data: received.append(data), pgns=[0xFEF1])
+
+        for payload in payloads:
+            sender.send_pgn(0, 0xFE, 0xF1, 6, 0x01, payload)
+            time.sleep(0.2)
+        sender.stop()
+        receiver.stop()
+
+        assert [bytes(data) for data in received] == list(payloads)
+        for data in received:
+            assert isinstance(data, (bytes, bytearray, memoryview))
+
+def test_multi_pg_send_during_transmission():
+    """
+    Test that a c-PG queued while its multi-pg buffer is being sent is not dropped
+    """
+    sent = []
+    completed = []
+    def send_message(can_id, extended_id, data, fd_format=False):
+        sent.append(bytes(data))
+        if len(sent) == 1:
+            # queued for the same source and destination as the buffer being sent
+            ecu.send_pgn(0, 0xFE, 0xF2, 6, 0x80, bytes(8), time_limit=0.01, on_complete=completed.append)
+
+    ecu = j1939.ElectronicControlUnit('j1939-22', send_message=send_message)
+    ecu.send_pgn(0, 0xFE, 0xF1, 6, 0x80, bytes(8), time_limit=0.01, on_complete=completed.append)
+    time.sleep(0.2)
+    ecu.stop()
+
+    assert len(sent) == 2
+    assert completed == [True, True]
+
+def test_can_id_cache():
+    """
+    Test the CAN-IDs of the transport protocol frames and the invalidation of the cache on address changes
+    """
+    sent = []
+    ecu = j1939.ElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: sent.append(can_id), minimum_tp_bam_dt_interval=0.001)
+    ca = ecu.add_ca(name=j1939.Name(), device_address=0x80)
+    ecu.send_pgn(0, 0xFE, 0xF1, 6, 0x80, bytes(20))
+    time.sleep(0.1)
+    assert sent == [0x18ECFF80, 0x1CEBFF80, 0x1CEBFF80, 0x1CEBFF80]
+    assert len(ecu.j1939_dll._can_id_cache) == 2
+
+    ca._address_changed()
+    assert len(ecu.j1939_dll._can_id_cache) == 0
+    ecu.stop()
+
+def test_stats():
+    """
+    Test the runtime counters of the ECU: frames, transport protocol sessions, callbacks and deltas
+    """
+    sent = []
+    ecu = j1939.ElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: sent.append(can_id), minimum_tp_bam_dt_interval=0.001)
+
+    def on_message(priority, pgn, sa, timestamp, data):
+        pass
+
+    ecu.subscribe(on_message)
+    ecu.notify(0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)
+    ecu.notify(0x18ECFF01, [32, 20, 0, 3, 255, 0xB0, 0xFE, 0], 0.0)       # TP.CM BAM
+    ecu.notify(0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7], 0.0)                 # TP.DT 1
+    ecu.notify(0x1CEBFF01, [2, 1, 2, 3, 4, 5, 6, 7], 0.0)                 # TP.DT 2
+    ecu.notify(0x1CEBFF01, [3, 1, 2, 3, 4, 5, 6, 255], 0.0)               # TP.DT 3
+
+    stats = ecu.stats(delta=True)
+    assert stats['rx']['frames'] == 5
+    assert stats['rx']['bytes'] == 40
+    assert stats['rx']['frames_by_pgn'] == {0xFEF1: 1, 0xEC00: 1, 0xEB00: 3}
+    assert stats['rx']['frames_by_sa'] == {0x01: 5}
+    assert stats['tp']['opened'] == 1
+    assert stats['tp']['completed'] == 1
+    [(subscription_id, callback_stats)] = stats['callbacks'].items()
+    assert callback_stats['name'] == on_message.__qualname__
+    assert callback_stats['calls'] == 2
+    assert sum(callback_stats['histogram']) == 2
+
+    ecu.send_pgn(0, 0xFE, 0xF1, 6, 0x80, bytes(20))
+    time.sleep(0.1)
+    ecu.stop()
+
+    stats = ecu.stats(delta=True)
+    assert stats['rx']['frames'] == 0
+    assert stats['tx']['frames'] == len(sent) == 4
+    assert stats['tx']['frames_by_pgn'] == {0xEC00: 1, 0xEB00: 3}
+    assert stats['tp']['opened'] == 1
+    assert stats['tp']['completed'] == 1
+    assert stats['callbacks'][subscription_id]['calls'] == 0
+    assert stats['job_wakeups'] > 0
+
+    stats = ecu.stats()
+    assert stats['rx']['frames'] == 5
+    assert stats['tp']['completed'] == 2
+
+    # the counters keep no reference to an unsubscribed callback
+    class Receiver:
+        def on_message(self, priority, pgn, sa, timestamp, data):
+            pass
+    receiver = Receiver()
+    ecu.subscribe(receiver.on_message)
+    ecu.notify(0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)
+    ecu.unsubscribe(receiver.on_message)
+    reference = weakref.ref(receiver)
+    del receiver
+    gc.collect()
+    assert reference() is None
+    callback_stats = [value for value in ecu.stats()['callbacks'].values() if value['name'] == Receiver.on_message.__qualname__]
+    assert [value['calls'] for value in callback_stats] == [1]
+
+    # every subscription is counted separately, also lambdas and the methods of different instances
+    ecu = j1939.ElectronicControlUnit(send_message=lambda can_id, extended_id, data, fd_format=False: None)
+    first, second = Receiver(), Receiver()
+    ecu.subscribe(first.on_message)
+    ecu.subscribe(second.on_message, pgns=0xFEF1)
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: None)
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: None, pgns=0xFEF1)
+    ecu.notify(0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)
+    ecu.notify(0x18FEF201, [1, 2, 3, 4, 5, 6, 7, 8], 0.0)
+    ecu.stop()
+    callback_stats = sorted((value['name'], value['calls']) for value in ecu.stats()['callbacks'].values())
+    assert callback_stats == sorted([(Receiver.on_message.__qualname__, 2), (Receiver.on_message.__qualname__, 1),
+                                     ('test_stats.<locals>.<lambda>', 2), ('test_stats.<locals>.<lambda>', 1)])
+
+    # multi-pg packing of j1939-22
+    ecu = j1939.ElectronicControlUnit('j1939-22', send_message=lambda can_id, extended_id, data, fd_format=False: None)
+    ecu.send_pgn(0, 0xFE, 0xF1, 6, 0x80, bytes(8), time_limit=0.01)
+    ecu.send_pgn(0, 0xFE, 0xF2, 6, 0x80, bytes(8), time_limit=0.01)
+    time.sleep(0.1)
+    ecu.stop()
+    multi_pg = ecu.stats()['multi_pg']
+    assert (multi_pg['frames'], multi_pg['c_pgs'], multi_pg['payload_bytes'], multi_pg['frame_bytes']) == (1, 2, 16, 24)
+    assert multi_pg['efficiency'] == 16 / 24
+
+def test_tracer():
+    """
+    Test the tracing hooks: frame received, classified, TP segment stored, PDU delivered,
+    subscriber returned, frame queued and frame sent
+    """
+    tracer = j1939.Tracer(capacity=64)
+    ecu = j1939.ElectronicControlUnit(minimum_tp_bam_dt_interval=0.001, tracer=tracer)
+    bus = can.interface.Bus(interface="virtual", channel="tracer")
+    ecu.add_bus(bus)
+    received = []
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: received.append(pgn))
+
+    listener = ecu._listeners[0]
+    for can_id, data in ((0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8]),
+                         (0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),      # TP.CM BAM
+                         (0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),               # TP.DT 1
+                         (0x1CEBFF01, [2, 1, 2, 255, 255, 255, 255, 255])):    # TP.DT 2
+        listener.on_message_received(can.Message(arbitration_id=can_id, data=data, is_extended_id=True))
+    assert received == [0xFEF1, 0xFEB0]
+
+    ecu.send_pgn(0, 0xFE, 0xF2, 6, 0x80, [1, 2, 3, 4, 5, 6, 7, 8])
+    ecu.stop()
+    bus.shutdown()
+
+    E = j1939.Tracer.Event
+    events = [(event, key) for _, event, key in tracer.records()]
+    assert events == [
+        (E.FRAME_RECEIVED, 0x18FEF101), (E.FRAME_CLASSIFIED, 0x18FEF101),
+        (E.PDU_DELIVERED, 0x18FEF101), (E.SUBSCRIBER_RETURNED, 0x18FEF101),
+        (E.FRAME_RECEIVED, 0x18ECFF01), (E.FRAME_CLASSIFIED, 0x18ECFF01),
+        (E.FRAME_RECEIVED, 0x1CEBFF01), (E.FRAME_CLASSIFIED, 0x1CEBFF01), (E.TP_SEGMENT_STORED, 0x1CEBFF01),
+        (E.FRAME_RECEIVED, 0x1CEBFF01), (E.FRAME_CLASSIFIED, 0x1CEBFF01), (E.TP_SEGMENT_STORED, 0x1CEBFF01),
+        (E.PDU_DELIVERED, 0x1CFEB001), (E.SUBSCRIBER_RETURNED, 0x1CFEB001),
+        (E.FRAME_QUEUED, 0x18FEF280), (E.FRAME_SENT, 0x18FEF280),
+    ]
+    times = [timestamp for timestamp, _, _ in tracer.records()]
+    assert times == sorted(times)
+
+    stages = tracer.stage_distributions()
+    assert stages['receive->classify']['count'] == 4
+    assert stages['classify->store']['count'] == 2
+    # the PDU of the TP session is not carried by a single frame
+    assert stages['classify->deliver']['count'] == 1
+    assert stages['deliver->return']['count'] == 2
+    assert stages['receive->return']['count'] == 1
+    assert stages['queue->send']['count'] == 1
+    assert 0 <= stages['receive->classify']['min'] <= stages['receive->classify']['p50'] <= stages['receive->classify']['max']
+
+    # the ring buffer keeps the latest records
+    tracer = j1939.Tracer(capacity=4)
+    for key in range(10):
+        tracer.record(E.FRAME_RECEIVED, key)
+    assert [key for _, _, key in tracer.records()] == [6, 7, 8, 9]
+    tracer.clear()
+    assert tracer.records() == []
+    tracer.record(E.FRAME_RECEIVED, 10)
+    assert [key for _, _, key in tracer.records()] == [10]
+
+    # PDUs returning out of order (e.g. subscriber workers) are paired by key
+    tracer = j1939.Tracer(capacity=8)
+    key_a = j1939.Tracer.pdu_key(6, 0xEF00, 0x01, 0x80)
+    key_b = j1939.Tracer.pdu_key(6, 0xFEF1, 0x02, 0xFF)
+    assert (key_a, key_b) == (0x18EF8001, 0x18FEF102)
+    for event, key in ((E.PDU_DELIVERED, key_a), (E.PDU_DELIVERED, key_b),
+                       (E.SUBSCRIBER_RETURNED, key_b), (E.SUBSCRIBER_RETURNED, key_a)):
+        tracer.record(event, key)
+    (deliver_a, _, _), (deliver_b, _, _), (return_b, _, _), (return_a, _, _) = tracer.records()
+    assert tracer.latencies(E.PDU_DELIVERED, E.SUBSCRIBER_RETURNED).tolist() == [return_b - deliver_b, return_a - deliver_a]
+
+    # batch-ingested frames are classified too
+    tracer = j1939.Tracer(capacity=64)
+    ecu = j1939.ElectronicControlUnit(tracer=tracer)
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: None)
+    ecu.notify_batch([0x18FEF101, 0x0CFEF202], [bytes(8), bytes(8)], [0.0, 0.0])
+    assert [(event, key) for _, event, key in tracer.records()] == [
+        (E.FRAME_CLASSIFIED, 0x18FEF101), (E.PDU_DELIVERED, 0x18FEF101), (E.SUBSCRIBER_RETURNED, 0x18FEF101),
+        (E.FRAME_CLASSIFIED, 0x0CFEF202), (E.PDU_DELIVERED, 0x0CFEF202), (E.SUBSCRIBER_RETURNED, 0x0CFEF202),
+    ]
+    assert tracer.stage_distributions()['classify->deliver']['count'] == 2
+    assert j1939.Tracer.distribution([])['count'] == 0
+
+def test_latest_values():
+    """
+    Test the latest value store: single frame and reassembled PDUs, counts and the PGN filter
+    """
+    assert j1939.ElectronicControlUnit(clock=j1939.VirtualClock()).latest_values is None
+    ecu = j1939.ElectronicControlUnit(clock=j1939.VirtualClock(), latest_values=True)
+    latest_values = ecu.latest_values
+    ecu.notify(0x18FEF101, bytearray([1, 2, 3, 4, 5, 6, 7, 8]), 1.0)
+    ecu.notify(0x18FEF101, bytearray([8, 7, 6, 5, 4, 3, 2, 1]), 2.0)
+    ecu.notify(0x18FEF102, bytearray([0] * 8), 2.5)
+    # BAM
+    ecu.notify(0x18ECFF01, bytearray([32, 9, 0, 2, 255, 0xB0, 0xFE, 0]), 3.0)
+    ecu.notify(0x1CEBFF01, bytearray([1, 1, 2, 3, 4, 5, 6, 7]), 3.1)
+    ecu.notify(0x1CEBFF01, bytearray([2, 8, 9, 255, 255, 255, 255, 255]), 3.2)
+
+    assert latest_values.get(0x01, 0xFEF1) == (2.0, 2, bytes([8, 7, 6, 5, 4, 3, 2, 1]))
+    assert latest_values.get(0x01, 0xFEB0) == (3.2, 1, bytes(range(1, 10)))
+    assert latest_values.get(0x03, 0xFEF1) is None
+    assert sorted(latest_values.snapshot()) == [(0x01, 0xFEB0), (0x01, 0xFEF1), (0x02, 0xFEF1)]
+    latest_values.clear()
+    assert latest_values.snapshot() == {}
+    ecu.stop()
+
+    ecu = j1939.ElectronicControlUnit(clock=j1939.VirtualClock(), latest_values=[0xFEB0])
+    ecu.notify(0x18FEF101, bytearray(8), 1.0)
+    assert ecu.latest_values.snapshot() == {}
+    ecu.stop()
+
+def test_latest_values_eom_ack():
+    """
+    Test that the EOM_ACK of a sent RTS/CTS transfer is not stored as received PDU of the receiver
+    """
+    sent = []
+    ecu = j1939.ElectronicControlUnit(clock=j1939.VirtualClock(), latest_values=True,
+                                      send_message=lambda can_id, extended_id, data, fd_format=False: sent.append(can_id))
+    eom_acks = []
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: eom_acks.append((pgn, sa)), device_address=0x80)
+    ecu.send_pgn(0, 0xEF, 0x90, 6, 0x80, bytes(20))
+    ecu.notify(0x1CEC8090, bytearray([17, 3, 1, 0xFF, 0xFF, 0x00, 0xEF, 0x00]), 0.0)    # TP.CM CTS
+    ecu.process_jobs()
+    ecu.notify(0x1CEC8090, bytearray([19, 20, 0, 3, 0xFF, 0x00, 0xEF, 0x00]), 0.0)     # TP.CM EOM_ACK
+    ecu.stop()
+
+    assert sent == [0x18EC9080, 0x1CEB9080, 0x1CEB9080, 0x1CEB9080]
+    assert eom_acks == [(0xEF00, 0x90)]
+    assert ecu.latest_values.get(0x90, 0xEF00) is None
+    assert ecu.latest_values.snapshot() == {}
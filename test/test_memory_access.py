@@ -261,6 +261,35 @@ def test_dm14_write(feeder, expected_messages):
     feeder.process_messages()
 
 
+def test_dm14_write_twice(feeder):
+    """
+    Tests two write queries with the same DM14 query, each DM15 is handled once
+    :param feeder: can message feeder
+    """
+    # the module level lists are consumed by the other tests
+    feeder.can_messages = 2 * [
+        (Feeder.MsgType.CANTX, 0x18D9D4F9, [0x01, 0x15, 0x07, 0x00, 0x00, 0x91, 0x07, 0x00], 0.0),  # DM14 write address 0x91000007
+        (Feeder.MsgType.CANRX, 0x18D8F9D4, [0x01, 0x11, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], 0.0),  # DM15 proceed response
+        (Feeder.MsgType.CANTX, 0x18D7D4F9, [0x04, 0x44, 0x33, 0x22, 0x11]                  , 0.0),  # DM16 data transfer
+        (Feeder.MsgType.CANRX, 0x18D8F9D4, [0x00, 0x19, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF], 0.0),  # DM15 operation completed
+        (Feeder.MsgType.CANTX, 0x18D9D4F9, [0x01, 0x19, 0x07, 0x00, 0x00, 0x91, 0xFF, 0xFF], 0.0),  # DM14 operation completed
+    ]
+    feeder.pdus_from_messages()
+
+    ca = feeder.accept_all_messages(
+        device_address_preferred=0xF9, bypass_address_claim=True
+    )
+
+    dm14 = j1939.Dm14Query(ca)
+    values = [0x11223344]
+    for _ in range(2):
+        dm14.write(0xD4, 1, 0x91000007, values, object_byte_size=4)
+        # the handlers are removed when the query is finished
+        assert all(dic["callback"] != dm14._parse_dm15 for dic in feeder.ecu._subscribers)
+
+    feeder.process_messages()
+
+
 def test_dm14_read_busy(
     feeder,
 ):
@@ -0,0 +1,24 @@
+import pytest
+
+import j1939
+
+
+@pytest.mark.parametrize('can_id', [0x18FEF101, 0x0CF00400, 0x18EC9B90, 0x1CEBFF01, 0x18EAFF00, 0x19FECA03, 0x1DEF20F9])
+def test_decode_can_id(can_id):
+    """Test decode_can_id against MessageId and ParameterGroupNumber"""
+    mid = j1939.MessageId(can_id=can_id)
+    pgn = j1939.ParameterGroupNumber()
+    pgn.from_message_id(mid)
+
+    priority, pgn_value, sa, da, is_pdu2 = j1939.decode_can_id(can_id)
+    assert priority == mid.priority
+    assert sa == mid.source_address
+    assert is_pdu2 == pgn.is_pdu2_format
+    if is_pdu2:
+        assert pgn_value == pgn.value
+        assert da == j1939.ParameterGroupNumber.Address.GLOBAL
+    else:
+        assert pgn_value == pgn.value & 0x1FF00
+        assert da == pgn.pdu_specific
+
+    assert j1939.MessageId.from_can_id(can_id).can_id == can_id
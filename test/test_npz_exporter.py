@@ -0,0 +1,40 @@
+import numpy as np
+import j1939
+
+
+def test_npz_exporter(tmp_path):
+    """
+    Test the columns of fixed and variable length payloads collected from an ECU and a stream
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    exporter = j1939.NpzExporter(ecu)
+    ecu.notify(0x18FEF101, bytearray([1, 2, 3, 4, 5, 6, 7, 8]), 100.0)
+    ecu.notify(0x18FEF102, bytearray([8, 7, 6, 5, 4, 3, 2, 1]), 100.1)
+    exporter.close()
+    ecu.stop()
+
+    frames = [
+        (100.2, 0x18FECA01, [0x00, 0xFF, 0x01, 0x02, 0x03, 0x04]),
+        (100.3, 0x18ECFF01, [32, 10, 0, 2, 255, 0xCA, 0xFE, 0]),       # TP.CM BAM of a DM1
+        (100.4, 0x1CEBFF01, [1, 0x00, 0xFF, 1, 2, 3, 4, 5]),
+        (100.5, 0x1CEBFF01, [2, 6, 7, 8, 255, 255, 255, 255]),
+    ]
+    assert exporter.add_stream(j1939.decode_stream((timestamp, can_id, bytes(data)) for timestamp, can_id, data in frames)) == 2
+    assert exporter.pgns() == [0xFECA, 0xFEF1]
+
+    arrays = exporter.arrays(0xFEF1)
+    assert arrays['timestamp'].tolist() == [100.0, 100.1]
+    assert arrays['sa'].tolist() == [0x01, 0x02]
+    assert arrays['da'].tolist() == [0xFF, 0xFF]
+    assert arrays['priority'].tolist() == [6, 6]
+    assert arrays['payload'].shape == (2, 8)
+    assert arrays['payload'][1].tolist() == [8, 7, 6, 5, 4, 3, 2, 1]
+
+    filenames = exporter.save(str(tmp_path / 'export'))
+    assert len(filenames) == 2
+    with np.load(filenames[0]) as dm1:
+        assert int(dm1['pgn']) == 0xFECA
+        assert 'payload' not in dm1
+        offsets, data = dm1['payload_offsets'], dm1['payload_data']
+        assert offsets.tolist() == [0, 6, 16]
+        assert data[offsets[1]:offsets[2]].tolist() == [0x00, 0xFF, 1, 2, 3, 4, 5, 6, 7, 8]
@@ -0,0 +1,47 @@
+import j1939
+
+
+def feed(ecu, frames):
+    for timestamp, can_id, data in frames:
+        ecu.notify(can_id, bytearray(data), timestamp)
+
+
+def test_pdu_recorder(tmp_path):
+    """
+    Test recording of single frame and reassembled PDUs, the selection by time and PGN and continuing a recording
+    """
+    filename = str(tmp_path / 'pdus.bin')
+    clock = j1939.VirtualClock(100.0)
+    ecu = j1939.ElectronicControlUnit(clock=clock, send_message=lambda *args, **kwargs: None)
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: None, device_address=0x02)
+    recorder = j1939.PduRecorder(ecu, filename, batch_size=2, flush_interval=0)
+    feed(ecu, [
+        (100.00, 0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8]),                # single frame
+        (100.10, 0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),       # TP.CM BAM
+        (100.15, 0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),                # TP.DT 1
+        (100.20, 0x1CEBFF01, [2, 8, 9, 255, 255, 255, 255, 255]),      # TP.DT 2
+        (100.30, 0x18EF0203, [0xAA, 0xBB]),                            # peer-to-peer to 0x02
+    ])
+    # the third record is kept in memory until the next batch
+    assert recorder.records == 2
+    recorder.close()
+    assert recorder.records == 3
+
+    recorder = j1939.PduRecorder(ecu, filename, flush_interval=0)
+    feed(ecu, [(101.00, 0x18FEF101, [8, 7, 6, 5, 4, 3, 2, 1])])
+    recorder.close()
+    ecu.stop()
+
+    reader = j1939.PduReader(filename)
+    assert len(reader) == 4
+    assert [(timestamp, priority, pgn, sa, da, list(payload)) for timestamp, priority, pgn, sa, da, payload in reader.records()] == [
+        (100.00, 6, 0xFEF1, 0x01, 0xFF, [1, 2, 3, 4, 5, 6, 7, 8]),
+        (100.20, 7, 0xFEB0, 0x01, 0xFF, [1, 2, 3, 4, 5, 6, 7, 8, 9]),
+        (100.30, 6, 0xEF00, 0x03, 0x02, [0xAA, 0xBB]),
+        (101.00, 6, 0xFEF1, 0x01, 0xFF, [8, 7, 6, 5, 4, 3, 2, 1]),
+    ]
+    assert reader.select(pgns=0xFEF1).tolist() == [0, 3]
+    assert reader.select(start=100.1, end=101.0).tolist() == [1, 2]
+    assert reader.select(start=100.1, pgns=[0xFEF1, 0xEF00]).tolist() == [2, 3]
+    assert list(reader.index['sa']) == [0x01, 0x01, 0x03, 0x01]
+    reader.close()
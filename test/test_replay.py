@@ -0,0 +1,87 @@
+import time
+
+import can
+import pytest
+import j1939
+
+# BAM session timed out between its data transfers, a complete BAM session and a single frame message
+LOG = [
+    (100.00, 0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),       # TP.CM BAM
+    (100.05, 0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),                # TP.DT 1
+    (101.00, 0x1CEBFF01, [2, 8, 9, 255, 255, 255, 255, 255]),      # TP.DT 2 after T1
+    (102.00, 0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),       # TP.CM BAM
+    (102.05, 0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),                # TP.DT 1
+    (102.10, 0x1CEBFF01, [2, 8, 9, 255, 255, 255, 255, 255]),      # TP.DT 2
+    (103.00, 0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8]),                # single frame
+]
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    filename = str(tmp_path / 'replay.log')
+    with can.Logger(filename) as logger:
+        for timestamp, can_id, data in LOG:
+            logger.on_message_received(can.Message(timestamp=timestamp, arbitration_id=can_id, data=data, is_extended_id=True, channel='can0'))
+    return filename
+
+
+def replay(ecu, log_file, **kwargs):
+    received = []
+    ecu.subscribe(lambda priority, pgn, sa, timestamp, data: received.append((pgn, timestamp, list(data))))
+    assert j1939.LogReplay(ecu, log_file, **kwargs).run() == len(LOG)
+    ecu.stop()
+    return received
+
+
+def test_replay_virtual_clock(log_file):
+    """
+    Test that the transport protocol timeouts follow the time of the log when replaying at full speed
+    """
+    clock = j1939.VirtualClock()
+    ecu = j1939.ElectronicControlUnit(clock=clock, send_message=lambda *args, **kwargs: None)
+    start = time.perf_counter()
+    received = replay(ecu, log_file)
+    assert time.perf_counter() - start < 0.75
+    assert received == [
+        (0xFEB0, pytest.approx(102.10), [1, 2, 3, 4, 5, 6, 7, 8, 9]),
+        (0xFEF1, pytest.approx(103.00), [1, 2, 3, 4, 5, 6, 7, 8]),
+    ]
+    assert clock() == pytest.approx(103.00)
+    assert ecu.stats()['tp']['timeouts'] == 1
+
+
+def test_replay_realtime(log_file):
+    """
+    Test the replay paced to the wall clock
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    start = time.perf_counter()
+    received = replay(ecu, log_file, realtime=True, speed=1.25)
+    assert time.perf_counter() - start >= 3.0 / 1.25 - 0.05
+    assert [pgn for pgn, _, _ in received] == [0xFEB0, 0xFEF1]
+
+
+def test_replay_requires_virtual_clock():
+    ecu = j1939.ElectronicControlUnit()
+    with pytest.raises(ValueError):
+        j1939.LogReplay(ecu, [])
+    ecu.stop()
+
+
+def test_virtual_clock_timer():
+    """
+    Test that timer events follow the virtual clock and skip the events missed by a jump
+    """
+    clock = j1939.VirtualClock(10.0)
+    ecu = j1939.ElectronicControlUnit(clock=clock)
+    calls = []
+    ecu.add_timer(0.1, lambda cookie: calls.append(clock()) or True)
+    ecu.process_jobs()
+    assert calls == []
+    clock.advance(10.1)
+    ecu.process_jobs()
+    clock.advance(1e9)
+    ecu.process_jobs()
+    ecu.process_jobs()
+    assert calls == [10.1, 1e9]
+    ecu.stop()
@@ -0,0 +1,96 @@
+import json
+
+import numpy as np
+import pytest
+import j1939
+
+DEFINITION = {
+    'pgns': [
+        {
+            'pgn': 0xF004,
+            'name': 'EEC1',
+            'spns': [
+                {'name': 'EngineTorqueMode', 'spn': 899, 'start_bit': 0, 'length': 4},
+                {'name': 'DriversDemandTorque', 'spn': 512, 'start_bit': 8, 'length': 8, 'scale': 1, 'offset': -125, 'unit': '%'},
+                {'name': 'EngineSpeed', 'spn': 190, 'start_bit': 24, 'length': 16, 'scale': 0.125, 'unit': 'rpm'},
+                {'name': 'StarterMode', 'spn': 1675, 'start_bit': 48, 'length': 4},
+            ],
+        },
+    ],
+}
+
+YAML = """
+pgns:
+  - pgn: 0xF004
+    name: EEC1
+    spns:
+      - {name: EngineTorqueMode, spn: 899, start_bit: 0, length: 4}
+      - {name: DriversDemandTorque, spn: 512, start_bit: 8, length: 8, scale: 1, offset: -125, unit: '%'}
+      - {name: EngineSpeed, spn: 190, start_bit: 24, length: 16, scale: 0.125, unit: rpm}
+      - {name: StarterMode, spn: 1675, start_bit: 48, length: 4}
+"""
+
+PAYLOADS = [
+    [0xF1, 0xA5, 0xFF, 0x40, 0x1F, 0xFF, 0xF0, 0xFF],   # 1000 rpm
+    [0xF2, 0xFE, 0xFF, 0x00, 0xFE, 0xFF, 0xFF, 0xFF],   # torque and speed in error, starter mode not available
+    [0xF3, 0xFB, 0xFF, 0xFF, 0xFF, 0xFF, 0xFE, 0xFF],   # torque reserved, speed not available, starter mode in error
+]
+
+
+@pytest.mark.parametrize('extension, content', [('json', json.dumps(DEFINITION)), ('yaml', YAML)])
+def test_load(tmp_path, extension, content):
+    """
+    Test loading a definition from JSON and YAML
+    """
+    filename = tmp_path / ('signals.' + extension)
+    filename.write_text(content)
+    db = j1939.SignalDatabase.load(str(filename))
+    assert db.pgns() == [0xF004]
+    assert db[0xF004].name == 'EEC1'
+    assert [spn.spn for spn in db[0xF004].spns] == [899, 512, 190, 1675]
+
+
+def test_decode():
+    """
+    Test the single payload and the matrix decoder with the ranges of ControllerApplication.FieldValue
+    """
+    db = j1939.SignalDatabase.from_dict(DEFINITION)
+    assert db.decode(0xF004, PAYLOADS[0]) == {'EngineTorqueMode': 1, 'DriversDemandTorque': 40, 'EngineSpeed': 1000.0, 'StarterMode': 0}
+    assert db.decode(0xF004, PAYLOADS[1]) == {'EngineTorqueMode': 2, 'DriversDemandTorque': None, 'EngineSpeed': None, 'StarterMode': None}
+    # missing bytes are not available
+    assert db.decode(0xF004, PAYLOADS[0][:4])['EngineSpeed'] is None
+
+    values, status = db.decode_matrix(0xF004, np.array(PAYLOADS, dtype=np.uint8), status=True)
+    Status = j1939.SpnDefinition.Status
+    assert values['EngineTorqueMode'].tolist() == [1, 2, 3]
+    assert values['EngineSpeed'][0] == 1000.0
+    assert np.isnan(values['EngineSpeed'][1:]).all()
+    assert status['EngineSpeed'].tolist() == [Status.VALID, Status.ERROR, Status.NOT_AVAILABLE]
+    assert status['DriversDemandTorque'].tolist() == [Status.VALID, Status.ERROR, Status.RESERVED]
+    assert status['StarterMode'].tolist() == [Status.VALID, Status.NOT_AVAILABLE, Status.ERROR]
+
+    # the single payload and the matrix decoder agree on random payloads
+    payloads = np.random.default_rng(1).integers(0, 256, size=(200, 8), dtype=np.uint8)
+    matrix = db.decode_matrix(0xF004, payloads)
+    for i, payload in enumerate(payloads.tolist()):
+        for name, value in db.decode(0xF004, payload).items():
+            if value is None:
+                assert np.isnan(matrix[name][i])
+            else:
+                assert matrix[name][i] == value
+
+
+def test_long_payload():
+    """
+    Test SPNs behind the first 8 bytes of a transport protocol payload
+    """
+    definition = j1939.PgnDefinition(0xFECA, [
+        j1939.SpnDefinition('Lamps', 0, 16, valid_max=0xFFFF, error_min=0x10000, not_available_min=0x10000),
+        j1939.SpnDefinition('Spn', 16, 19),
+        j1939.SpnDefinition('Fmi', 40, 5),
+        j1939.SpnDefinition('Oc', 64, 7),
+    ])
+    payload = (0xFF40 | (1234 << 16) | (5 << 40) | (99 << 64)).to_bytes(10, 'little')
+    assert definition.decode(payload) == {'Lamps': 0xFF40, 'Spn': 1234, 'Fmi': 5, 'Oc': 99}
+    values = definition.decode_matrix(np.frombuffer(payload, dtype=np.uint8).reshape(1, 10))
+    assert {name: value.tolist() for name, value in values.items()} == {'Lamps': [0xFF40], 'Spn': [1234], 'Fmi': [5], 'Oc': [99]}
@@ -0,0 +1,158 @@
+import os
+
+import pytest
+
+import j1939
+import j1939.stream_decoder
+
+PAYLOAD = list(range(20))
+
+
+def tp_dt_frames(timestamp, can_id, payload, first, last, start=1, offset=0):
+    """TP.DT or ETP.DT frames with the packets first..last (1-based), the sequence numbers start at start"""
+    frames = []
+    for packet in range(first, last + 1):
+        chunk = payload[(offset + packet - 1) * 7:(offset + packet) * 7]
+        frames.append((timestamp, can_id, [start + packet - first] + chunk + [255] * (7 - len(chunk))))
+        timestamp += 0.01
+    return frames
+
+
+def test_bam_and_single_frames():
+    """
+    Test the reassembly of a BAM, a timed out BAM and the delivery of single frames
+    """
+    frames = [
+        (100.00, 0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),       # TP.CM BAM
+        (100.05, 0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),                # TP.DT 1
+        (101.00, 0x1CEBFF01, [2, 8, 9, 255, 255, 255, 255, 255]),      # TP.DT 2 after T1
+        (102.00, 0x18ECFF01, [32, 9, 0, 2, 255, 0xB0, 0xFE, 0]),       # TP.CM BAM
+        (102.05, 0x1CEBFF01, [1, 1, 2, 3, 4, 5, 6, 7]),                # TP.DT 1
+        (102.08, 0x18EA0102, [0xB0, 0xFE, 0]),                         # request to 0x01
+        (102.10, 0x1CEBFF01, [2, 8, 9, 255, 255, 255, 255, 255]),      # TP.DT 2
+        (103.00, 0x18FEF101, [1, 2, 3, 4, 5, 6, 7, 8]),                # single frame
+    ]
+    pdus = [(timestamp, priority, pgn, sa, da, list(payload)) for timestamp, priority, pgn, sa, da, payload in j1939.decode_stream(frames)]
+    assert pdus == [
+        (102.08, 6, 0xEA00, 0x02, 0x01, [0xB0, 0xFE, 0]),
+        (102.10, 7, 0xFEB0, 0x01, 0xFF, [1, 2, 3, 4, 5, 6, 7, 8, 9]),
+        (103.00, 6, 0xFEF1, 0x01, 0xFF, [1, 2, 3, 4, 5, 6, 7, 8]),
+    ]
+
+    # without timeouts the late TP.DT completes the first session
+    assert [pdu[0] for pdu in j1939.decode_stream(frames, timeouts=False)] == [101.00, 102.08, 102.10, 103.00]
+
+
+def test_rts_cts():
+    """
+    Test the reassembly of a RTS/CTS session with a repeated packet and a hold
+    """
+    frames = [(0.0, 0x1CEC0201, [16, 20, 0, 3, 2, 0x00, 0xEF, 0])]          # TP.CM RTS
+    frames += [(0.01, 0x1CEC0102, [17, 2, 1, 255, 255, 0x00, 0xEF, 0])]     # TP.CM CTS 2 packets from 1
+    frames += tp_dt_frames(0.02, 0x1CEB0201, PAYLOAD, 1, 2)
+    frames += [(0.05, 0x1CEC0102, [17, 0, 255, 255, 255, 0x00, 0xEF, 0])]   # TP.CM CTS hold
+    frames += [(0.50, 0x1CEC0102, [17, 2, 2, 255, 255, 0x00, 0xEF, 0])]     # TP.CM CTS repeat packet 2
+    frames += tp_dt_frames(0.51, 0x1CEB0201, PAYLOAD, 2, 3, start=2)
+    frames += [(0.60, 0x1CEC0102, [19, 20, 0, 3, 255, 0x00, 0xEF, 0])]      # TP.CM EOM_ACK
+    pdus = list(j1939.decode_stream(frames))
+    assert len(pdus) == 1
+    timestamp, priority, pgn, sa, da, payload = pdus[0]
+    assert (timestamp, priority, pgn, sa, da) == (0.52, 7, 0xEF00, 0x01, 0x02)
+    assert list(payload) == PAYLOAD
+
+    # a missing packet drops the session
+    incomplete = [frame for frame in frames if frame[2][0] != 1 or frame[1] != 0x1CEB0201]
+    assert list(j1939.decode_stream(incomplete)) == []
+
+
+def test_etp():
+    """
+    Test the reassembly of an ETP session with two data packet offsets
+    """
+    payload = [i & 0xFF for i in range(2000)]
+    num_packets = (len(payload) + 6) // 7
+    size = len(payload).to_bytes(4, 'little')
+    frames = [(0.0, 0x1CC80201, [20, *size, 0x00, 0xEF, 0])]                                # ETP.CM RTS
+    frames += [(0.01, 0x1CC80102, [21, 255, 1, 0, 0, 0x00, 0xEF, 0])]                       # ETP.CM CTS
+    frames += [(0.02, 0x1CC80201, [22, 255, 0, 0, 0, 0x00, 0xEF, 0])]                       # ETP.CM DPO
+    frames += tp_dt_frames(0.03, 0x1CC70201, payload, 1, 255)
+    frames += [(3.0, 0x1CC80102, [21, num_packets - 255, 0, 1, 0, 0x00, 0xEF, 0])]          # ETP.CM CTS
+    frames += [(3.01, 0x1CC80201, [22, num_packets - 255, 255, 0, 0, 0x00, 0xEF, 0])]       # ETP.CM DPO
+    frames += tp_dt_frames(3.02, 0x1CC70201, payload, 1, num_packets - 255, offset=255)
+    frames += [(4.0, 0x1CC80102, [23, *size, 0x00, 0xEF, 0])]                               # ETP.CM EOM_ACK
+    pdus = list(j1939.decode_stream(frames))
+    assert [pdu[2:5] for pdu in pdus] == [(0xEF00, 0x01, 0x02)]
+    assert list(pdus[0][5]) == payload
+
+
+def test_fd_tp_and_multi_pg():
+    """
+    Test the reassembly of a FD-TP BAM and the c-PGs of a multi-PG frame
+    """
+    payload = list(range(100))
+    session = 3 << 4
+    frames = [
+        (0.0, 0x1C4DFF01, [session | 4, 100, 0, 0, 2, 0, 0, 0xFF, 0, 0x00, 0xFF, 0]),     # FD.TP.CM BAM
+        (0.01, 0x1C4EFF01, [session, 1, 0, 0] + payload[:60]),                           # FD.TP.DT 1
+        (0.02, 0x1C4EFF01, [session, 2, 0, 0] + payload[60:] + [255] * 4),               # FD.TP.DT 2
+        (0.03, 0x1C4DFF01, [session | 2, 100, 0, 0, 2, 0, 0, 0, 0, 0x00, 0xFF, 0]),      # FD.TP.CM EOM_STATUS
+        (0.04, 0x1825FF01, [0x43, 0xF0, 0x04, 2, 1, 2,                                   # c-PG 0x3F004
+                            0x40, 0xFE, 0xF1, 3, 3, 4, 5,                                # c-PG 0xFEF1
+                            0, 0, 0, 0xAA, 0xAA, 0xAA]),                                 # padding
+    ]
+    pdus = [(timestamp, priority, pgn, sa, da, list(payload)) for timestamp, priority, pgn, sa, da, payload in j1939.decode_stream(frames)]
+    assert pdus == [
+        (0.03, 7, 0xFF00, 0x01, 0xFF, payload),
+        (0.04, 6, 0x3F004, 0x01, 0xFF, [1, 2]),
+        (0.04, 6, 0xFEF1, 0x01, 0xFF, [3, 4, 5]),
+    ]
+
+
+def test_parallel():
+    """
+    Test that decoding with several processes delivers the same PDUs in the same order
+    """
+    frames = []
+    for session in range(30):
+        timestamp = session * 0.001
+        src_address = 0x10 + session % 7
+        dest_address = 0x20 + session % 5
+        # interleaved RTS/CTS and BAM sessions, aborted sessions and single frames
+        frames += [(timestamp, 0x1CEC0000 | (dest_address << 8) | src_address, [16, 20, 0, 3, 3, session, 0xEF, 0])]
+        frames += [(timestamp + 0.1, 0x1CEC0000 | (src_address << 8) | dest_address, [17, 3, 1, 255, 255, session, 0xEF, 0])]
+        frames += tp_dt_frames(timestamp + 0.2, 0x1CEB0000 | (dest_address << 8) | src_address, [session] * 20, 1, 3)
+        frames += [(timestamp + 0.4, 0x18ECFF40 + session, [32, 9, 0, 2, 255, session, 0xFE, 0])]
+        frames += tp_dt_frames(timestamp + 0.5, 0x1CEBFF40 + session, [session] * 9, 1, 2)
+        if session % 3 == 0:
+            # the receiver aborts the next session of the originator
+            frames += [(timestamp + 0.7, 0x1CEC0000 | (dest_address << 8) | src_address, [16, 20, 0, 3, 3, session, 0xEE, 0])]
+            frames += [(timestamp + 0.8, 0x1CEC0000 | (src_address << 8) | dest_address, [255, 1, 255, 255, 255, session, 0xEE, 0])]
+            frames += tp_dt_frames(timestamp + 0.9, 0x1CEB0000 | (dest_address << 8) | src_address, [session] * 20, 1, 3)
+        frames += [(timestamp + 0.6, 0x18FEF100 | src_address, [session] * 8)]
+    frames.sort(key=lambda frame: frame[0])
+
+    def decode(**kwargs):
+        return [(timestamp, priority, pgn, sa, da, list(payload)) for timestamp, priority, pgn, sa, da, payload in j1939.decode_stream(frames, **kwargs)]
+
+    expected = decode()
+    assert len(expected) == 30 * 3
+    assert decode(processes=3, batch_size=17) == expected
+
+
+def _exiting_worker(tasks, results, timeouts):
+    os._exit(3)
+
+
+def test_parallel_worker_failure(monkeypatch):
+    """
+    Test that decoding with several processes raises instead of waiting when a worker fails
+    """
+    frames = [(0.0, 0x18FEF101, [1, 2, 3]), (0.1, 0x1CEBFF01, None)]
+    # the exception of the worker decoding the malformed frame is raised again
+    with pytest.raises(TypeError):
+        list(j1939.decode_stream(frames, processes=2))
+
+    # a worker exiting without a result
+    monkeypatch.setattr(j1939.stream_decoder, '_decode_worker', _exiting_worker)
+    with pytest.raises(RuntimeError, match='exit code 3'):
+        list(j1939.decode_stream(frames, processes=2))
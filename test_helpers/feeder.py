@@ -75,7 +75,7 @@ class Feeder:
         expected_data = self.can_messages.pop(0)
         assert expected_data[0] == Feeder.MsgType.CANTX
         assert can_id == expected_data[1]
-        assert data == expected_data[2]
+        assert list(data) == expected_data[2]
         self._inject_messages_into_ecu()
 
     def _on_message(self, priority, pgn, sa, timestamp, data):
@@ -98,8 +98,8 @@ class Feeder:
         expected_data = self.pdus.pop(0)
         assert expected_data[0] == Feeder.MsgType.PDU
         assert pgn == expected_data[1]
-        if isinstance(data, list):
-            assert data == expected_data[2]
+        if isinstance(data, (list, bytes, bytearray, memoryview)):
+            assert list(data) == expected_data[2]
         else:
             assert data is None
 